@@ -9,7 +9,7 @@ PtoM - PDF to Markdown Converter
 3. 自动优化Markdown文档（移除页面标记、优化代码块、修复格式等）
 
 使用方法：
-    python PtoM.py <PDF文件> [输出文件]
+    python PtoM.py <PDF文件> [输出文件] [选项]
     
 如果不指定输出文件，将自动生成（原文件名.md）
 """
@@ -17,6 +17,13 @@ PtoM - PDF to Markdown Converter
 import re
 import sys
 import os
+import time
+import mmap
+import json
+import tempfile
+import operator
+import hashlib
+from array import array
 
 
 def print_banner():
@@ -41,15 +48,320 @@ def print_banner():
     print(banner)
 
 
+def write_text_atomic(path, content, encoding='utf-8'):
+    """原子写入文本文件：先写同目录下的临时文件，再重命名覆盖目标文件"""
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(prefix='.ptom-', suffix='.tmp', dir=directory)
+    try:
+        with os.fdopen(fd, 'w', encoding=encoding) as f:
+            f.write(content)
+            f.flush()
+            os.fsync(f.fileno())
+        # mkstemp创建的文件权限为0600，改为与普通新建文件一致
+        if os.path.exists(path):
+            mode = os.stat(path).st_mode & 0o777
+        else:
+            umask = os.umask(0)
+            os.umask(umask)
+            mode = 0o666 & ~umask
+        os.chmod(tmp_path, mode)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+def file_has_content(path, data):
+    """已有文件的内容是否与data（bytes）完全相同（先比较大小）"""
+    try:
+        if os.path.getsize(path) != len(data):
+            return False
+        with open(path, 'rb') as f:
+            return f.read() == data
+    except OSError:
+        return False
+
+
+def write_text_if_changed(path, content, encoding='utf-8'):
+    """内容有变化时才原子写入文本文件（不改动内容相同的文件，避免同步工具重复传输），返回是否写入"""
+    if file_has_content(path, content.encode(encoding)):
+        return False
+    write_text_atomic(path, content, encoding=encoding)
+    return True
+
+
+class PDFSource:
+    """PDF输入源：只对文件做一次内存映射，pdfplumber和PyMuPDF共享同一缓冲区
+    
+    内存映射的页面由操作系统按需换入（按字节范围读取），不会把整个文件读入进程内存；
+    分块处理时可调用 release_pages() 让系统回收已访问过的映射页面。
+    """
+    
+    def __init__(self, pdf_path, use_mmap=True):
+        self.pdf_path = pdf_path
+        self.use_mmap = use_mmap
+        self._file = None
+        self._mmap = None
+        self._views = []
+    
+    def __enter__(self):
+        self.open()
+        return self
+    
+    def __exit__(self, exc_type, exc_value, tb):
+        self.close()
+    
+    def open(self):
+        """打开并映射文件（映射失败时回退为按路径打开）"""
+        if not self.use_mmap or self._mmap is not None:
+            return
+        try:
+            self._file = open(self.pdf_path, 'rb')
+            self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError) as e:
+            # 空文件或不支持映射的文件系统
+            print(f"提示: 无法内存映射PDF，改为按路径读取: {e}")
+            if self._file:
+                self._file.close()
+            self._file = None
+            self._mmap = None
+    
+    def close(self):
+        """释放映射和文件句柄"""
+        for view in self._views:
+            try:
+                view.release()
+            except BufferError:
+                pass  # 仍被PyMuPDF文档引用，交给垃圾回收
+        self._views = []
+        if self._mmap is not None:
+            try:
+                self._mmap.close()
+            except BufferError:
+                pass
+            self._mmap = None
+        if self._file:
+            self._file.close()
+            self._file = None
+    
+    def open_pdfplumber(self, pdfplumber, pages=None):
+        """使用共享缓冲区打开pdfplumber文档（pages为1-based页码列表）"""
+        if self._mmap is not None:
+            self._mmap.seek(0)
+            return pdfplumber.open(self._mmap, pages=pages)
+        return pdfplumber.open(self.pdf_path, pages=pages)
+    
+    def open_fitz(self, fitz):
+        """使用共享缓冲区打开PyMuPDF文档（零拷贝）"""
+        if self._mmap is not None:
+            view = memoryview(self._mmap)
+            try:
+                doc = fitz.open(stream=view, filetype='pdf')
+                self._views.append(view)
+                return doc
+            except TypeError:
+                # 旧版PyMuPDF不支持memoryview，按路径打开以避免整文件拷贝
+                view.release()
+        return fitz.open(self.pdf_path)
+    
+    def release_pages(self):
+        """提示操作系统回收已访问的映射页面，控制常驻内存"""
+        if self._mmap is not None and hasattr(self._mmap, 'madvise') and hasattr(mmap, 'MADV_DONTNEED'):
+            try:
+                self._mmap.madvise(mmap.MADV_DONTNEED)
+            except OSError:
+                pass
+
+
+class ProgressReporter:
+    """转换进度报告：吞吐量（页/字符/图片每秒）、预计剩余时间和各阶段耗时
+    
+    mode:
+        text   人类可读的进度行（带文档名前缀，便于区分并行转换的输出）
+        json   每个事件一行JSON，写入stderr，供编排系统解析
+        quiet  不输出
+    callback: 每个事件都会以字典形式回调，供库调用方使用
+    
+    转换过程中的提示信息（提取到的图片、页眉页脚、结束时的汇总等）也通过 message() 输出：
+    text 模式原样打印，json 模式写为 event 为 message 的一行JSON，quiet 模式不输出。
+    """
+    
+    MODES = ('text', 'json', 'quiet')
+    STAGE_NAMES = {'images': '图片', 'text': '文本', 'tables': '表格'}
+    
+    def __init__(self, mode='text', callback=None, interval=10, stream=None):
+        if mode not in self.MODES:
+            raise ValueError(f"不支持的进度模式: {mode}（可选: {', '.join(self.MODES)}）")
+        self.mode = mode
+        self.callback = callback
+        self.interval = interval  # text模式下每隔多少页输出一次
+        self.stream = stream
+        self.document = None
+        self.total_pages = 0
+        self.start_page = 1
+        self.current_page = 0
+        self.pages_done = 0
+        self.chars = 0
+        self.images = 0
+        self.stages = {}
+        self.start_time = None
+    
+    def start(self, document, total_pages, start_page=1):
+        """开始转换一个文档"""
+        self.document = document
+        self.total_pages = total_pages
+        self.start_page = start_page
+        self.current_page = start_page - 1
+        self.pages_done = 0
+        self.chars = 0
+        self.images = 0
+        self.stages = {}
+        self.start_time = time.perf_counter()
+        self._emit('start')
+    
+    def page_done(self, page):
+        """记录一个已完成的页面"""
+        self.current_page = page.page_num
+        self.pages_done += 1
+        self.chars += len(page.text) + sum(len(cell) for rows in page.tables for row in rows for cell in row)
+        self.images += len(page.images)
+        for stage, seconds in page.timings.items():
+            if stage != 'total':
+                self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+        self._emit('page')
+    
+    def finish(self):
+        """文档转换结束"""
+        self._emit('finish')
+    
+    def message(self, text):
+        """输出一条提示信息（不回调callback）"""
+        if self.mode == 'json':
+            stream = self.stream or sys.stderr
+            stream.write(json.dumps({'event': 'message', 'document': self.document, 'message': text},
+                                    ensure_ascii=False) + '\n')
+            stream.flush()
+        elif self.mode == 'text':
+            print(text, file=self.stream or sys.stdout, flush=True)
+    
+    def snapshot(self, event='page'):
+        """当前进度的字典表示"""
+        elapsed = time.perf_counter() - self.start_time if self.start_time else 0.0
+        remaining = max(self.total_pages - self.current_page, 0)
+        pages_per_sec = self.pages_done / elapsed if elapsed > 0 else 0.0
+        return {
+            'event': event,
+            'document': self.document,
+            'page': self.current_page,
+            'total_pages': self.total_pages,
+            'pages_done': self.pages_done,
+            'elapsed': round(elapsed, 3),
+            'pages_per_sec': round(pages_per_sec, 3),
+            'chars_per_sec': round(self.chars / elapsed, 1) if elapsed > 0 else 0.0,
+            'images_per_sec': round(self.images / elapsed, 3) if elapsed > 0 else 0.0,
+            'eta': round(remaining / pages_per_sec, 1) if pages_per_sec > 0 else None,
+            'stages': {stage: round(seconds, 3) for stage, seconds in self.stages.items()},
+        }
+    
+    def _emit(self, event):
+        info = self.snapshot(event)
+        if self.callback:
+            self.callback(info)
+        if self.mode == 'json':
+            stream = self.stream or sys.stderr
+            stream.write(json.dumps(info, ensure_ascii=False) + '\n')
+            stream.flush()
+        elif self.mode == 'text':
+            self._print_text(info)
+    
+    @staticmethod
+    def _format_seconds(seconds):
+        if seconds is None:
+            return '--:--'
+        minutes, secs = divmod(int(seconds), 60)
+        hours, minutes = divmod(minutes, 60)
+        return f"{hours}:{minutes:02d}:{secs:02d}" if hours else f"{minutes:02d}:{secs:02d}"
+    
+    def _print_text(self, info):
+        name = os.path.basename(info['document']) if info['document'] else ''
+        prefix = f"[{name}] " if name else ''
+        stream = self.stream or sys.stdout
+        if info['event'] == 'start':
+            return
+        if info['event'] == 'page':
+            page = info['page']
+            if page % self.interval != 0 and page != self.start_page and page != self.total_pages:
+                return
+            line = (f"{prefix}处理第 {page}/{info['total_pages']} 页 | "
+                    f"{info['pages_per_sec']:.1f} 页/秒 | {info['chars_per_sec']:.0f} 字符/秒 | "
+                    f"{info['images_per_sec']:.1f} 图片/秒 | 预计剩余 {self._format_seconds(info['eta'])}")
+        else:
+            stages = '，'.join(f"{self.STAGE_NAMES.get(stage, stage)} {seconds:.2f}秒"
+                              for stage, seconds in info['stages'].items())
+            line = (f"{prefix}✓ 本次处理 {info['pages_done']} 页，用时 {info['elapsed']:.2f} 秒"
+                    f"（{info['pages_per_sec']:.1f} 页/秒）")
+            if stages:
+                line += f"；各阶段: {stages}"
+        print(line, file=stream, flush=True)
+
+
 class PDFToMarkdownConverter:
     """PDF转Markdown转换器"""
     
-    def __init__(self, output_dir=None, output_file=None):
+    ENGINES = ('pdfplumber', 'pymupdf')
+    
+    # 异步接口共享的线程池大小：所有并发转换的页面任务都在这几个线程中排队，线程数不随请求数增长
+    ASYNC_WORKERS = min(4, os.cpu_count() or 1)
+    _async_executor = None
+    
+    PREVIEW_FIRST_PAGES = 3  # 预览包含的开头页数
+    PREVIEW_SAMPLE_PAGES = 7  # 预览在其余页面中均匀抽样的页数
+    
+    def __init__(self, output_dir=None, output_file=None, use_mmap=True, chunk_pages=None, engine='pdfplumber',
+                 progress=None, table_precheck=True, detect_scans=True, scan_dpi=None, strip_headers=False,
+                 min_image_size=8, min_image_bytes=128, skip_unchanged_images=False):
         self.output_dir = output_dir
         self.output_file = output_file  # Markdown输出文件路径
+        self.use_mmap = use_mmap  # 是否内存映射PDF并在两个解析库之间共享
+        self.chunk_pages = chunk_pages  # 每处理多少页关闭并重新打开文档（None表示不分块）
         self.images_dir = None
         self.image_counter = 0
+        self.progress = progress if progress is not None else ProgressReporter()  # 进度报告
+        self.table_precheck = table_precheck  # 是否先检查页面有无表格线再做表格识别
+        self.table_pages_checked = 0
+        self.table_pages_skipped = 0
+        self.detect_scans = detect_scans  # 是否识别扫描页/空白页并跳过文本和表格分析
+        self.scan_dpi = scan_dpi  # 扫描页渲染分辨率（None表示保存原始扫描图）
+        self.page_types = {}  # 各类页面计数
+        self.strip_headers = strip_headers  # 是否先学习页眉页脚区域，提取文本前裁掉
+        self.page_bands = None  # 学习到的页眉页脚区域
+        self.open_table_columns = None  # 上一页最后一个表格延伸到页面底部时的列数（可能在下一页继续）
+        self.min_image_size = min_image_size  # 宽或高小于该像素数的图片视为装饰图片（0表示不限制）
+        self.min_image_bytes = min_image_bytes  # 原始数据流小于该字节数的图片视为装饰图片（0表示不限制）
+        self.images_skipped = 0
+        self.skip_unchanged_images = skip_unchanged_images  # 已有图片文件内容相同时不重写
+        if engine not in self.ENGINES:
+            raise ValueError(f"不支持的解析引擎: {engine}（可选: {', '.join(self.ENGINES)}）")
         self.check_dependencies()
+        if engine == 'pymupdf' and not self.has_fitz:
+            print("提示: 未安装PyMuPDF，无法使用pymupdf引擎，改用pdfplumber。安装: pip install PyMuPDF")
+            engine = 'pdfplumber'
+        self.engine = engine  # 解析引擎：pdfplumber（文本/表格）+ PyMuPDF（图片），或全部使用PyMuPDF
+    
+    def output_options(self):
+        """影响转换结果的参数（检查点只在这些参数相同时继续）"""
+        return {
+            'engine': self.engine,
+            'table_precheck': self.table_precheck,
+            'detect_scans': self.detect_scans,
+            'scan_dpi': self.scan_dpi,
+            'strip_headers': self.strip_headers,
+            'min_image_size': self.min_image_size,
+            'min_image_bytes': self.min_image_bytes,
+        }
     
     def check_dependencies(self):
         """检查依赖库"""
@@ -99,6 +411,85 @@ class PDFToMarkdownConverter:
         
         return self.images_dir
     
+    def relative_image_path(self, image_path, output_file=None):
+        """生成图片的相对路径（用于Markdown）"""
+        # 相对于输出Markdown文件所在目录
+        if output_file:
+            output_dir = os.path.dirname(os.path.abspath(output_file))
+            if output_dir:
+                relative_path = os.path.relpath(image_path, output_dir)
+            else:
+                relative_path = os.path.basename(image_path)
+        else:
+            # 如果没有输出文件，相对于PDF文件所在目录
+            pdf_dir = os.path.dirname(os.path.abspath(self.pdf_path))
+            if pdf_dir:
+                relative_path = os.path.relpath(image_path, pdf_dir)
+            else:
+                relative_path = os.path.basename(image_path)
+        
+        # 统一使用正斜杠（Markdown标准）
+        return relative_path.replace('\\', '/')
+    
+    def write_image(self, image_path, image_bytes):
+        """保存图片（skip_unchanged_images 为True时，内容相同的已有文件不重写）"""
+        if self.skip_unchanged_images and file_has_content(image_path, image_bytes):
+            return
+        with open(image_path, "wb") as img_file:
+            img_file.write(image_bytes)
+    
+    def render_page_image(self, pdf_doc, page_num, dpi, output_file=None):
+        """将整页渲染为降采样图片（用于扫描页，代替保存原始分辨率的扫描图）"""
+        try:
+            pixmap = pdf_doc[page_num - 1].get_pixmap(dpi=dpi)
+            try:
+                image_bytes, image_ext = pixmap.tobytes("jpeg"), "jpg"
+            except Exception:
+                image_bytes, image_ext = pixmap.tobytes("png"), "png"
+            
+            self.image_counter += 1
+            image_filename = f"page_{page_num}_scan.{image_ext}"
+            image_path = os.path.join(self.images_dir, image_filename)
+            self.write_image(image_path, image_bytes)
+            return [{
+                'path': self.relative_image_path(image_path, output_file),
+                'filename': image_filename,
+                'index': self.image_counter
+            }]
+        except Exception as e:
+            print(f"  警告: 渲染第{page_num}页失败: {e}")
+            return []
+    
+    def is_decorative_image(self, pdf_doc, xref, width, height):
+        """根据get_images中的宽高和原始数据流长度判断是否为小图标/装饰图片（不解码）"""
+        if self.min_image_size and width and height and min(width, height) < self.min_image_size:
+            return True
+        if self.min_image_bytes:
+            try:
+                kind, value = pdf_doc.xref_get_key(xref, "Length")
+                length = int(value) if kind == 'int' else len(pdf_doc.xref_stream_raw(xref))
+            except Exception:
+                return False
+            if length < self.min_image_bytes:
+                return True
+        return False
+    
+    def decode_image(self, pdf_doc, xref, smask=0):
+        """解码图片，返回 (图片数据, 扩展名)；带软蒙版（SMask）的图片合并透明通道后保存为PNG"""
+        if smask:
+            try:
+                pix = self.fitz.Pixmap(pdf_doc, xref)
+                if pix.alpha:
+                    pix = self.fitz.Pixmap(pix, 0)  # 去掉已有的透明通道
+                if pix.colorspace and pix.colorspace.n > 3:
+                    pix = self.fitz.Pixmap(self.fitz.csRGB, pix)  # CMYK等转为RGB
+                mask = self.fitz.Pixmap(pdf_doc, smask)
+                return self.fitz.Pixmap(pix, mask).tobytes("png"), "png"
+            except Exception as e:
+                print(f"  警告: 合并图片透明通道失败（xref {xref}），保存原图: {e}")
+        base_image = pdf_doc.extract_image(xref)
+        return base_image["image"], base_image["ext"]
+    
     def extract_images_with_fitz(self, pdf_doc, page_num, output_file=None):
         """使用PyMuPDF提取图片（使用已打开的文档）"""
         images = []
@@ -111,39 +502,23 @@ class PDFToMarkdownConverter:
             
             for img_index, img in enumerate(image_list):
                 try:
-                    xref = img[0]
-                    base_image = pdf_doc.extract_image(xref)
-                    image_bytes = base_image["image"]
-                    image_ext = base_image["ext"]
+                    xref, smask, width, height = img[0], img[1], img[2], img[3]
+                    
+                    # 解码前先根据元数据跳过小图标、间隔图等装饰性图片
+                    if self.is_decorative_image(pdf_doc, xref, width, height):
+                        self.images_skipped += 1
+                        continue
+                    
+                    image_bytes, image_ext = self.decode_image(pdf_doc, xref, smask)
                     
                     # 保存图片
                     self.image_counter += 1
                     image_filename = f"page_{page_num}_img_{img_index + 1}.{image_ext}"
                     image_path = os.path.join(self.images_dir, image_filename)
+                    self.write_image(image_path, image_bytes)
                     
-                    with open(image_path, "wb") as img_file:
-                        img_file.write(image_bytes)
-                    
-                    # 生成相对路径（用于Markdown）
-                    # 相对于输出Markdown文件所在目录
-                    if output_file:
-                        output_dir = os.path.dirname(os.path.abspath(output_file))
-                        if output_dir:
-                            relative_path = os.path.relpath(image_path, output_dir)
-                        else:
-                            relative_path = os.path.basename(image_path)
-                    else:
-                        # 如果没有输出文件，相对于PDF文件所在目录
-                        pdf_dir = os.path.dirname(os.path.abspath(self.pdf_path))
-                        if pdf_dir:
-                            relative_path = os.path.relpath(image_path, pdf_dir)
-                        else:
-                            relative_path = os.path.basename(image_path)
-                    
-                    # 统一使用正斜杠（Markdown标准）
-                    relative_path = relative_path.replace('\\', '/')
                     images.append({
-                        'path': relative_path,
+                        'path': self.relative_image_path(image_path, output_file),
                         'filename': image_filename,
                         'index': self.image_counter
                     })
@@ -191,194 +566,1521 @@ class PDFToMarkdownConverter:
         
         return images
     
-    def convert(self, pdf_path, output_file=None):
-        """将PDF转换为Markdown"""
-        print(f"正在读取PDF文件: {pdf_path}")
+    def filter_tables(self, tables):
+        """筛选有效表格，返回清理后的行列表（单元格均为字符串）"""
+        result = []
+        for table in tables or []:
+            rows = self._clean_table(table)
+            if rows is not None:
+                result.append(rows)
+        return result
+    
+    def _clean_table(self, table):
+        """清理单个表格，返回行列表（单元格均为字符串）；不像有效表格时返回None"""
+        # 检查表格是否有效（至少2行，且不是纯文本内容）
+        if not table or len(table) < 2:
+            return None
+        # 检查第一行是否像表头（通常表头较短）
+        first_row = [str(cell).strip() if cell else "" for cell in table[0]]
+        first_row_text = " ".join(first_row).strip()
+        
+        # 如果第一行太长（>200字符），可能是文本内容而不是表格
+        if len(first_row_text) >= 200:
+            return None
+        # 检查是否有明显的表格结构（至少2列）
+        if len([c for c in first_row if c]) < 2:
+            return None
+        
+        rows = []
+        for row in table:
+            if not row:
+                continue
+            # 清理None值；单元格内的换行替换为空格，避免一行表格在Markdown中被拆成多行
+            row = [str(cell).replace('\n', ' ').strip() if cell is not None else "" for cell in row]
+            
+            # 跳过明显是文本内容的行（单列且内容很长）
+            if len(row) == 1 and len(row[0].strip()) > 100:
+                continue
+            rows.append(row)
+        return rows
+    
+    def collect_tables(self, result, tables, top, bottom):
+        """筛选页面上识别出的表格（(行列表, bbox) 列表，bbox 为 (x0, top, x1, bottom)），写入 result.tables
+        
+        第一个表格从页面内容区顶部开始、且与上一页延伸到底部的最后一个表格列数相同时，
+        视为跨页表格的续表（result.table_continued），渲染时拼接为一个表格。
+        """
+        columns, self.open_table_columns = self.open_table_columns, None
+        kept = []
+        for table, bbox in tables:
+            rows = self._clean_table(table)
+            if rows is not None:
+                kept.append((rows, bbox))
+        result.tables = [rows for rows, _ in kept]
+        if not kept:
+            return
+        edge = (bottom - top) * self.TABLE_EDGE_RATIO
+        rows, bbox = kept[0]
+        result.table_continued = columns == len(rows[0]) and bbox[1] - top <= edge
+        rows, bbox = kept[-1]
+        if bottom - bbox[3] <= edge:
+            self.open_table_columns = len(rows[0])
+        result.open_table_columns = self.open_table_columns
+    
+    @staticmethod
+    def _count_positions(values, tolerance=3):
+        """统计坐标聚类后的不同位置数（排序后相邻值相差不超过tolerance视为同一位置）"""
+        count = 0
+        last = None
+        for value in sorted(values):
+            if last is None or value - last > tolerance:
+                count += 1
+            last = value
+        return count
+    
+    def _has_grid(self, horizontal, vertical):
+        """有效表格至少2行2列，需要至少3条横线位置和3条竖线位置"""
+        return self._count_positions(horizontal) >= 3 and self._count_positions(vertical) >= 3
+    
+    def has_table_structure(self, page):
+        """快速判断pdfplumber页面是否可能包含表格
+        
+        默认的lines策略只根据页面上的线条和矩形边（page.edges）构造单元格，
+        没有足够的横线和竖线时extract_tables()不可能返回有效表格。
+        """
+        horizontal = []
+        vertical = []
+        for edge in page.edges:
+            if edge['orientation'] == 'h':
+                horizontal.append(edge['top'])
+            else:
+                vertical.append(edge['x0'])
+        return self._has_grid(horizontal, vertical)
+    
+    def has_table_structure_fitz(self, fitz_page, tolerance=3):
+        """快速判断PyMuPDF页面是否可能包含表格（依据矢量图形中的直线、矩形和四边形）"""
+        get_drawings = getattr(fitz_page, 'get_cdrawings', None) or fitz_page.get_drawings
+        horizontal = []
+        vertical = []
+        
+        def add_rect(x0, y0, x1, y1):
+            horizontal.extend((y0, y1))
+            vertical.extend((x0, x1))
+        
+        for path in get_drawings():
+            rect = path.get('rect')
+            if rect is not None:
+                add_rect(*tuple(rect)[:4])
+            for item in path.get('items', ()):
+                kind = item[0]
+                if kind == 'l':
+                    (x0, y0), (x1, y1) = tuple(item[1])[:2], tuple(item[2])[:2]
+                    if abs(y0 - y1) <= tolerance:
+                        horizontal.append(min(y0, y1))
+                    if abs(x0 - x1) <= tolerance:
+                        vertical.append(min(x0, x1))
+                elif kind == 're':
+                    add_rect(*tuple(item[1])[:4])
+                elif kind == 'qu':
+                    points = [tuple(point)[:2] for point in item[1]]
+                    xs = [x for x, _ in points]
+                    ys = [y for _, y in points]
+                    add_rect(min(xs), min(ys), max(xs), max(ys))
+        return self._has_grid(horizontal, vertical)
+    
+    def _should_extract_tables(self, check, page):
+        """表格预检：返回是否需要执行表格识别，并累计跳过的页数"""
+        if not self.table_precheck:
+            return True
+        self.table_pages_checked += 1
+        if check(page):
+            return True
+        self.table_pages_skipped += 1
+        return False
+    
+    SCAN_MAX_CHARS = 20  # 字符数少于该值才可能是扫描页
+    SCAN_MIN_COVERAGE = 0.5  # 图片覆盖页面面积的比例不低于该值视为扫描页
+    TABLE_EDGE_RATIO = 0.15  # 表格与页面内容区上/下边缘的距离不超过页面高度的该比例时，视为可能跨页
+    PAGE_TYPE_NAMES = {'text': '文本', 'scanned': '扫描', 'blank': '空白'}
+    
+    def classify_page(self, char_count, image_boxes, width, height):
+        """根据字符数和图片覆盖率判断页面类型：text / scanned / blank"""
+        if not self.detect_scans or char_count >= self.SCAN_MAX_CHARS:
+            return 'text'
+        if char_count == 0 and not image_boxes:
+            return 'blank'
+        
+        # 图片面积之和（裁剪到页面范围内，不扣除重叠部分）占页面面积的比例
+        page_area = width * height
+        covered = 0.0
+        for x0, top, x1, bottom in image_boxes:
+            w = min(x1, width) - max(x0, 0)
+            h = min(bottom, height) - max(top, 0)
+            if w > 0 and h > 0:
+                covered += w * h
+        coverage = min(covered / page_area, 1.0) if page_area > 0 else 0.0
+        return 'scanned' if coverage >= self.SCAN_MIN_COVERAGE else 'text'
+    
+    HEADER_ZONE = 0.15  # 页眉/页脚只在页面顶部/底部该比例的区域内查找
+    HEADER_MIN_REPEAT = 0.6  # 在不低于该比例的样本页上重复出现才视为页眉页脚
+    HEADER_SAMPLE_PAGES = 12  # 学习页眉页脚时最多采样的页数
+    HEADER_POSITION_TOLERANCE = 6  # 重复行在各页上的位置允许的偏差（pt）
+    
+    @staticmethod
+    def _group_word_lines(words, y_tolerance=3):
+        """将单词 (x0, top, x1, bottom, text) 按行合并为 (top, bottom, text)"""
+        lines = []
+        current = []
+        for word in sorted(words, key=lambda w: (w[1], w[0])):
+            if current and word[1] - current[0][1] > y_tolerance:
+                lines.append(current)
+                current = []
+            current.append(word)
+        if current:
+            lines.append(current)
+        return [(min(w[1] for w in line), max(w[3] for w in line),
+                 ' '.join(w[4] for w in sorted(line, key=lambda w: w[0]))) for line in lines]
+    
+    def sample_page_numbers(self, total_pages):
+        """选择用于学习页眉页脚的样本页：前3页加均匀分布的页面"""
+        count = min(self.HEADER_SAMPLE_PAGES, total_pages)
+        first = min(3, count)
+        # 其余样本在第 first+1 页到最后一页之间均匀分布，总数恰好为count
+        step = (total_pages - first) / max(count - first, 1)
+        return list(range(1, first + 1)) + [first + 1 + int(k * step) for k in range(count - first)]
+    
+    @staticmethod
+    def _header_key(text):
+        """页眉页脚行的归一化文本：页码类的短行忽略数字差异，其余行要求逐字相同"""
+        text = re.sub(r'\s+', ' ', text).strip()
+        if len(re.sub(r'[\d\W_]', '', text)) <= 20:
+            return re.sub(r'\d+', '#', text)
+        return text
+    
+    def learn_page_bands(self, samples):
+        """从样本页的文本行学习页眉页脚区域
+        
+        samples: [(页面高度, [(top, bottom, text), ...]), ...]
+        在多数样本页顶部/底部相同位置重复出现的行是页眉页脚（页码类短行忽略数字差异）；
+        区域不会越过任何样本页上的非重复内容。返回距页面上/下边缘的裁剪高度。
+        """
+        if len(samples) < 3:
+            return None
+        threshold = max(2, -(-len(samples) * self.HEADER_MIN_REPEAT // 1))
+        
+        # 记录每一行：(区域, 归一化文本, 距上边缘/下边缘的近端和远端距离)
+        records = []
+        positions = {}
+        for height, lines in samples:
+            page_records = []
+            seen = set()
+            for top, bottom, text in lines:
+                key = self._header_key(text)
+                if bottom <= height * self.HEADER_ZONE:
+                    zone = 'header'
+                elif top >= height * (1 - self.HEADER_ZONE):
+                    zone = 'footer'
+                else:
+                    zone = None
+                page_records.append((zone, key, (top, bottom), (height - bottom, height - top)))
+                if zone and (zone, key) not in seen:
+                    seen.add((zone, key))
+                    positions.setdefault((zone, key), []).append(top if zone == 'header' else height - bottom)
+            records.append(page_records)
+        
+        repeated = {zone_key for zone_key, offsets in positions.items()
+                    if len(offsets) >= threshold and max(offsets) - min(offsets) <= self.HEADER_POSITION_TOLERANCE}
+        
+        bands = {'header': 0.0, 'footer': 0.0, 'samples': len(samples), 'texts': sorted(key for _, key in repeated)}
+        for zone, side in (('header', 2), ('footer', 3)):
+            band_lines = []
+            other_lines = []
+            for page_records in records:
+                for record in page_records:
+                    near, far = record[side]
+                    if (record[0], record[1]) in repeated and record[0] == zone:
+                        band_lines.append(far)
+                    else:
+                        other_lines.append(near)
+            band = max(band_lines, default=0.0)
+            # 不能裁到任何非重复内容
+            conflict = min((near for near in other_lines if near < band), default=None)
+            if conflict is not None:
+                band = max((far for far in band_lines if far <= conflict), default=0.0)
+            if band > 0:
+                nearest = min((near for near in other_lines if near >= band), default=band + 2)
+                bands[zone] = band + min(1.0, (nearest - band) / 2)
+        
+        if not bands['header'] and not bands['footer']:
+            return None
+        return bands
+    
+    def _learn_bands_pdfplumber(self, source, total_pages):
+        """采样页面，用pdfplumber的单词位置学习页眉页脚"""
+        samples = []
+        sample_pages = self.sample_page_numbers(total_pages)
+        with source.open_pdfplumber(self.pdfplumber, pages=sample_pages) as pdf:
+            for page in pdf.pages:
+                words = [(w['x0'], w['top'], w['x1'], w['bottom'], w['text']) for w in page.extract_words()]
+                samples.append((page.height, self._group_word_lines(words)))
+        return self.learn_page_bands(samples)
+    
+    def _learn_bands_fitz(self, pdf_doc):
+        """采样页面，用PyMuPDF的单词位置学习页眉页脚"""
+        samples = []
+        for page_num in self.sample_page_numbers(pdf_doc.page_count):
+            fitz_page = pdf_doc[page_num - 1]
+            words = [w[:5] for w in fitz_page.get_text("words")]
+            samples.append((fitz_page.rect.height, self._group_word_lines(words)))
+        return self.learn_page_bands(samples)
+    
+    def _report_page_bands(self):
+        """输出学习到的页眉页脚区域"""
+        if not self.page_bands:
+            self.progress.message("页眉页脚: 未识别到重复的页眉页脚")
+            return
+        examples = '、'.join(f"'{text}'" for text in self.page_bands['texts'][:3])
+        self.progress.message(f"页眉页脚: 从 {self.page_bands['samples']} 个样本页识别到页眉 "
+                              f"{self.page_bands['header']:.1f}pt、页脚 {self.page_bands['footer']:.1f}pt（如 {examples}），提取文本前裁掉")
+    
+    def _crop_page_bands(self, page):
+        """裁掉pdfplumber页面的页眉页脚区域"""
+        if not self.page_bands:
+            return page
+        x0, top, x1, bottom = page.bbox
+        new_top = top + self.page_bands['header']
+        new_bottom = bottom - self.page_bands['footer']
+        if new_bottom <= new_top:
+            return page
+        return page.within_bbox((x0, new_top, x1, new_bottom))
+    
+    def _page_clip_fitz(self, fitz_page):
+        """PyMuPDF页面去掉页眉页脚后的区域（None表示整页）"""
+        if not self.page_bands:
+            return None
+        rect = fitz_page.rect
+        clip = self.fitz.Rect(rect.x0, rect.y0 + self.page_bands['header'],
+                              rect.x1, rect.y1 - self.page_bands['footer'])
+        return clip if clip.y1 > clip.y0 else None
+    
+    def _extract_page_images(self, result, pdf_doc, output_file=None):
+        """提取页面图片；扫描页在指定scan_dpi时改为渲染降采样的整页图片"""
+        stage_start = time.perf_counter()
+        if result.page_type == 'scanned' and self.scan_dpi:
+            result.images = self.render_page_image(pdf_doc, result.page_num, self.scan_dpi, output_file)
+        else:
+            result.images = self.extract_images_with_fitz(pdf_doc, result.page_num, output_file)
+        result.timings['images'] = time.perf_counter() - stage_start
+        if result.images:
+            self.progress.message(f"  提取到 {len(result.images)} 张图片")
+    
+    def process_page(self, page, page_num, pdf_doc=None, output_file=None):
+        """处理单个页面，返回结构化的PageResult"""
+        result = PageResult(page_num)
+        page_start = time.perf_counter()
+        
+        # 判断页面类型（扫描页和空白页不做文本和表格分析）
+        if self.detect_scans:
+            image_boxes = [(img['x0'], img['top'], img['x1'], img['bottom']) for img in page.images]
+            result.page_type = self.classify_page(len(page.chars), image_boxes, page.width, page.height)
+        self.page_types[result.page_type] = self.page_types.get(result.page_type, 0) + 1
+        
+        # 提取图片（优先使用PyMuPDF）
+        if pdf_doc:
+            self._extract_page_images(result, pdf_doc, output_file)
+        
+        if result.page_type == 'text':
+            # 裁掉页眉页脚区域
+            text_page = self._crop_page_bands(page)
+            
+            # 提取文本
+            stage_start = time.perf_counter()
+            text = text_page.extract_text()
+            if text:
+                result.text_blocks.append(text)
+            result.timings['text'] = time.perf_counter() - stage_start
+            
+            # 尝试提取表格
+            stage_start = time.perf_counter()
+            tables = []
+            if self._should_extract_tables(self.has_table_structure, text_page):
+                tables = [(table.extract(), table.bbox) for table in text_page.find_tables()]
+            self.collect_tables(result, tables, text_page.bbox[1], text_page.bbox[3])
+            result.timings['tables'] = time.perf_counter() - stage_start
+        else:
+            self.open_table_columns = None
+        
+        result.timings['total'] = time.perf_counter() - page_start
+        return result
+    
+    def get_text_dict_fitz(self, fitz_page, clip=None):
+        """获取页面文本结构（不解码图片数据）"""
+        flags = getattr(self.fitz, 'TEXTFLAGS_DICT', None)
+        if flags is None:
+            return fitz_page.get_text("dict", clip=clip)
+        return fitz_page.get_text("dict", clip=clip, flags=flags & ~self.fitz.TEXT_PRESERVE_IMAGES)
+    
+    def extract_text_with_fitz(self, fitz_page, y_tolerance=3, text_dict=None):
+        """使用PyMuPDF提取页面文本，按行排列（与pdfplumber的extract_text输出保持一致）"""
+        if text_dict is None:
+            text_dict = self.get_text_dict_fitz(fitz_page)
+        spans = []
+        for block in text_dict["blocks"]:
+            if block.get("type") != 0:
+                continue
+            for line in block["lines"]:
+                text = ''.join(span["text"] for span in line["spans"]).strip()
+                if text:
+                    x0, top = line["bbox"][0], line["bbox"][1]
+                    spans.append((top, x0, text))
+        
+        # 同一基线（top相差不超过y_tolerance）的文本行合并为一行，从左到右排列
+        spans.sort()
+        lines = []
+        current = []
+        current_top = None
+        for top, x0, text in spans:
+            if current and top - current_top > y_tolerance:
+                lines.append(' '.join(t for _, t in sorted(current)))
+                current = []
+            if not current:
+                current_top = top
+            current.append((x0, text))
+        if current:
+            lines.append(' '.join(t for _, t in sorted(current)))
+        return '\n'.join(lines)
+    
+    def extract_tables_with_fitz(self, fitz_page, clip=None):
+        """使用PyMuPDF的find_tables提取表格，返回 (行列表, bbox) 列表（行列表与pdfplumber的结构相同）"""
+        if not hasattr(fitz_page, 'find_tables'):
+            return []
+        try:
+            return [(table.extract(), tuple(table.bbox)) for table in fitz_page.find_tables(clip=clip).tables]
+        except Exception as e:
+            print(f"  警告: 第{fitz_page.number + 1}页表格识别失败: {e}")
+            return []
+    
+    def process_page_fitz(self, pdf_doc, page_num, output_file=None):
+        """使用PyMuPDF处理单个页面（文本、表格、图片均来自同一文档）"""
+        result = PageResult(page_num)
+        page_start = time.perf_counter()
+        fitz_page = pdf_doc[page_num - 1]
+        
+        # 判断页面类型（扫描页和空白页不做文本和表格分析）
+        # 去掉页眉页脚区域
+        clip = self._page_clip_fitz(fitz_page)
+        
+        stage_start = time.perf_counter()
+        text_dict = self.get_text_dict_fitz(fitz_page, clip=clip)
+        text_time = time.perf_counter() - stage_start
+        if self.detect_scans:
+            char_count = sum(len(span["text"].strip())
+                             for block in text_dict["blocks"] if block.get("type") == 0
+                             for line in block["lines"] for span in line["spans"])
+            image_boxes = [info['bbox'] for info in fitz_page.get_image_info()]
+            rect = fitz_page.rect
+            result.page_type = self.classify_page(char_count, image_boxes, rect.width, rect.height)
+        self.page_types[result.page_type] = self.page_types.get(result.page_type, 0) + 1
+        
+        self._extract_page_images(result, pdf_doc, output_file)
+        
+        if result.page_type == 'text':
+            stage_start = time.perf_counter()
+            text = self.extract_text_with_fitz(fitz_page, text_dict=text_dict)
+            if text:
+                result.text_blocks.append(text)
+            result.timings['text'] = text_time + time.perf_counter() - stage_start
+            
+            stage_start = time.perf_counter()
+            tables = []
+            if self._should_extract_tables(self.has_table_structure_fitz, fitz_page):
+                tables = self.extract_tables_with_fitz(fitz_page, clip=clip)
+            area = clip or fitz_page.rect
+            self.collect_tables(result, tables, area.y0, area.y1)
+            result.timings['tables'] = time.perf_counter() - stage_start
+        else:
+            self.open_table_columns = None
+        
+        result.timings['total'] = time.perf_counter() - page_start
+        return result
+    
+    def iter_pages(self, pdf_path, output_file=None, start_page=1):
+        """逐页转换PDF，按页产出PageResult（惰性，从start_page开始）"""
+        self.progress.message(f"正在读取PDF文件: {pdf_path}")
         
         # 保存pdf_path供后续使用
         self.pdf_path = pdf_path
         
         # 设置图片保存目录
         self.setup_images_directory(pdf_path, output_file)
-        print(f"图片将保存到: {self.images_dir}")
+        self.progress.message(f"图片将保存到: {self.images_dir}")
         
-        markdown_content = []
-        pdf_doc = None
+        self.table_pages_checked = 0
+        self.table_pages_skipped = 0
+        self.page_types = {}
+        self.page_bands = None
+        if start_page == 1:
+            # 从中间页继续时由调用方按已完成的最后一页恢复
+            self.open_table_columns = None
+        self.images_skipped = 0
         
-        # 打开PDF文档用于图片提取（如果支持）
-        if self.has_fitz:
+        with PDFSource(pdf_path, use_mmap=self.use_mmap) as source:
             try:
-                pdf_doc = self.fitz.open(pdf_path)
+                if self.engine == 'pymupdf':
+                    yield from self._iter_fitz_pages(source, output_file, start_page)
+                else:
+                    yield from self._iter_source_pages(source, output_file, start_page)
             except Exception as e:
-                print(f"警告: 无法使用PyMuPDF打开PDF: {e}")
-                pdf_doc = None
+                print(f"错误: PDF转换失败 - {e}")
+                raise
+        self.progress.finish()
+        
+        if self.table_pages_skipped:
+            self.progress.message(f"表格预检: {self.table_pages_skipped}/{self.table_pages_checked} 页没有表格线，"
+                                  f"已跳过表格识别")
         
+        if self.page_types.get('scanned') or self.page_types.get('blank'):
+            summary = '，'.join(f"{self.PAGE_TYPE_NAMES.get(page_type, page_type)} {count} 页"
+                               for page_type, count in self.page_types.items())
+            self.progress.message(f"页面类型: {summary}")
+            self.progress.message(f"  （字符少于{self.SCAN_MAX_CHARS}个且图片覆盖不低于"
+                                  f"{self.SCAN_MIN_COVERAGE:.0%}的页面视为扫描页，扫描页和空白页跳过文本和表格分析）")
+        
+        if self.images_skipped:
+            self.progress.message(f"已跳过 {self.images_skipped} 张小图标/装饰图片"
+                                  f"（宽或高小于{self.min_image_size}像素，或数据小于{self.min_image_bytes}字节）")
+        
+        if self.image_counter > 0:
+            self.progress.message(f"✓ 共提取 {self.image_counter} 张图片，保存在: {self.images_dir}")
+        else:
+            if not self.has_fitz:
+                self.progress.message("提示: 未检测到图片。如需提取图片，请安装PyMuPDF: pip install PyMuPDF")
+    
+    def _open_fitz(self, source):
+        """打开PyMuPDF文档用于图片提取（如果支持）"""
+        if not self.has_fitz:
+            return None
         try:
-            with self.pdfplumber.open(pdf_path) as pdf:
-                total_pages = len(pdf.pages)
-                print(f"总页数: {total_pages}")
+            return source.open_fitz(self.fitz)
+        except Exception as e:
+            print(f"警告: 无法使用PyMuPDF打开PDF: {e}")
+            return None
+    
+    def _iter_source_pages(self, source, output_file=None, start_page=1):
+        """按块遍历页面，每块结束后关闭两个解析器并释放映射页面"""
+        with source.open_pdfplumber(self.pdfplumber) as pdf:
+            total_pages = len(pdf.pages)
+        self.progress.message(f"总页数: {total_pages}")
+        if self.strip_headers:
+            self.page_bands = self._learn_bands_pdfplumber(source, total_pages)
+            self._report_page_bands()
+        self.progress.start(source.pdf_path, total_pages, start_page)
+        
+        chunk_size = self.chunk_pages if self.chunk_pages and self.chunk_pages > 0 else total_pages
+        for start in range(start_page - 1, total_pages, chunk_size):
+            end = min(start + chunk_size, total_pages)
+            pdf_doc = self._open_fitz(source)
+            try:
+                with source.open_pdfplumber(self.pdfplumber, pages=list(range(start + 1, end + 1))) as pdf:
+                    for i, page in enumerate(pdf.pages, start + 1):
+                        if not pdf_doc and self.has_fitz:
+                            # 如果之前打开失败，尝试重新打开
+                            try:
+                                pdf_doc = source.open_fitz(self.fitz)
+                            except:
+                                pass
+                        
+                        result = self.process_page(page, i, pdf_doc, output_file)
+                        self.progress.page_done(result)
+                        yield result
+                        # 释放页面缓存的布局对象
+                        page.close()
+            finally:
+                # 关闭PDF文档
+                if pdf_doc:
+                    pdf_doc.close()
+            source.release_pages()
+    
+    def _iter_fitz_pages(self, source, output_file=None, start_page=1):
+        """仅使用PyMuPDF遍历页面（单解析器模式）"""
+        pdf_doc = source.open_fitz(self.fitz)
+        total_pages = pdf_doc.page_count
+        self.progress.message(f"总页数: {total_pages}")
+        if self.strip_headers:
+            self.page_bands = self._learn_bands_fitz(pdf_doc)
+            self._report_page_bands()
+        self.progress.start(source.pdf_path, total_pages, start_page)
+        
+        chunk_size = self.chunk_pages if self.chunk_pages and self.chunk_pages > 0 else total_pages
+        try:
+            for i in range(start_page, total_pages + 1):
+                result = self.process_page_fitz(pdf_doc, i, output_file)
+                self.progress.page_done(result)
+                yield result
                 
-                for i, page in enumerate(pdf.pages, 1):
-                    if i % 10 == 0 or i == 1:
-                        print(f"处理第 {i}/{total_pages} 页...")
-                    
-                    # 提取图片（优先使用PyMuPDF）
-                    images = []
-                    if pdf_doc:
-                        images = self.extract_images_with_fitz(pdf_doc, i, output_file)
-                    elif self.has_fitz:
-                        # 如果之前打开失败，尝试重新打开
-                        try:
-                            pdf_doc = self.fitz.open(pdf_path)
-                            images = self.extract_images_with_fitz(pdf_doc, i, output_file)
-                        except:
-                            pass
-                    
-                    if images:
-                        print(f"  提取到 {len(images)} 张图片")
-                    
-                    # 添加页面分隔符（后续优化时会移除）
-                    if i > 1:
-                        markdown_content.append("\n---\n")
-                    markdown_content.append(f"## 第 {i} 页\n\n")
-                    
-                    # 插入图片（如果有）
-                    if images:
-                        for img in images:
-                            # 使用相对路径，确保Markdown可以正确显示
-                            img_path = img['path']  # 已经是正斜杠格式
-                            # 如果路径不是相对于输出文件的，需要调整
-                            if output_file:
-                                output_dir = os.path.dirname(os.path.abspath(output_file))
-                                if output_dir and not os.path.isabs(img_path):
-                                    # 确保路径相对于输出文件
-                                    pass  # 已经在extract_images_with_fitz中处理了
-                            markdown_content.append(f"![图片 {img['index']}]({img_path})\n\n")
-                    
-                    # 提取文本
-                    text = page.extract_text()
-                    
-                    if text:
-                        markdown_content.append(text)
-                        markdown_content.append("\n")
-                    
-                    # 尝试提取表格
-                    tables = page.extract_tables()
-                    if tables:
-                        for table in tables:
-                            if table:
-                                # 检查表格是否有效（至少2行，且不是纯文本内容）
-                                valid_table = False
-                                if len(table) >= 2:
-                                    # 检查第一行是否像表头（通常表头较短）
-                                    first_row = [str(cell).strip() if cell else "" for cell in table[0]]
-                                    first_row_text = " ".join(first_row).strip()
-                                    
-                                    # 如果第一行太长（>200字符），可能是文本内容而不是表格
-                                    if len(first_row_text) < 200:
-                                        # 检查是否有明显的表格结构（至少2列）
-                                        if len([c for c in first_row if c]) >= 2:
-                                            valid_table = True
-                                
-                                if valid_table:
-                                    markdown_content.append("\n### 表格\n\n")
-                                    # 转换为Markdown表格格式
-                                    for row_idx, row in enumerate(table):
-                                        if row:
-                                            # 清理None值
-                                            row = [str(cell) if cell is not None else "" for cell in row]
-                                            row_text = " ".join(row).strip()
-                                            
-                                            # 跳过明显是文本内容的行（单列且内容很长）
-                                            if len(row) == 1 and len(row_text) > 100:
-                                                continue
-                                            
-                                            markdown_content.append("| " + " | ".join(row) + " |\n")
-                                            if row_idx == 0:
-                                                # 添加表头分隔符
-                                                markdown_content.append("| " + " | ".join(["---"] * len(row)) + " |\n")
-                                    markdown_content.append("\n")
+                # 分块：关闭并重新打开文档，释放PyMuPDF内部缓存
+                if i % chunk_size == 0 and i < total_pages:
+                    pdf_doc.close()
+                    source.release_pages()
+                    pdf_doc = source.open_fitz(self.fitz)
+        finally:
+            pdf_doc.close()
+    
+    def convert_pages(self, pdf_path, output_file=None, journal=None):
+        """将PDF转换为PageResult列表（指定journal时逐页写入检查点，并从上次中断处继续）"""
+        if journal is None:
+            return list(self.iter_pages(pdf_path, output_file))
         
-        except Exception as e:
-            print(f"错误: PDF转换失败 - {e}")
-            raise
+        pages = journal.load()
+        if pages:
+            # 图片编号在整个文档内连续，需要从已完成页面继续计数
+            self.image_counter = max([img['index'] for page in pages for img in page.images] + [self.image_counter])
+            # 跨页表格可能在断点处继续
+            self.open_table_columns = pages[-1].open_table_columns
+            self.progress.message(f"从断点继续: 已完成 {len(pages)} 页，从第 {len(pages) + 1} 页开始")
+        for page in self.iter_pages(pdf_path, output_file, start_page=len(pages) + 1):
+            journal.append(page)
+            pages.append(page)
+        return pages
+    
+    def convert(self, pdf_path, output_file=None, formats=None):
+        """将PDF转换为Markdown（带页面标记的原始文本）
+        
+        指定 formats（OUTPUT_FORMATS 中的若干项，如 ('md', 'json', 'txt')）时，
+        PDF只解析一次，从同一组页面数据渲染全部格式，返回 {格式: 内容}。
+        """
+        if formats is None:
+            return MarkdownRenderer().render(self.iter_pages(pdf_path, output_file))
+        return render_outputs(self.iter_pages(pdf_path, output_file), formats)
+    
+    @classmethod
+    def async_executor(cls):
+        """异步接口默认使用的共享线程池（首次使用时创建）"""
+        if cls._async_executor is None:
+            from concurrent.futures import ThreadPoolExecutor
+            cls._async_executor = ThreadPoolExecutor(max_workers=cls.ASYNC_WORKERS, thread_name_prefix='ptom')
+        return cls._async_executor
+    
+    async def iter_pages_async(self, pdf_path, output_file=None, executor=None):
+        """异步逐页转换PDF，按页产出PageResult，不阻塞事件循环
+        
+        每一页在线程池中处理（默认为 async_executor() 返回的共享线程池），同一文档同一时刻
+        只有一页在处理，多个文档的页面在线程池中交替排队。取消或提前结束迭代时，
+        正在处理的页面完成后即关闭PDF，不再处理后续页面。每个文档使用单独的转换器实例。
+        """
+        import asyncio
+        executor = executor or self.async_executor()
+        pages = self.iter_pages(pdf_path, output_file)
+        done = object()
+        future = None
+        try:
+            while True:
+                future = executor.submit(next, pages, done)
+                page = await asyncio.wrap_future(future)
+                if page is done:
+                    future = None
+                    return
+                yield page
         finally:
-            # 关闭PDF文档
-            if pdf_doc:
-                pdf_doc.close()
+            if future is not None:
+                # 不能在页面处理中途关闭生成器：等当前任务结束后，在线程池中关闭（释放PDF和内存映射）
+                future.add_done_callback(lambda _: executor.submit(pages.close))
+    
+    async def convert_async(self, pdf_path, output_file=None, formats=None, executor=None):
+        """异步转换PDF，返回值与 convert() 相同；渲染和优化同样在线程池中执行"""
+        import asyncio
+        executor = executor or self.async_executor()
+        pages = [page async for page in self.iter_pages_async(pdf_path, output_file, executor)]
+        if formats is None:
+            future = executor.submit(MarkdownRenderer().render, pages)
+        else:
+            future = executor.submit(render_outputs, pages, formats)
+        return await asyncio.wrap_future(future)
+    
+    @staticmethod
+    def preview_page_numbers(total_pages, first_pages, sample_pages):
+        """预览页：前first_pages页，加上在其余页面中均匀分布的sample_pages页（取各区间中点）"""
+        pages = list(range(1, min(first_pages, total_pages) + 1))
+        rest = total_pages - len(pages)
+        count = min(sample_pages, rest)
+        if count > 0:
+            step = rest / count
+            offset = len(pages) + 1
+            pages.extend(offset + int(k * step + step / 2) for k in range(count))
+        return pages
+    
+    def _extract_preview_pages(self, pdf_path, first_pages, sample_pages, state, stop):
+        """提取预览页的文本（在后台线程中运行，每页之前检查是否已超时）"""
+        with PDFSource(pdf_path, use_mmap=self.use_mmap) as source:
+            if self.has_fitz:
+                # 预览优先使用更快的PyMuPDF提取文本
+                doc = source.open_fitz(self.fitz)
+                try:
+                    state['total'] = doc.page_count
+                    state['planned'] = self.preview_page_numbers(doc.page_count, first_pages, sample_pages)
+                    for page_num in state['planned']:
+                        if stop.is_set():
+                            break
+                        text = self.extract_text_with_fitz(doc[page_num - 1])
+                        state['pages'].append(PageResult(page_num, text_blocks=[text] if text else []))
+                finally:
+                    doc.close()
+            else:
+                with source.open_pdfplumber(self.pdfplumber) as pdf:
+                    state['total'] = len(pdf.pages)
+                    state['planned'] = self.preview_page_numbers(len(pdf.pages), first_pages, sample_pages)
+                    for page_num in state['planned']:
+                        if stop.is_set():
+                            break
+                        page = pdf.pages[page_num - 1]
+                        text = page.extract_text()
+                        page.close()
+                        state['pages'].append(PageResult(page_num, text_blocks=[text] if text else []))
+    
+    def preview(self, pdf_path, first_pages=None, sample_pages=None, budget=1.0, optimizer=None):
+        """快速预览：只提取开头几页和均匀抽样页的文本（不提取图片和表格），budget秒内返回Markdown
         
-        if self.image_counter > 0:
-            print(f"✓ 共提取 {self.image_counter} 张图片，保存在: {self.images_dir}")
+        提取在后台线程中进行，时间用完时直接返回已完成的页面（正在处理的页面被丢弃）；
+        未抽样或来不及处理的页面在预览中标注为已省略。结果只做轻量优化（见 MarkdownOptimizer.optimize_light）。
+        """
+        import threading
+        deadline = time.monotonic() + budget
+        first_pages = self.PREVIEW_FIRST_PAGES if first_pages is None else first_pages
+        sample_pages = self.PREVIEW_SAMPLE_PAGES if sample_pages is None else sample_pages
+        state = {'total': None, 'planned': [], 'pages': [], 'error': None}
+        stop = threading.Event()
+        
+        def run():
+            try:
+                self._extract_preview_pages(pdf_path, first_pages, sample_pages, state, stop)
+            except Exception as e:
+                state['error'] = e
+        
+        thread = threading.Thread(target=run, name='ptom-preview', daemon=True)
+        thread.start()
+        thread.join(max(0.0, deadline - time.monotonic()))
+        stop.set()
+        pages = list(state['pages'])
+        if state['error'] is not None and not pages:
+            raise state['error']
+        content = MarkdownRenderer().render_preview(pages, state['total'], timed_out=thread.is_alive())
+        return (optimizer or MarkdownOptimizer()).optimize_light(content)
+
+
+class PageResult:
+    """单页转换结果"""
+    
+    def __init__(self, page_num, text_blocks=None, tables=None, images=None, timings=None, page_type='text',
+                 table_continued=False, open_table_columns=None):
+        self.page_num = page_num
+        self.page_type = page_type  # 页面类型：text / scanned / blank
+        self.text_blocks = text_blocks if text_blocks is not None else []  # 文本块（按阅读顺序）
+        self.tables = tables if tables is not None else []  # 表格：行列表，每行为单元格字符串列表
+        self.table_continued = table_continued  # 第一个表格是否为上一页最后一个表格的续表
+        self.open_table_columns = open_table_columns  # 最后一个表格延伸到页面底部时的列数（可能在下一页继续）
+        self.images = images if images is not None else []  # 图片引用：{'path', 'filename', 'index'}
+        self.timings = timings if timings is not None else {}  # 各阶段耗时（秒）
+    
+    @property
+    def text(self):
+        """页面全文"""
+        return '\n'.join(self.text_blocks)
+    
+    def to_dict(self):
+        """转换为可JSON序列化的字典"""
+        return {
+            'page_num': self.page_num,
+            'page_type': self.page_type,
+            'text_blocks': self.text_blocks,
+            'tables': self.tables,
+            'table_continued': self.table_continued,
+            'open_table_columns': self.open_table_columns,
+            'images': self.images,
+            'timings': self.timings,
+        }
+    
+    @classmethod
+    def from_dict(cls, data):
+        """从to_dict()的结果还原"""
+        return cls(data['page_num'], text_blocks=data.get('text_blocks'), tables=data.get('tables'),
+                   images=data.get('images'), timings=data.get('timings'), page_type=data.get('page_type', 'text'),
+                   table_continued=data.get('table_continued', False),
+                   open_table_columns=data.get('open_table_columns'))
+    
+    def __repr__(self):
+        return (f"PageResult(page_num={self.page_num}, text_blocks={len(self.text_blocks)}, "
+                f"tables={len(self.tables)}, images={len(self.images)})")
+
+
+class ConversionJournal:
+    """转换检查点日志（JSON Lines）
+    
+    第一行记录PDF指纹（路径、大小、修改时间、解析引擎、转换参数的哈希），之后每行一个已完成页面的PageResult。
+    重新运行时只要指纹一致，就从最后一个完整写入的页面继续转换；PDF或转换参数变化时重新开始。
+    """
+    
+    VERSION = 2
+    
+    def __init__(self, journal_path, pdf_path, engine='pdfplumber', options=None):
+        self.journal_path = journal_path
+        self.fingerprint = self._fingerprint(pdf_path, engine, options)
+        self._file = None
+    
+    @staticmethod
+    def _fingerprint(pdf_path, engine, options=None):
+        stat = os.stat(pdf_path)
+        options = json.dumps(options or {}, sort_keys=True)
+        return {
+            'version': ConversionJournal.VERSION,
+            'pdf': os.path.abspath(pdf_path),
+            'size': stat.st_size,
+            'mtime_ns': stat.st_mtime_ns,
+            'engine': engine,
+            'options': hashlib.blake2b(options.encode('utf-8'), digest_size=16).hexdigest(),
+        }
+    
+    def load(self):
+        """读取已完成的页面，并打开日志用于追加（指纹不一致时重新开始）"""
+        pages = []
+        valid_bytes = 0
+        if os.path.exists(self.journal_path):
+            with open(self.journal_path, 'rb') as f:
+                header = f.readline()
+                try:
+                    matched = header.endswith(b'\n') and json.loads(header) == self.fingerprint
+                except ValueError:
+                    matched = False
+                if matched:
+                    valid_bytes = len(header)
+                    for raw in f:
+                        # 最后一行可能因进程被杀而不完整，丢弃它及之后的内容
+                        if not raw.endswith(b'\n'):
+                            break
+                        try:
+                            page = PageResult.from_dict(json.loads(raw))
+                        except (ValueError, KeyError):
+                            break
+                        if page.page_num != len(pages) + 1:
+                            break
+                        pages.append(page)
+                        valid_bytes += len(raw)
+                else:
+                    print("提示: 检查点与当前PDF或转换参数不匹配，重新开始转换")
+        
+        if valid_bytes:
+            self._file = open(self.journal_path, 'r+b')
+            self._file.truncate(valid_bytes)
+            self._file.seek(valid_bytes)
         else:
-            if not self.has_fitz:
-                print("提示: 未检测到图片。如需提取图片，请安装PyMuPDF: pip install PyMuPDF")
+            self._file = open(self.journal_path, 'wb')
+            self._write_line(self.fingerprint)
+        return pages
+    
+    def _write_line(self, data):
+        self._file.write(json.dumps(data, ensure_ascii=False).encode('utf-8') + b'\n')
+        self._file.flush()
+    
+    def append(self, page):
+        """追加一个已完成页面"""
+        self._write_line(page.to_dict())
+    
+    def close(self):
+        if self._file:
+            self._file.close()
+            self._file = None
+    
+    def remove(self):
+        """转换成功保存后删除日志"""
+        self.close()
+        if os.path.exists(self.journal_path):
+            os.remove(self.journal_path)
+
+
+class MarkdownRenderer:
+    """将PageResult渲染为Markdown"""
+    
+    def render_images(self, page):
+        """渲染图片引用"""
+        # 使用相对路径，确保Markdown可以正确显示（已经是正斜杠格式）
+        return ''.join(f"![图片 {img['index']}]({img['path']})\n\n" for img in page.images)
+    
+    def table_lines(self, rows, header=True):
+        """逐行渲染表格（header=True 时在第一行后添加表头分隔符）"""
+        for row_idx, row in enumerate(rows):
+            yield "| " + " | ".join(row) + " |\n"
+            if header and row_idx == 0:
+                # 添加表头分隔符
+                yield "| " + " | ".join(["---"] * len(row)) + " |\n"
+    
+    def render_table(self, rows):
+        """渲染单个表格"""
+        return "\n### 表格\n\n" + ''.join(self.table_lines(rows)) + "\n"
+    
+    def iter_page_body(self, page, skip_first_table=False):
+        """逐块渲染页面正文（不含页面标记）；最后一个表格结尾的空行不输出，由调用方在表格结束时补上"""
+        yield self.render_images(page)
+        if page.text_blocks:
+            yield page.text
+            yield "\n"
+        tables = page.tables[1:] if skip_first_table else page.tables
+        for idx, rows in enumerate(tables):
+            yield "\n\n### 表格\n\n" if idx else "\n### 表格\n\n"
+            yield from self.table_lines(rows)
+    
+    def render_page_body(self, page):
+        """渲染页面正文（不含页面标记）"""
+        return ''.join(self.iter_page_body(page)) + ("\n" if page.tables else "")
+    
+    def render_page(self, page, first=False):
+        """渲染单页（包含页面分隔符和页面标记，后续优化时会移除）"""
+        separator = "" if first else "\n---\n"
+        return f"{separator}## 第 {page.page_num} 页\n\n" + self.render_page_body(page)
+    
+    @staticmethod
+    def _page_start(page, first, markers):
+        """页面开头：页面分隔符和页面标记（markers=False 时为移除页面标记后留下的空行）"""
+        if not markers:
+            return "\n" if first else "\n\n"
+        separator = "" if first else "\n---\n"
+        return f"{separator}## 第 {page.page_num} 页\n\n"
+    
+    def iter_render(self, pages, markers=True):
+        """逐块渲染全部页面，表格逐行输出，不在内存中拼接整页或整个表格
         
-        return ''.join(markdown_content)
+        标记为续表（table_continued）且列数相同的第一个表格直接接在上一页最后一个表格之后，
+        与表头相同的第一行（每页重复的表头）省略；续表所在页面的其余内容在拼接的表格结束后按页输出。
+        markers=False 时不输出页面分隔符和页面标记（与 remove_page_markers 处理后等价）。
+        """
+        first = True
+        open_header = None  # 尚未结束的表格的表头行
+        deferred = []  # 第一个表格已拼接、其余内容等表格结束后再输出的页面
+        for page in pages:
+            continued = (open_header is not None and page.table_continued and page.tables
+                         and len(page.tables[0][0]) == len(open_header))
+            if continued:
+                rows = page.tables[0]
+                yield from self.table_lines(rows[1:] if rows[0] == open_header else rows, header=False)
+                deferred.append(page)
+                if len(page.tables) == 1:
+                    continue  # 表格可能在下一页继续
+            if open_header is not None:
+                yield "\n"
+                open_header = None
+            for pending in deferred:
+                yield self._page_start(pending, False, markers)
+                yield from self.iter_page_body(pending, skip_first_table=True)
+                if len(pending.tables) > 1:
+                    open_header = pending.tables[-1][0]
+            deferred = []
+            if continued:
+                continue
+            yield self._page_start(page, first, markers)
+            first = False
+            yield from self.iter_page_body(page)
+            if page.tables:
+                open_header = page.tables[-1][0]
+        if open_header is not None:
+            yield "\n"
+        for pending in deferred:
+            yield self._page_start(pending, False, markers)
+            yield from self.iter_page_body(pending, skip_first_table=True)
+    
+    def render(self, pages):
+        """渲染全部页面"""
+        return ''.join(self.iter_render(pages))
+    
+    def render_preview(self, pages, total_pages, timed_out=False):
+        """渲染预览：保留页面标记，页面之间标注省略的页码范围"""
+        if total_pages is None:
+            return "> 预览：时间已用完，未能读取PDF\n"
+        summary = f"> 预览：共 {total_pages} 页，包含 {len(pages)} 页（不含图片和表格）"
+        if timed_out:
+            summary += "，时间已用完，其余页面未处理"
+        parts = [summary + "\n\n"]
+        previous = 0
+        for idx, page in enumerate(pages):
+            if page.page_num > previous + 1:
+                parts.append(self._omitted(previous + 1, page.page_num - 1))
+            parts.append(self.render_page(page, first=(idx == 0)))
+            previous = page.page_num
+        if previous < total_pages:
+            parts.append(self._omitted(previous + 1, total_pages))
+        return ''.join(parts)
+    
+    @staticmethod
+    def _omitted(start, end):
+        pages = f"第 {start} 页" if start == end else f"第 {start}–{end} 页"
+        return f"\n> （{pages}已省略）\n\n"
+    
+    def page_lines(self, pages):
+        """生成与 remove_page_markers 处理后等价的行列表（不产生页面标记）"""
+        lines = []
+        partial = ''  # 尚未结束的行
+        for chunk in self.iter_render(pages, markers=False):
+            if '\n' not in chunk:
+                partial += chunk
+                continue
+            pieces = chunk.split('\n')
+            pieces[0] = partial + pieces[0]
+            partial = pieces.pop()
+            lines.extend(pieces)
+        lines.append(partial)
+        return lines
+
+
+class TextRenderer:
+    """将PageResult渲染为纯文本（表格单元格以制表符分隔，页面之间以换页符分隔）"""
+    
+    def render_page(self, page):
+        parts = []
+        if page.text_blocks:
+            parts.append(page.text)
+        for rows in page.tables:
+            parts.append('\n'.join('\t'.join(row) for row in rows))
+        return '\n\n'.join(parts) + '\n'
+    
+    def render(self, pages):
+        return '\f'.join(self.render_page(page) for page in pages)
+
+
+class JSONRenderer:
+    """将PageResult渲染为JSON（页面、文本块、表格和图片结构，不含各阶段耗时）"""
+    
+    def render(self, pages):
+        data = []
+        for page in pages:
+            page_data = page.to_dict()
+            del page_data['timings']
+            data.append(page_data)
+        return json.dumps({'page_count': len(data), 'pages': data}, ensure_ascii=False, indent=2) + '\n'
+
+
+# 可选输出格式：优化后的Markdown、优化前的Markdown、JSON结构、纯文本
+OUTPUT_FORMATS = ('md', 'raw', 'json', 'txt')
+
+
+def render_outputs(pages, formats, optimizer=None):
+    """从同一组PageResult渲染多种输出格式，返回 {格式: 内容}（PDF只需解析一次）"""
+    unknown = [fmt for fmt in formats if fmt not in OUTPUT_FORMATS]
+    if unknown:
+        raise ValueError(f"不支持的输出格式: {', '.join(unknown)}（可选: {', '.join(OUTPUT_FORMATS)}）")
+    pages = list(pages)
+    outputs = {}
+    for fmt in formats:
+        if fmt == 'md':
+            outputs[fmt] = (optimizer or MarkdownOptimizer()).optimize_pages(pages)
+        elif fmt == 'raw':
+            outputs[fmt] = MarkdownRenderer().render(pages)
+        elif fmt == 'json':
+            outputs[fmt] = JSONRenderer().render(pages)
+        else:
+            outputs[fmt] = TextRenderer().render(pages)
+    return outputs
+
+
+def output_paths(output_file, formats):
+    """各输出格式的文件路径：md 为输出文件本身，其余格式与之同名、扩展名不同"""
+    base = os.path.splitext(output_file)[0]
+    suffixes = {'md': None, 'raw': '.raw.md', 'json': '.json', 'txt': '.txt'}
+    return {fmt: output_file if suffixes[fmt] is None else base + suffixes[fmt] for fmt in formats}
+
+
+class SearchIndexWriter:
+    """全文检索索引输出（SQLite FTS5）
+    
+    转换时把每页按标题切分为记录（文档、页码、标题路径、正文），直接写入本地 SQLite FTS5 数据库，
+    检索服务无需再读取生成的Markdown重新分词。记录按批次写入，每批一个事务。
+    新建的数据库使用 trigram 分词器（支持中文子串检索），SQLite 不支持时退回 unicode61。
+    """
+    
+    TABLE = 'pages'
+    
+    def __init__(self, db_path, batch_size=500):
+        import sqlite3
+        self.db_path = db_path
+        self.batch_size = batch_size  # 每个事务写入的记录数
+        self.records = 0  # 已写入的记录数
+        self._pending = []
+        self._conn = sqlite3.connect(db_path)
+        self._create_table(sqlite3.OperationalError)
+    
+    def _create_table(self, error_type):
+        if self._conn.execute("SELECT 1 FROM sqlite_master WHERE name = ?", (self.TABLE,)).fetchone():
+            return
+        for tokenizer in ('trigram', 'unicode61'):
+            try:
+                self._conn.execute(f"CREATE VIRTUAL TABLE {self.TABLE} USING fts5("
+                                   f"document UNINDEXED, page UNINDEXED, heading, text, tokenize='{tokenizer}')")
+                return
+            except error_type as e:
+                last_error = e
+        raise RuntimeError(f"当前SQLite不支持FTS5全文索引: {last_error}")
+    
+    @staticmethod
+    def _heading_level(stripped, flags):
+        """标题级别（与优化器的标题规则一致），不是标题时返回0"""
+        if flags & LineStore.HEADING and not flags & LineStore.PAGE_MARKER:
+            return len(stripped) - len(stripped.lstrip('#'))
+        if flags & LineStore.CHAPTER:
+            return 2
+        if flags & LineStore.SECTION:
+            return 3
+        if flags & LineStore.SUBSECTION:
+            return 4
+        return 0
+    
+    @classmethod
+    def page_sections(cls, page, headings):
+        """按标题把页面切分为 (标题路径, 正文) 记录
+        
+        headings 为跨页延续的标题栈 [(级别, 标题), ...]，处理过程中会被更新。
+        表格按行转换为以空格分隔的文本，追加到页面最后一段。
+        """
+        sections = []
+        body = []
+        
+        def flush():
+            text = '\n'.join(body).strip()
+            if text:
+                sections.append((' > '.join(title for _, title in headings), text))
+            body.clear()
+        
+        for line in page.text.split('\n'):
+            stripped = line.strip()
+            flags = LineStore.classify(stripped)
+            level = cls._heading_level(stripped, flags)
+            if level:
+                flush()
+                while headings and headings[-1][0] >= level:
+                    headings.pop()
+                headings.append((level, stripped.lstrip('#').strip()))
+            elif stripped:
+                body.append(stripped)
+        for rows in page.tables:
+            for row in rows:
+                cells = [str(cell).strip() for cell in row if cell is not None and str(cell).strip()]
+                if cells:
+                    body.append(' '.join(cells))
+        flush()
+        return sections
+    
+    def add_pages(self, document, pages):
+        """写入一个文档的全部页面（先删除该文档已有的记录）"""
+        self._flush()
+        self._conn.execute(f"DELETE FROM {self.TABLE} WHERE document = ?", (document,))
+        headings = []
+        for page in pages:
+            for heading, text in self.page_sections(page, headings):
+                self._pending.append((document, page.page_num, heading, text))
+                if len(self._pending) >= self.batch_size:
+                    self._flush()
+        self._flush()
+    
+    def _flush(self):
+        """在一个事务中写入待写记录"""
+        if self._pending:
+            self._conn.executemany(f"INSERT INTO {self.TABLE} (document, page, heading, text) VALUES (?, ?, ?, ?)",
+                                   self._pending)
+            self.records += len(self._pending)
+            self._pending = []
+        self._conn.commit()
+    
+    def close(self):
+        if self._conn:
+            self._flush()
+            self._conn.close()
+            self._conn = None
+
+
+def _prefix_pattern(words):
+    """把一组字面前缀转换为按字符分支的正则（前缀树）
+    
+    re.match 的结果与 'a|b|c' 形式的选择相同（只关心是否以其中某个词开头），
+    但不需要逐个尝试每个候选词。被更短的候选词覆盖的词（如 apt-get 之于 apt）会被省略。
+    """
+    words = sorted(set(words))
+    words = [w for w in words if not any(w != other and w.startswith(other) for other in words)]
+    
+    def build(candidates):
+        if candidates == ['']:
+            return ''
+        branches = {}
+        for word in candidates:
+            branches.setdefault(word[0], []).append(word[1:])
+        alternatives = [re.escape(char) + build(rest) for char, rest in sorted(branches.items())]
+        return alternatives[0] if len(alternatives) == 1 else '(?:' + '|'.join(alternatives) + ')'
+    
+    return build(words)
+
+
+class LineStore:
+    """优化器内部的行存储
+    
+    每行的分类标志在加入时只计算一次，保存在 array 中（每行4字节），各优化步骤共享，
+    不再对每一行反复调用 strip() 和正则匹配；复制未修改的行时直接沿用已有的标志。
+    迭代和按下标取值返回原文，可以当作只读的行列表使用。
+    """
+    
+    __slots__ = ('texts', 'flags')
+    
+    # 行分类标志
+    BLANK = 1              # 空行
+    IMAGE = 1 << 1         # 图片引用 ![
+    FENCE = 1 << 2         # 代码块标记 ```
+    TABLE = 1 << 3         # 表格行 |
+    RULE = 1 << 4          # 分隔线 ---
+    HASH = 1 << 5          # 以#开头（标题或注释）
+    HEADING = 1 << 6       # Markdown标题
+    PAGE_MARKER = 1 << 7   # 页面标记（## 第 N 页）
+    CHAPTER = 1 << 8       # 章节标题（一、二、三等）
+    SECTION = 1 << 9       # 小节标题（如"2.1"）
+    SUBSECTION = 1 << 10   # 子小节标题（如"2.2.1"）
+    NUMBERED = 1 << 11     # 以"数字."开头
+    COMMAND = 1 << 12      # 命令
+    CONFIG = 1 << 13       # 配置项
+    ENV = 1 << 14          # 环境变量设置（VAR= 或 export）
+    DASH = 1 << 15         # 以-开头
+    URL = 1 << 16          # 以http(s)://开头
+    # 图片引用、代码块标记、表格、分隔线和标题不参与段落去重
+    BOUNDARY = IMAGE | FENCE | TABLE | RULE | HEADING
+    
+    _HEADING_RE = re.compile(r'#{1,6}\s+')
+    _PAGE_MARKER_RE = re.compile(r'##\s*第\s*\d+\s*页')
+    _CHAPTER_RE = re.compile(r'[一二三四五六七八九十]+ ')
+    _NUMBERED_RE = re.compile(r'\d+\.')
+    _SECTION_RE = re.compile(r'\d+\.\d+ ')
+    _SECTION_DOT_RE = re.compile(r'\d+\.\d+\.')
+    _SUBSECTION_RE = re.compile(r'\d+\.\d+\.\d+')
+    # 命令开头（不区分大小写）：系统命令、包管理器、工具命令、路径开头的命令等
+    COMMAND_PREFIXES = (
+        'yum', 'rpm', 'systemctl', 'vi', 'cp', 'tar', 'cd', './', 'sudo', 'mysqladmin', 'tail', 'cat', 'nikto',
+        '/usr/', 'apt', 'pip', 'npm', 'dnf', 'ls', 'nano', 'suricata', 'kill', 'add-apt-repository', 'apt-get',
+        'apt-cache', 'wget', 'curl', 'git', 'docker', 'kubectl', 'psql', 'mysql', 'python', 'python3', 'node',
+        'yarn', 'make', 'cmake', 'gcc', 'g++', 'javac', 'java', 'go', 'rustc', 'cargo', 'perl', 'ruby', 'php',
+        'bash', 'sh', 'zsh', 'fish', 'ssh', 'scp', 'rsync', 'grep', 'sed', 'awk', 'find', 'chmod', 'chown',
+        'mount', 'umount', 'df', 'du', 'top', 'htop', 'ps', 'killall', 'pkill', 'service', 'journalctl', 'log',
+        'head', 'less', 'more', 'vim', 'emacs', 'gedit', 'code', 'subl', 'atom', 'firefox', 'chrome',
+        'chromium', 'xdg-open', 'open', 'start', 'echo', 'printf', 'export', 'source', '.', '..', '/etc/',
+        '/var/', '/opt/', '/home/', '/root/', '/tmp/',
+    )
+    _COMMAND_RE = re.compile(_prefix_pattern(COMMAND_PREFIXES), re.IGNORECASE)
+    _CONFIG_RE = re.compile(r'[a-z_]+\.[a-z_]+:|[A-Z_]+:|[a-z_]+:\s*["\[{]')
+    _ENV_RE = re.compile(r'[A-Z_]+=|export\s')
+    _URL_RE = re.compile(r'https?://')
+    # 配置项、环境变量和链接只可能以这些字符开头
+    _IDENT_CHARS = frozenset('abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ_')
+    
+    def __init__(self, lines=()):
+        self.texts = list(lines)
+        classify = self.classify
+        self.flags = array('I', [classify(line.strip()) for line in self.texts])
+    
+    @classmethod
+    def of(cls, lines):
+        """将行列表转换为 LineStore（已经是 LineStore 时直接返回）"""
+        return lines if isinstance(lines, cls) else cls(lines)
+    
+    @classmethod
+    def concat(cls, stores):
+        """按顺序拼接多个 LineStore"""
+        result = cls()
+        for store in stores:
+            result.extend_from(store, 0, len(store))
+        return result
+    
+    @classmethod
+    def classify(cls, stripped):
+        """计算一行（已去除首尾空白）的分类标志"""
+        if not stripped:
+            return cls.BLANK
+        flags = 0
+        first = stripped[0]
+        if first == '#':
+            flags |= cls.HASH
+            if cls._HEADING_RE.match(stripped):
+                flags |= cls.HEADING
+            if cls._PAGE_MARKER_RE.match(stripped):
+                flags |= cls.PAGE_MARKER
+        elif first == '!':
+            if stripped.startswith('!['):
+                flags |= cls.IMAGE
+        elif first == '`':
+            if stripped.startswith('```'):
+                flags |= cls.FENCE
+        elif first == '|':
+            flags |= cls.TABLE
+        elif first == '-':
+            flags |= cls.DASH
+            if stripped == '---':
+                flags |= cls.RULE
+        elif first in '一二三四五六七八九十':
+            if cls._CHAPTER_RE.match(stripped):
+                flags |= cls.CHAPTER
+        elif first.isdecimal():
+            # \d 即 Unicode 十进制数字，与 str.isdecimal() 一致
+            if cls._NUMBERED_RE.match(stripped):
+                flags |= cls.NUMBERED
+                if cls._SECTION_RE.match(stripped) and not cls._SECTION_DOT_RE.match(stripped):
+                    flags |= cls.SECTION
+                if cls._SUBSECTION_RE.match(stripped):
+                    flags |= cls.SUBSECTION
+        if cls._COMMAND_RE.match(stripped):
+            flags |= cls.COMMAND
+        if first in cls._IDENT_CHARS:
+            if ':' in stripped and cls._CONFIG_RE.match(stripped):
+                flags |= cls.CONFIG
+            if cls._ENV_RE.match(stripped):
+                flags |= cls.ENV
+            if first == 'h' and cls._URL_RE.match(stripped):
+                flags |= cls.URL
+        return flags
+    
+    def stripped(self, index):
+        """第 index 行去除首尾空白后的文本（行本身没有首尾空白时不产生新字符串）"""
+        return self.texts[index].strip()
+    
+    def append(self, text):
+        """添加一行新文本（计算分类标志）"""
+        self.texts.append(text)
+        self.flags.append(self.classify(text.strip()))
+    
+    def append_from(self, other, index):
+        """复制另一个 LineStore 中的一行（沿用已计算的标志）"""
+        self.texts.append(other.texts[index])
+        self.flags.append(other.flags[index])
+    
+    def extend_from(self, other, start, end):
+        """复制另一个 LineStore 中 [start, end) 范围的行"""
+        self.texts.extend(other.texts[start:end])
+        self.flags.extend(other.flags[start:end])
+    
+    def slice(self, start, end):
+        """返回 [start, end) 范围的行组成的新 LineStore"""
+        result = LineStore()
+        result.extend_from(self, start, end)
+        return result
+    
+    def pop(self):
+        """移除并返回最后一行"""
+        self.flags.pop()
+        return self.texts.pop()
+    
+    def __len__(self):
+        return len(self.texts)
+    
+    def __iter__(self):
+        return iter(self.texts)
+    
+    def __getitem__(self, index):
+        return self.texts[index]
+
+
+class BoilerplateIndex:
+    """跨文档的样板段落索引（免责声明、版权声明、目录等反复出现的段落）
+    
+    对一批文档统计每个段落出现在多少篇文档中，出现次数达到 min_docs 的段落记为样板段落，
+    以哈希形式保存到磁盘（JSON）。优化时已知的样板段落通过一次集合查找直接移除，
+    不再参与相似度比较。段落先去除全部空白并做大小写折叠，再计算哈希。
+    """
+    
+    VERSION = 1
+    
+    def __init__(self, min_docs=3, max_entries=50000, max_candidates=1000000):
+        self.min_docs = min_docs  # 至少出现在多少篇文档中才算样板段落
+        self.max_entries = max_entries  # 索引最多保存的样板段落数（保留出现次数最多的）
+        self.max_candidates = max_candidates  # 构建时最多统计的候选段落数
+        self.documents = 0
+        self.counts = {}  # 段落哈希 -> 包含该段落的文档数
+        self.entries = set()  # 样板段落哈希
+    
+    @staticmethod
+    def paragraph_key(text):
+        """段落的归一化哈希"""
+        normalized = re.sub(r'\s+', '', text).casefold()
+        return hashlib.blake2b(normalized.encode('utf-8'), digest_size=8).hexdigest()
+    
+    def __contains__(self, text):
+        return self.paragraph_key(text) in self.entries
+    
+    def __len__(self):
+        return len(self.entries)
+    
+    def add_document(self, paragraphs):
+        """统计一篇文档的段落（同一文档中重复的段落只计一次）"""
+        self.documents += 1
+        for key in {self.paragraph_key(text) for text in paragraphs}:
+            self.counts[key] = self.counts.get(key, 0) + 1
+        if len(self.counts) > self.max_candidates:
+            self._prune()
+    
+    def _prune(self):
+        """候选过多时依次丢弃出现次数最少的段落，直到减少到上限的一半（计数因此是近似的）"""
+        threshold = 1
+        while len(self.counts) > self.max_candidates // 2:
+            self.counts = {key: count for key, count in self.counts.items() if count > threshold}
+            threshold += 1
+    
+    def finalize(self):
+        """根据统计结果确定样板段落（超过 max_entries 时保留出现次数最多的）"""
+        frequent = [(count, key) for key, count in self.counts.items() if count >= self.min_docs]
+        frequent.sort(reverse=True)
+        self.counts = {key: count for count, key in frequent[:self.max_entries]}
+        self.entries = set(self.counts)
+    
+    def save(self, path):
+        """写入索引文件"""
+        data = {
+            'version': self.VERSION,
+            'documents': self.documents,
+            'min_docs': self.min_docs,
+            'entries': self.counts,
+        }
+        write_text_atomic(path, json.dumps(data, ensure_ascii=False, sort_keys=True))
+    
+    @classmethod
+    def load(cls, path):
+        """读取索引文件（版本不兼容时抛出 ValueError）"""
+        with open(path, encoding='utf-8') as f:
+            data = json.load(f)
+        if data.get('version') != cls.VERSION:
+            raise ValueError(f"样板段落索引版本不兼容: {path}，请使用 --rebuild-boilerplate-index 重建")
+        index = cls(min_docs=data['min_docs'])
+        index.documents = data['documents']
+        index.counts = data['entries']
+        index.entries = set(index.counts)
+        return index
+
+
+def rebuild_boilerplate_index(index_path, inputs, min_docs=3, max_entries=50000, engine='pdfplumber'):
+    """扫描语料（PDF或已转换的Markdown，目录会递归查找），重建样板段落索引并保存"""
+    files = collect_input_files(inputs, ('.pdf', '.md'))
+    
+    index = BoilerplateIndex(min_docs=min_docs, max_entries=max_entries)
+    optimizer = MarkdownOptimizer()
+    for num, path in enumerate(files, 1):
+        if path.lower().endswith('.pdf'):
+            # PDF先转换（图片写入临时目录，用完删除）
+            with tempfile.TemporaryDirectory(prefix='ptom_boilerplate_') as tmp_dir:
+                converter = PDFToMarkdownConverter(output_dir=tmp_dir, engine=engine,
+                                                   progress=ProgressReporter(mode='quiet'))
+                pages = converter.convert_pages(path)
+            lines = MarkdownRenderer().page_lines(pages)
+        else:
+            with open(path, encoding='utf-8') as f:
+                lines = f.read().split('\n')
+        paragraphs = optimizer.dedup_paragraphs(lines)
+        index.add_document(paragraphs)
+        print(f"  [{num}/{len(files)}] {os.path.basename(path)}: {len(paragraphs)} 个段落")
+    
+    index.finalize()
+    index.save(index_path)
+    print(f"✓ 样板段落索引已重建: {index.documents} 篇文档，{len(index)} 个样板段落 -> {index_path}")
+    return index
+
+
+def _init_similarity_worker(texts, similarity_window=None):
+    """进程池初始化：各工作进程共享全部待比较段落"""
+    global _SIMILARITY_TEXTS, _SIMILARITY_OPTIMIZER
+    _SIMILARITY_TEXTS = texts
+    _SIMILARITY_OPTIMIZER = MarkdownOptimizer(similarity_window=similarity_window)
+
+
+def _first_similar_worker(index_range):
+    """工作进程：对区间内的每个段落，找出第一个与之相似（>0.8）的更早段落，没有则为None"""
+    optimizer = _SIMILARITY_OPTIMIZER
+    texts = _SIMILARITY_TEXTS
+    start, end = index_range
+    window = optimizer.similarity_window
+    first = max(0, start - window) if window else 0
+    profiles = {q: optimizer._similarity_profile(texts[q]) for q in range(first, end)}
+    result = []
+    for idx in range(start, end):
+        candidates = range(max(0, idx - window) if window else 0, idx)
+        result.append(optimizer._find_similar(texts[idx], profiles[idx], texts, profiles, candidates))
+    return result
+
+
+def _optimize_chunk_worker(args):
+    """工作进程：对一个分块执行局部优化步骤"""
+    chunk, is_first = args
+    return MarkdownOptimizer().optimize_local(chunk, is_first=is_first)
 
 
 class MarkdownOptimizer:
     """Markdown优化器"""
     
-    def __init__(self):
-        pass
+    PARALLEL_MIN_LINES = 5000  # 行数达到该值才使用进程池分块优化
+    PARALLEL_MIN_PARAGRAPHS = 200  # 待去重段落数达到该值才并行计算相似度
+    SIMILARITY_WINDOW = 200  # 启用相似度窗口时（--similarity-window）建议的窗口大小
+    BITSET_MIN_RATIO = 16  # 逐位置比较的字符数超过两文本长度之和的这么多倍时，文本相似度改用位并行计算
+    TABLE_BLOCK_CHARS = 1 << 16  # 表格与前文比较相似度时，每块处理的表格字符数
+    
+    def __init__(self, workers=1, boilerplate=None, similarity_window=None):
+        self.workers = workers or 1  # 优化使用的进程数（1表示串行）
+        # 段落相似度只与最近这么多个段落内出现过的已保留段落比较（None表示与全部已保留段落比较）
+        self.similarity_window = similarity_window or None
+        self.boilerplate = boilerplate  # 跨文档的样板段落索引（BoilerplateIndex），None表示不使用
+        self.boilerplate_removed = 0  # 通过索引移除的样板段落数
         
     def remove_page_markers(self, lines):
         """移除页面标记和分隔符（保留图片引用）"""
-        result = []
-        for line in lines:
-            # 跳过页面标记
-            if re.match(r'^##\s*第\s*\d+\s*页', line.strip()):
-                continue
-            # 跳过页面分隔符
-            if line.strip() == '---' and result and result[-1].strip() == '':
+        store = LineStore.of(lines)
+        result = LineStore()
+        run_start = 0  # 未修改的行按连续区间整体复制
+        last_blank = False  # 上一个保留的行是否为空行
+        for i, flags in enumerate(store.flags):
+            # 跳过页面标记和页面分隔符
+            if flags & LineStore.PAGE_MARKER or (flags & LineStore.RULE and last_blank):
+                result.extend_from(store, run_start, i)
+                run_start = i + 1
                 continue
-            # 保留图片引用（以![开头的行）
-            if line.strip().startswith('!['):
-                result.append(line)
-                continue
-            result.append(line)
+            last_blank = bool(flags & LineStore.BLANK)
+        result.extend_from(store, run_start, len(store))
         return result
     
-    def fix_title_hierarchy(self, lines):
-        """修复标题层级"""
-        result = []
-        seen_first_title = False  # 标记是否已经处理过第一个标题
+    def optimize_light(self, content):
+        """轻量优化（用于预览）：只修复标题层级、格式化链接和整理空行，保留页面标记，不做去重和表格、代码块处理"""
+        lines = self.fix_title_hierarchy(content.split('\n'))
+        lines = self.format_links(lines)
+        lines = self.clean_extra_blank_lines(lines)
+        return '\n'.join(lines.texts)
+    
+    def fix_title_hierarchy(self, lines, seen_first_title=False):
+        """修复标题层级（seen_first_title=True 时不再自动添加主标题，用于非首个分块）"""
+        store = LineStore.of(lines)
+        flags_list = store.flags
+        result = LineStore()
+        run_start = 0  # 未修改的行按连续区间整体复制
         
-        for i, line in enumerate(lines):
-            stripped = line.strip()
+        for i in range(len(store)):
+            flags = flags_list[i]
             
             # 跳过空行和图片引用
-            if not stripped or stripped.startswith('!['):
-                result.append(line)
+            if flags & (LineStore.BLANK | LineStore.IMAGE):
                 continue
             
             # 如果已经是Markdown标题格式，直接保留（避免重复添加）
-            if stripped.startswith('#'):
-                result.append(line)
-                if not seen_first_title:
-                    seen_first_title = True
+            if flags & LineStore.HASH:
+                seen_first_title = True
                 continue
             
             # 如果已经看到第一个标题，就不再自动添加主标题
             # 处理主标题（如果文档开头有标题，且还没有看到任何标题）
-            if not seen_first_title and len(result) < 5 and not stripped.startswith('|'):
+            if not seen_first_title and len(result) + i - run_start < 5 and not flags & LineStore.TABLE:
+                stripped = store.stripped(i)
                 # 检查是否是标题（短行且不包含标点，且不是命令或配置项）
                 is_command = re.match(r'^(yum|rpm|systemctl|vi|cp|tar|cd|\./|sudo|mysqladmin|tail|cat|nikto|/usr/|apt|pip|npm|dnf|ls|nano|suricata|kill|add-apt-repository)', stripped, re.IGNORECASE)
                 is_config = re.match(r'^[A-Z_]+:', stripped) or re.match(r'^[a-z_]+\.[a-z_]+:', stripped)
                 
                 if len(stripped) < 50 and not any(c in stripped for c in '。，、；：') and not is_command and not is_config:
-                    # 检查下一行是否是章节标题（一、二、三等）
-                    next_stripped = ''
-                    if i + 1 < len(lines):
-                        next_stripped = lines[i + 1].strip()
-                    
-                    # 如果下一行是章节标题，说明当前行可能是主标题
+                    # 如果下一行是章节标题（一、二、三等），说明当前行可能是主标题
                     # 但为了避免重复，检查是否已经有主标题格式
-                    if re.match(r'^[一二三四五六七八九十]+ ', next_stripped):
-                        # 下一行是章节标题，当前行可能是主标题
+                    if i + 1 < len(store) and flags_list[i + 1] & LineStore.CHAPTER:
+                        result.extend_from(store, run_start, i)
+                        run_start = i
                         # 检查是否在结果中已经有主标题
                         has_main_title = False
-                        for prev_line in result:
+                        for prev_line in result.texts:
                             if prev_line.strip().startswith('# ') and len(prev_line.strip()) < 100:
                                 has_main_title = True
                                 break
@@ -386,290 +2088,205 @@ class MarkdownOptimizer:
                         if not has_main_title:
                             result.append('# ' + stripped)
                             result.append('')
+                            run_start = i + 1
                             seen_first_title = True
                             continue
             
-            # 处理章节标题（一、二、三等）
-            if re.match(r'^[一二三四五六七八九十]+ ', stripped):
-                if not stripped.startswith('##'):
-                    result.append('## ' + stripped)
-                else:
-                    result.append(line)
-                result.append('')
-                if not seen_first_title:
-                    seen_first_title = True
-                continue
-            
-            # 处理小节标题（如"2.1"）
-            if re.match(r'^\d+\.\d+ ', stripped) and not re.match(r'^\d+\.\d+\.', stripped):
-                if not stripped.startswith('###'):
-                    result.append('### ' + stripped)
-                else:
-                    result.append(line)
-                result.append('')
-                continue
-            
-            # 处理子小节标题（如"2.2.1"）
-            if re.match(r'^\d+\.\d+\.\d+', stripped):
-                if not stripped.startswith('####'):
-                    result.append('#### ' + stripped)
-                else:
-                    result.append(line)
-                result.append('')
+            # 处理章节标题（一、二、三等）、小节标题（如"2.1"）和子小节标题（如"2.2.1"）
+            if flags & LineStore.CHAPTER:
+                prefix = '## '
+                seen_first_title = True
+            elif flags & LineStore.SECTION:
+                prefix = '### '
+            elif flags & LineStore.SUBSECTION:
+                prefix = '#### '
+            else:
                 continue
-            
-            result.append(line)
+            result.extend_from(store, run_start, i)
+            run_start = i + 1
+            result.append(prefix + store.stripped(i))
+            result.append('')
+        
+        result.extend_from(store, run_start, len(store))
         return result
     
     def optimize_code_blocks(self, lines):
         """优化代码块使用"""
-        result = []
+        store = LineStore.of(lines)
+        flags_list = store.flags
+        total = len(store)
+        result = LineStore()
+        run_start = 0  # 未修改的行按连续区间整体复制
         i = 0
         
-        while i < len(lines):
-            line = lines[i]
-            stripped = line.strip()
+        while i < total:
+            flags = flags_list[i]
+            if not flags & (LineStore.FENCE | LineStore.COMMAND | LineStore.CONFIG):
+                i += 1
+                continue
+            # 以下处理需要查看已输出的内容，先写入待复制的行
+            result.extend_from(store, run_start, i)
+            run_start = i
             
             # 检测代码块开始
-            if stripped.startswith('```'):
-                lang = stripped[3:].strip()
-                code_lines = []
+            if flags & LineStore.FENCE:
+                lang = store.stripped(i)[3:].strip()
                 i += 1
                 
                 # 收集代码块内容
-                while i < len(lines):
-                    if lines[i].strip().startswith('```'):
-                        break
-                    code_lines.append(lines[i])
+                code_start = i
+                while i < total and not flags_list[i] & LineStore.FENCE:
                     i += 1
+                code_end = i
                 
                 # 跳过结束标记
-                if i < len(lines):
+                if i < total:
                     i += 1
                 
-                # 处理代码块
-                code_content = '\n'.join(code_lines).strip()
+                # 处理代码块（全是空行的代码块直接丢弃）
+                has_code = any(not flags_list[k] & LineStore.BLANK for k in range(code_start, code_end))
                 
                 # 检查是否可以与下一个代码块合并
-                if code_content and self._can_merge_with_next(lines, i, lang):
-                    merged = self._merge_code_blocks(code_lines, lines, i, lang)
-                    result.extend(merged['lines'])
-                    i = merged['next_index']
+                if has_code and self._can_merge_with_next(store, i, lang):
+                    merged = self._merge_code_blocks((code_start, code_end), store, i, lang)
+                    result.extend_from(merged['lines'], 0, len(merged['lines']))
+                    i = run_start = merged['next_index']
                     continue
                 
                 # 单独处理代码块
-                if code_content:
+                if has_code:
                     result.append(f'```{lang}')
-                    for cl in code_lines:
-                        result.append(cl)
+                    result.extend_from(store, code_start, code_end)
                     result.append('```')
                     result.append('')
                 
+                run_start = i
                 continue
             
-            # 检测命令（扩展命令识别模式）
-            # 包括：系统命令、包管理器、工具命令、路径开头的命令等
-            command_pattern = r'^(yum|rpm|systemctl|vi|cp|tar|cd|\./|sudo|mysqladmin|tail|cat|nikto|/usr/|apt|pip|npm|dnf|ls|nano|suricata|kill|add-apt-repository|apt-get|apt-cache|wget|curl|git|docker|kubectl|psql|mysql|python|python3|node|npm|yarn|make|cmake|gcc|g\+\+|javac|java|go|rustc|cargo|perl|ruby|php|bash|sh|zsh|fish|ssh|scp|rsync|grep|sed|awk|find|chmod|chown|mount|umount|df|du|top|htop|ps|killall|pkill|service|journalctl|log|tail|head|less|more|vim|emacs|nano|gedit|code|subl|atom|firefox|chrome|chromium|xdg-open|open|start|echo|printf|export|source|\.|\.\.|/etc/|/var/|/usr/|/opt/|/home/|/root/|/tmp/)'
-            
-            if re.match(command_pattern, stripped, re.IGNORECASE):
+            # 检测命令（扩展命令识别模式，见 LineStore._COMMAND_RE）
+            if flags & LineStore.COMMAND:
                 # 检查前面是否已经有代码块
-                if not result or not result[-1].strip().startswith('```'):
+                if not result or not result.flags[-1] & LineStore.FENCE:
                     result.append('```bash')
-                    result.append(line)
+                    result.append_from(store, i)
                     # 继续收集相关命令
                     j = i + 1
-                    while j < len(lines):
-                        next_line = lines[j]
-                        next_stripped = next_line.strip()
+                    while j < total:
+                        next_flags = flags_list[j]
                         
                         # 空行时，检查下一行是否还是命令
-                        if next_stripped == '':
-                            # 跳过空行，检查下一行
-                            if j + 1 < len(lines):
-                                next_next = lines[j + 1].strip()
-                                if re.match(command_pattern, next_next, re.IGNORECASE):
-                                    result.append('')
-                                    j += 1
-                                    continue
+                        if next_flags & LineStore.BLANK:
+                            if j + 1 < total and flags_list[j + 1] & LineStore.COMMAND:
+                                result.append('')
+                                j += 1
+                                continue
                             break
                         
                         # 如果遇到标题，停止收集
-                        if re.match(r'^#{1,6}\s+', next_stripped) or re.match(r'^\d+\.', next_stripped):
+                        if next_flags & (LineStore.HEADING | LineStore.NUMBERED):
                             break
                         
-                        # 注释行也包含在代码块中
-                        if next_stripped.startswith('#'):
-                            result.append(next_line)
-                            j += 1
-                        # 继续收集命令
-                        elif re.match(command_pattern, next_stripped, re.IGNORECASE):
-                            result.append(next_line)
-                            j += 1
-                        # 配置项也可能在同一代码块中（如环境变量设置）
-                        elif re.match(r'^[A-Z_]+=', next_stripped) or re.match(r'^export\s+', next_stripped):
-                            result.append(next_line)
+                        # 注释行、命令和配置项（如环境变量设置）都包含在代码块中
+                        if next_flags & (LineStore.HASH | LineStore.COMMAND | LineStore.ENV):
+                            result.append_from(store, j)
                             j += 1
                         else:
                             break
                     result.append('```')
                     result.append('')
-                    i = j
+                    i = run_start = j
                     continue
             
-            # 检测配置项（扩展配置项识别模式）
-            # 包括：YAML配置（如 network.host:）、环境变量（如 HOME_NET:）、带引号的配置等
-            config_patterns = [
-                r'^[a-z_]+\.[a-z_]+:',  # network.host:
-                r'^[A-Z_]+:\s*',  # HOME_NET:, HTTP_PORTS: (包括后面可能有引号的情况)
-                r'^[a-z_]+:\s*["\[{]',  # 带引号或括号的配置项
-            ]
-            
-            is_config = False
-            for pattern in config_patterns:
-                if re.match(pattern, stripped) and not stripped.startswith('```'):
-                    is_config = True
-                    break
-            
-            if is_config:
+            # 检测配置项（扩展配置项识别模式，见 LineStore._CONFIG_RE）
+            if flags & LineStore.CONFIG:
                 # 检查前面是否有未闭合的yaml代码块
-                if result and result[-1].strip() == '```':
+                if result and result.stripped(-1) == '```':
                     result.pop()
                     result.append('```yaml')
-                    result.append(line)
-                    # 继续收集配置项
-                    j = i + 1
-                    while j < len(lines):
-                        next_line = lines[j]
-                        next_stripped = next_line.strip()
-                        
-                        if next_stripped == '':
-                            # 空行时，检查下一行是否还是配置项
-                            if j + 1 < len(lines):
-                                next_next = lines[j + 1].strip()
-                                is_next_config = False
-                                for pattern in config_patterns:
-                                    if re.match(pattern, next_next):
-                                        is_next_config = True
-                                        break
-                                if is_next_config:
-                                    result.append('')
-                                    j += 1
-                                    continue
-                            break
-                        
-                        # 如果遇到标题或命令，停止收集
-                        if re.match(r'^#{1,6}\s+', next_stripped) or re.match(r'^\d+\.', next_stripped):
-                            break
-                        
-                        # 检查是否是配置项或注释
-                        is_next_config = False
-                        for pattern in config_patterns:
-                            if re.match(pattern, next_stripped):
-                                is_next_config = True
-                                break
-                        
-                        if is_next_config or next_stripped.startswith('#') or next_stripped.startswith('-') or next_stripped.startswith('|'):
-                            result.append(next_line)
-                            j += 1
-                        elif re.match(r'^(yum|rpm|systemctl|vi|cp|tar|cd|\./|dnf|ls|nano|suricata)', next_stripped, re.IGNORECASE):
-                            break
-                        else:
-                            break
-                    result.append('```')
-                    result.append('')
-                    i = j
+                    result.append_from(store, i)
+                    i = run_start = self._collect_config_lines(store, i + 1, result)
                     continue
                 # 如果前面没有代码块，创建一个新的
-                elif not result or not result[-1].strip().startswith('```'):
+                elif not result or not result.flags[-1] & LineStore.FENCE:
                     # 检查前面是否有说明文字
-                    if result and result[-1].strip() and not result[-1].strip().startswith('#'):
+                    if result and not result.flags[-1] & (LineStore.BLANK | LineStore.HASH):
                         result.append('')
                     result.append('```yaml')
-                    result.append(line)
-                    # 继续收集配置项
-                    j = i + 1
-                    while j < len(lines):
-                        next_line = lines[j]
-                        next_stripped = next_line.strip()
-                        
-                        if next_stripped == '':
-                            # 空行时，检查下一行是否还是配置项
-                            if j + 1 < len(lines):
-                                next_next = lines[j + 1].strip()
-                                is_next_config = False
-                                for pattern in config_patterns:
-                                    if re.match(pattern, next_next):
-                                        is_next_config = True
-                                        break
-                                if is_next_config:
-                                    result.append('')
-                                    j += 1
-                                    continue
-                            break
-                        
-                        if re.match(r'^#{1,6}\s+', next_stripped) or re.match(r'^\d+\.', next_stripped):
-                            break
-                        
-                        # 检查是否是配置项或注释
-                        is_next_config = False
-                        for pattern in config_patterns:
-                            if re.match(pattern, next_stripped):
-                                is_next_config = True
-                                break
-                        
-                        if is_next_config or next_stripped.startswith('#') or next_stripped.startswith('-') or next_stripped.startswith('|'):
-                            result.append(next_line)
-                            j += 1
-                        elif re.match(r'^(yum|rpm|systemctl|vi|cp|tar|cd|\./|dnf|ls|nano|suricata)', next_stripped, re.IGNORECASE):
-                            break
-                        else:
-                            break
-                    result.append('```')
-                    result.append('')
-                    i = j
+                    result.append_from(store, i)
+                    i = run_start = self._collect_config_lines(store, i + 1, result)
                     continue
-                else:
-                    result.append(line)
-            else:
-                result.append(line)
             
+            # 其余情况原样保留（留在待复制区间中）
             i += 1
         
+        result.extend_from(store, run_start, total)
         return result
     
+    def _collect_config_lines(self, store, j, result):
+        """从第j行开始继续收集配置项并关闭yaml代码块，返回下一个待处理的行下标"""
+        total = len(store)
+        flags_list = store.flags
+        while j < total:
+            next_flags = flags_list[j]
+            
+            if next_flags & LineStore.BLANK:
+                # 空行时，检查下一行是否还是配置项
+                if j + 1 < total and flags_list[j + 1] & LineStore.CONFIG:
+                    result.append('')
+                    j += 1
+                    continue
+                break
+            
+            # 如果遇到标题，停止收集
+            if next_flags & (LineStore.HEADING | LineStore.NUMBERED):
+                break
+            
+            # 配置项、注释、列表和表格行继续收集；遇到命令或其他内容停止
+            if next_flags & (LineStore.CONFIG | LineStore.HASH | LineStore.DASH | LineStore.TABLE):
+                result.append_from(store, j)
+                j += 1
+            else:
+                break
+        result.append('```')
+        result.append('')
+        return j
+    
     def _can_merge_with_next(self, lines, start_idx, lang):
         """检查是否可以与下一个代码块合并"""
+        store = LineStore.of(lines)
         idx = start_idx
-        while idx < len(lines) and lines[idx].strip() == '':
+        while idx < len(store) and store.flags[idx] & LineStore.BLANK:
             idx += 1
         
-        if idx >= len(lines):
+        if idx >= len(store):
             return False
         
-        if not lines[idx].strip().startswith('```'):
+        if not store.flags[idx] & LineStore.FENCE:
             return False
         
-        next_lang = lines[idx].strip()[3:].strip()
+        next_lang = store.stripped(idx)[3:].strip()
         return (next_lang == lang) or (lang == 'bash' and next_lang == 'bash') or (not lang and not next_lang)
     
     def _merge_code_blocks(self, first_code, lines, start_idx, lang):
-        """合并代码块"""
-        result_lines = []
+        """合并代码块（first_code 为第一个代码块内容所在的行下标范围）"""
+        store = LineStore.of(lines)
+        total = len(store)
+        result_lines = LineStore()
         result_lines.append(f'```{lang}')
-        result_lines.extend(first_code)
+        result_lines.extend_from(store, *first_code)
         
         idx = start_idx
-        while idx < len(lines) and lines[idx].strip() == '':
+        while idx < total and store.flags[idx] & LineStore.BLANK:
             idx += 1
         
-        if idx < len(lines) and lines[idx].strip().startswith('```'):
+        if idx < total and store.flags[idx] & LineStore.FENCE:
             idx += 1
         
-        while idx < len(lines):
-            if lines[idx].strip().startswith('```'):
-                idx += 1
-                break
-            result_lines.append(lines[idx])
+        code_start = idx
+        while idx < total and not store.flags[idx] & LineStore.FENCE:
+            idx += 1
+        result_lines.extend_from(store, code_start, idx)
+        if idx < total:
             idx += 1
         
         result_lines.append('```')
@@ -679,119 +2296,204 @@ class MarkdownOptimizer:
     
     def format_links(self, lines):
         """格式化链接"""
-        result = []
-        for line in lines:
+        store = LineStore.of(lines)
+        result = LineStore()
+        run_start = 0
+        for i, flags in enumerate(store.flags):
             # 处理URL链接
-            if re.match(r'^https?://', line.strip()) and '[' not in line and ']' not in line:
-                url = line.strip()
+            if flags & LineStore.URL and '[' not in store.texts[i] and ']' not in store.texts[i]:
+                result.extend_from(store, run_start, i)
+                run_start = i + 1
+                url = store.stripped(i)
                 result.append(f'参考链接: [{url}]({url})')
                 result.append('')
-                continue
-            result.append(line)
+        result.extend_from(store, run_start, len(store))
         return result
     
     def clean_extra_blank_lines(self, lines):
         """清理多余的空行（最多连续2个）"""
-        result = []
+        store = LineStore.of(lines)
+        result = LineStore()
+        run_start = 0
         empty_count = 0
         
-        for line in lines:
-            if line.strip() == '':
+        for i, flags in enumerate(store.flags):
+            if flags & LineStore.BLANK:
                 empty_count += 1
-                if empty_count <= 2:
-                    result.append('')
+                # 超出的空行删除，只含空白字符的空行替换为''
+                if empty_count > 2 or store.texts[i]:
+                    result.extend_from(store, run_start, i)
+                    run_start = i + 1
+                    if empty_count <= 2:
+                        result.append('')
             else:
                 empty_count = 0
-                result.append(line)
+        result.extend_from(store, run_start, len(store))
         
         return result
     
+    def _paragraph_events(self, store):
+        """将行切分为事件：('line', 行下标)、('blank',) 或 ('para', 起始下标, 结束下标, 结束方式, 段落文本)
+        
+        结束方式为 'blank'（空行结束）、'boundary'（遇到不参与去重的行）或 'end'（文档结束）。
+        """
+        events = []
+        start = None
+        for i, flags in enumerate(store.flags):
+            if flags & LineStore.BOUNDARY:
+                if start is not None:
+                    events.append(('para', start, i, 'boundary', ' '.join(store.texts[start:i]).strip()))
+                    start = None
+                events.append(('line', i))
+            elif flags & LineStore.BLANK:
+                # 空行表示段落结束
+                if start is not None:
+                    events.append(('para', start, i, 'blank', ' '.join(store.texts[start:i]).strip()))
+                    start = None
+                else:
+                    events.append(('blank',))
+            elif start is None:
+                start = i
+        # 处理最后一个段落
+        if start is not None:
+            events.append(('para', start, len(store), 'end', ' '.join(store.texts[start:]).strip()))
+        return events
+    
+    def _find_similar(self, text, profile, texts, profiles, candidates):
+        """在 candidates 中按顺序找出第一个与 text 相似度>0.8的段落下标"""
+        for q in candidates:
+            if (self._may_be_similar(profile, profiles[q], 0.8)
+                    and self._overlap_ratio(profile[0], profiles[q][0]) > 0.8):
+                return q
+        return None
+    
+    def _resolve_duplicates(self, texts, first_similar=None):
+        """按文档顺序判断每个段落是否保留：与已保留段落相同或相似度>0.8即为重复
+        
+        去除空白后完全相同的段落在全文范围内查找；相似度默认与全部已保留段落比较。
+        设置 similarity_window 时只与窗口内的已保留段落比较：窗口包含最近 similarity_window 个段落内
+        出现过（自身或与之重复的段落）的已保留段落，反复出现的页眉页脚等段落因此一直留在窗口中，
+        而长文档的耗时与段落数成线性关系（相距更远的近似重复段落不再移除）。
+        first_similar 为并行预先算好的每个段落在窗口范围内第一个相似的段落；
+        它已被保留时当前段落即为重复，否则只需继续检查其后的已保留段落。
+        """
+        kept = []
+        seen = {}  # 已保留段落去除空白后的文本 -> 段落下标
+        window = {}  # 窗口内已保留段落的下标 -> 预筛选特征（按下标递增）
+        recent = {}  # 窗口内已保留段落的下标 -> 最近出现的段落下标（按最近出现的先后排列）
+        for idx, text in enumerate(texts):
+            limit = idx - self.similarity_window if self.similarity_window else -1
+            while recent and recent[next(iter(recent))] < limit:
+                q = next(iter(recent))
+                del recent[q], window[q]
+            clean = re.sub(r'\s+', '', text)
+            q = seen.get(clean)
+            profile = None
+            if q is None:
+                profile = self._similarity_profile(text)
+                if first_similar is None:
+                    q = self._find_similar(text, profile, texts, window, window)
+                else:
+                    # 并行结果只覆盖最近的段落，更早但仍在窗口中的已保留段落需要先单独比较
+                    q = self._find_similar(text, profile, texts, window, [k for k in window if k < limit])
+                    if q is None:
+                        q = first_similar[idx]
+                        if q is not None and not kept[q]:
+                            q = self._find_similar(text, profile, texts, window, [k for k in window if k > q])
+            kept.append(q is None)
+            if q is None:
+                seen[clean] = idx
+                window[idx] = profile
+                recent[idx] = idx
+            elif q in recent:
+                del recent[q]
+                recent[q] = idx
+        return kept
+    
+    def _first_similar_parallel(self, texts):
+        """使用进程池计算每个段落第一个相似的更早段落"""
+        from concurrent.futures import ProcessPoolExecutor
+        # 各段落的比较次数不同，切成较小的区间交给进程池调度
+        block = max(16, len(texts) // (self.workers * 16))
+        ranges = [(start, min(start + block, len(texts))) for start in range(0, len(texts), block)]
+        first_similar = []
+        with ProcessPoolExecutor(max_workers=self.workers, initializer=_init_similarity_worker,
+                                 initargs=(texts, self.similarity_window)) as pool:
+            for part in pool.map(_first_similar_worker, ranges):
+                first_similar.extend(part)
+        return first_similar
+    
     def remove_duplicate_content(self, lines):
         """移除重复的内容段落"""
-        result = []
-        seen_paragraphs = {}  # 存储已见过的段落（用于去重）
-        current_paragraph = []
+        store = LineStore.of(lines)
+        events = self._paragraph_events(store)
         
-        i = 0
-        while i < len(lines):
-            line = lines[i]
-            stripped = line.strip()
-            
-            # 跳过图片引用、代码块标记、表格标记等
-            if (stripped.startswith('![') or 
-                stripped.startswith('```') or 
-                stripped.startswith('|') or
-                stripped == '---' or
-                re.match(r'^#{1,6}\s+', stripped)):
-                # 如果当前有段落，先处理它
-                if current_paragraph:
-                    para_text = ' '.join(current_paragraph).strip()
-                    if para_text and len(para_text) > 20:  # 只处理较长的段落
-                        # 检查是否与已见过的段落相似（相似度>80%）
-                        is_duplicate = False
-                        for seen_text, seen_count in seen_paragraphs.items():
-                            if self._text_similarity(para_text, seen_text) > 0.8:
-                                is_duplicate = True
-                                seen_paragraphs[seen_text] = seen_count + 1
-                                break
-                        
-                        if not is_duplicate:
-                            result.extend(current_paragraph)
-                            seen_paragraphs[para_text] = 1
-                    else:
-                        result.extend(current_paragraph)
-                    current_paragraph = []
-                
-                result.append(line)
-                i += 1
-                continue
-            
-            # 空行表示段落结束
-            if stripped == '':
-                if current_paragraph:
-                    para_text = ' '.join(current_paragraph).strip()
-                    if para_text and len(para_text) > 20:
-                        is_duplicate = False
-                        for seen_text, seen_count in seen_paragraphs.items():
-                            if self._text_similarity(para_text, seen_text) > 0.8:
-                                is_duplicate = True
-                                seen_paragraphs[seen_text] = seen_count + 1
-                                break
-                        
-                        if not is_duplicate:
-                            result.extend(current_paragraph)
-                            result.append('')
-                            seen_paragraphs[para_text] = 1
-                        else:
-                            # 是重复的，跳过
-                            pass
-                    else:
-                        result.extend(current_paragraph)
-                        result.append('')
-                    current_paragraph = []
-                else:
-                    result.append('')
-            else:
-                current_paragraph.append(line)
-            
-            i += 1
+        # 只处理较长的段落；已知的样板段落直接移除，不参与相似度比较
+        boilerplate = set()
+        if self.boilerplate:
+            boilerplate = {idx for idx, event in enumerate(events)
+                           if event[0] == 'para' and len(event[4]) > 20 and event[4] in self.boilerplate}
+            self.boilerplate_removed += len(boilerplate)
+        texts = [event[4] for idx, event in enumerate(events)
+                 if event[0] == 'para' and len(event[4]) > 20 and idx not in boilerplate]
+        first_similar = None
+        if self.workers > 1 and len(texts) >= self.PARALLEL_MIN_PARAGRAPHS:
+            first_similar = self._first_similar_parallel(texts)
+        kept = iter(self._resolve_duplicates(texts, first_similar))
         
-        # 处理最后一个段落
-        if current_paragraph:
-            para_text = ' '.join(current_paragraph).strip()
-            if para_text and len(para_text) > 20:
-                is_duplicate = False
-                for seen_text, seen_count in seen_paragraphs.items():
-                    if self._text_similarity(para_text, seen_text) > 0.8:
-                        is_duplicate = True
-                        break
-                
-                if not is_duplicate:
-                    result.extend(current_paragraph)
+        result = LineStore()
+        for idx, event in enumerate(events):
+            if idx in boilerplate:
+                continue  # 样板段落，跳过（包括结束段落的空行）
+            if event[0] == 'line':
+                result.append_from(store, event[1])
+            elif event[0] == 'blank':
+                result.append('')
             else:
-                result.extend(current_paragraph)
+                _, start, end, ending, para_text = event
+                if len(para_text) > 20 and not next(kept):
+                    continue  # 是重复的，跳过（包括结束段落的空行）
+                result.extend_from(store, start, end)
+                if ending == 'blank':
+                    result.append('')
+        return result
+    
+    def dedup_paragraphs(self, lines):
+        """返回参与段落去重的段落文本（与 optimize 中 remove_duplicate_content 看到的一致，用于构建样板段落索引）"""
+        store = self.clean_duplicate_tables(self.remove_page_markers(LineStore.of(lines)))
+        return [event[4] for event in self._paragraph_events(store) if event[0] == 'para' and len(event[4]) > 20]
+    
+    def _similarity_profile(self, text):
+        """相似度预筛选用的特征：去除空白后的文本和三字符组集合
+        
+        同一三字符组的第k次出现（k>0）记为不同的元素，集合交集的大小即为两者共有的三字符组数。
+        """
+        clean = re.sub(r'\s+', '', text)
+        counts = {}
+        grams = []
+        for i in range(len(clean) - 2):
+            gram = clean[i:i + 3]
+            k = counts.get(gram, 0)
+            counts[gram] = k + 1
+            grams.append(gram if k == 0 else f"{gram}\x00{k}")
+        return clean, frozenset(grams)
+    
+    def _may_be_similar(self, profile1, profile2, threshold):
+        """快速判断 _text_similarity 是否可能超过 threshold（只会误报，不会漏报）
         
-        return result
+        相似度>threshold 时，较短文本在某个对齐位置上至少有 threshold 比例的字符相同，
+        每个不同字符最多破坏3个三字符组，因此两者共有的三字符组数
+        必然大于 len - 2 - 3 * (1 - threshold) * len。
+        """
+        clean1, grams1 = profile1
+        clean2, grams2 = profile2
+        shorter = min(len(clean1), len(clean2))
+        if shorter == 0:
+            return False
+        bound = shorter - 2 - 3 * (1 - threshold) * shorter
+        if bound <= 0:
+            return True
+        return min(len(grams1), len(grams2)) > bound and len(grams1 & grams2) > bound
     
     def _text_similarity(self, text1, text2):
         """计算两个文本的相似度（简单的字符重叠度）"""
@@ -799,130 +2501,214 @@ class MarkdownOptimizer:
             return 0.0
         
         # 移除空白字符进行比较
-        text1_clean = re.sub(r'\s+', '', text1)
-        text2_clean = re.sub(r'\s+', '', text2)
-        
+        return self._overlap_ratio(re.sub(r'\s+', '', text1), re.sub(r'\s+', '', text2))
+    
+    def _overlap_ratio(self, text1_clean, text2_clean):
+        """去除空白后的两个文本的相似度：较短文本在较长文本各对齐位置上相同字符比例的最大值"""
         if len(text1_clean) == 0 or len(text2_clean) == 0:
             return 0.0
         
         # 计算较短的文本在较长文本中的重叠度
         shorter = text1_clean if len(text1_clean) < len(text2_clean) else text2_clean
         longer = text2_clean if len(text1_clean) < len(text2_clean) else text1_clean
+        return self._max_overlap(shorter, longer) / len(shorter)
+    
+    def _max_overlap(self, shorter, longer):
+        """较短文本在较长文本中滑动时，对齐位置上相同字符数的最大值"""
+        size = len(shorter)
+        if shorter in longer:
+            return size
+        
+        # 对齐位置较多时改用位并行计算（耗时与文本长度成正比），结果与逐个位置比较完全相同
+        if (len(longer) - size + 1) * size > self.BITSET_MIN_RATIO * (len(longer) + size):
+            return self._max_aligned_matches(shorter, longer)
         
         # 使用滑动窗口计算最大重叠
         max_overlap = 0
-        for i in range(len(longer) - len(shorter) + 1):
-            overlap = sum(1 for j in range(len(shorter)) if shorter[j] == longer[i + j])
-            max_overlap = max(max_overlap, overlap)
+        for i in range(len(longer) - size + 1):
+            overlap = sum(map(operator.eq, shorter, longer[i:i + size]))
+            if overlap > max_overlap:
+                max_overlap = overlap
+        return max_overlap
+    
+    @staticmethod
+    def _max_aligned_matches(shorter, longer):
+        """较短文本在较长文本各对齐位置上相同字符数的最大值
+        
+        大整数的第i位对应对齐位置i：较长文本中每个字符的出现位置构成位掩码，
+        较短文本的第k个字符贡献 mask >> k，按位存放的计数器（counters[b] 为各位置计数的第b位）
+        用进位加法同时累加所有位置，最后从最高位开始逐位筛选出最大值。
+        """
+        needed = set(shorter)
+        positions = {}
+        for j, char in enumerate(longer):
+            if char in needed:
+                positions.setdefault(char, []).append(j)
+        masks = {}
+        for char, indices in positions.items():
+            bits = bytearray((len(longer) + 7) // 8)
+            for j in indices:
+                bits[j >> 3] |= 1 << (j & 7)
+            masks[char] = int.from_bytes(bits, 'little')
+        
+        counters = []
+        for k, char in enumerate(shorter):
+            carry = masks.get(char, 0) >> k
+            b = 0
+            while carry:
+                if b == len(counters):
+                    counters.append(carry)
+                    break
+                counters[b], carry = counters[b] ^ carry, counters[b] & carry
+                b += 1
+        
+        candidates = (1 << (len(longer) - len(shorter) + 1)) - 1
+        best = 0
+        for b in reversed(range(len(counters))):
+            hit = candidates & counters[b]
+            if hit:
+                candidates = hit
+                best |= 1 << b
+        return best
+    
+    def _is_duplicate_table(self, store, table_lines, table_start_idx):
+        """检查表格内容是否与前面100行内的文本内容高度重复（相似度>0.6）
+        
+        表格行逐行处理，不拼接成整段文本：表格文本去除空白后等于各行去除空白后依次相连，
+        长度逐行累加，相似度由 _table_overlap_exceeds 分块计算。
+        """
+        # 表格行去除首尾空白后非空，用空格连接后的长度即各行长度之和加上分隔的空格数
+        if sum(len(store.stripped(k)) for k in table_lines) + len(table_lines) - 1 <= 100:
+            return False
+        
+        # 向前查找100行，收集前面的文本块（跳过表格、图片、代码块、标题等）
+        prev_text_blocks = []
+        for j in range(max(0, table_start_idx - 100), table_start_idx):
+            if store.flags[j] & LineStore.BOUNDARY:
+                continue
+            prev_line = store.stripped(j)
+            if len(prev_line) > 20:
+                prev_text_blocks.append(prev_line)
         
-        return max_overlap / len(shorter) if len(shorter) > 0 else 0.0
+        # 合并前面的文本块并检查相似度
+        prev_text = re.sub(r'\s+', '', ' '.join(prev_text_blocks))
+        if not prev_text:
+            return False
+        return self._table_overlap_exceeds(
+            prev_text, lambda: (re.sub(r'\s+', '', store.stripped(k)) for k in table_lines), 0.6)
+    
+    def _table_overlap_exceeds(self, text, rows, threshold):
+        """去除空白后的 text 与表格文本（各行依次相连）的相似度（_overlap_ratio）是否超过 threshold
+        
+        rows 每次调用返回表格各行（已去除空白）的迭代器。表格比 text 短时直接计算；
+        否则 text 在表格上滑动，任一对齐位置的相同字符数超过 threshold*len(text) 时，
+        两者共有的字符数必然超过该值，共有的相邻字符对数必然超过
+        len(text) - 1 - 2*(1-threshold)*len(text)（每个不同字符最多破坏2个字符对）。
+        先逐行累计字符和字符对计数，不满足时直接返回；满足时再按 TABLE_BLOCK_CHARS 分块计算
+        （相邻块重叠 len(text)-1 个字符），任一块超过阈值即可返回。
+        内存占用只与 text 长度和块大小有关，与表格行数无关。
+        """
+        from collections import Counter
+        size = len(text)
+        text_chars = Counter(text)
+        text_pairs = Counter(map(operator.add, text, text[1:]))
+        table_chars = Counter()
+        table_pairs = Counter()  # 只统计 text 中出现过的字符对
+        head = []  # 表格开头不超过 len(text) 个字符的部分
+        total = 0
+        last = ''
+        for row in rows():
+            if total < size:
+                head.append(row)
+            total += len(row)
+            table_chars.update(row)
+            joined = last + row
+            table_pairs.update(pair for pair in map(operator.add, joined, joined[1:]) if pair in text_pairs)
+            last = joined[-1:]
+        if total < size:
+            table = ''.join(head)
+            return bool(table) and self._overlap_ratio(table, text) > threshold
+        
+        shared_chars = sum(min(count, table_chars[char]) for char, count in text_chars.items())
+        shared_pairs = sum(min(count, table_pairs[pair]) for pair, count in text_pairs.items())
+        if shared_chars <= threshold * size or shared_pairs <= size - 1 - 2 * (1 - threshold) * size:
+            return False
+        
+        block = []
+        block_size = 0
+        for row in rows():
+            block.append(row)
+            block_size += len(row)
+            if block_size >= size - 1 + self.TABLE_BLOCK_CHARS:
+                window = ''.join(block)
+                if self._max_overlap(text, window) / size > threshold:
+                    return True
+                # 保留末尾 len(text)-1 个字符，跨块的对齐位置在下一块中计算
+                block = [window[len(window) - size + 1:]]
+                block_size = size - 1
+        return block_size >= size and self._max_overlap(text, ''.join(block)) / size > threshold
     
     def clean_duplicate_tables(self, lines):
         """清理表格中的重复内容"""
-        result = []
+        store = LineStore.of(lines)
+        flags_list = store.flags
+        total = len(store)
+        result = LineStore()
         i = 0
         in_table = False
-        table_lines = []
+        table_lines = []  # 表格行的下标
         table_start_idx = -1
         
-        while i < len(lines):
-            line = lines[i]
-            stripped = line.strip()
+        while i < total:
+            flags = flags_list[i]
             
             # 检测表格开始
-            if stripped.startswith('|') and not in_table:
+            if flags & LineStore.TABLE and not in_table:
                 in_table = True
                 table_start_idx = i
-                table_lines = [line]
+                table_lines = [i]
                 i += 1
                 continue
             
             # 在表格中
             if in_table:
                 # 表格结束（空行或非表格行，且不是表格分隔符）
-                if not stripped.startswith('|') and stripped != '':
-                    # 处理收集到的表格
-                    table_text = ' '.join([l.strip() for l in table_lines]).strip()
-                    
-                    # 检查表格内容是否与前面的文本内容重复
-                    if table_text and len(table_text) > 100:
-                        # 向前查找，检查是否有重复内容
-                        is_duplicate = False
-                        lookback_start = max(0, table_start_idx - 100)  # 向前查找100行
-                        prev_text_blocks = []
-                        
-                        # 收集前面的文本块
-                        for j in range(lookback_start, table_start_idx):
-                            prev_line = lines[j].strip()
-                            # 跳过表格、图片、代码块、标题等
-                            if (prev_line.startswith('|') or 
-                                prev_line.startswith('![') or 
-                                prev_line.startswith('```') or
-                                prev_line == '---' or
-                                re.match(r'^#{1,6}\s+', prev_line)):
-                                continue
-                            
-                            if prev_line and len(prev_line) > 20:
-                                prev_text_blocks.append(prev_line)
-                        
-                        # 合并前面的文本块
-                        prev_text = ' '.join(prev_text_blocks)
-                        
-                        # 检查相似度
-                        if prev_text and self._text_similarity(table_text, prev_text) > 0.6:
-                            is_duplicate = True
-                        
-                        # 如果表格内容与前面文本高度重复，跳过整个表格
-                        if is_duplicate:
-                            # 跳过表格标题行（如果有）
-                            if i < len(lines) and lines[i].strip().startswith('### 表格'):
-                                i += 1
-                            in_table = False
-                            table_lines = []
-                            result.append(line)  # 保留非表格行
+                if not flags & (LineStore.TABLE | LineStore.BLANK):
+                    # 如果表格内容与前面文本高度重复，跳过整个表格
+                    if self._is_duplicate_table(store, table_lines, table_start_idx):
+                        line_idx = i
+                        # 跳过表格标题行（如果有）
+                        if store.stripped(i).startswith('### 表格'):
                             i += 1
-                            continue
+                        in_table = False
+                        table_lines = []
+                        result.append_from(store, line_idx)  # 保留非表格行
+                        i += 1
+                        continue
                     
                     # 不是重复的，输出表格
-                    if table_lines:
-                        result.extend(table_lines)
+                    for k in table_lines:
+                        result.append_from(store, k)
                     in_table = False
                     table_lines = []
-                    result.append(line)
+                    result.append_from(store, i)
                     i += 1
                     continue
                 
                 # 继续收集表格行
-                if stripped.startswith('|'):
-                    table_lines.append(line)
+                if flags & LineStore.TABLE:
+                    table_lines.append(i)
                 i += 1
                 continue
             
-            result.append(line)
+            result.append_from(store, i)
             i += 1
         
         # 处理最后一个表格（如果文档以表格结束）
         if in_table and table_lines:
-            table_text = ' '.join([l.strip() for l in table_lines]).strip()
-            if table_text and len(table_text) > 100:
-                lookback_start = max(0, table_start_idx - 100)
-                prev_text_blocks = []
-                for j in range(lookback_start, table_start_idx):
-                    prev_line = lines[j].strip()
-                    if (prev_line.startswith('|') or 
-                        prev_line.startswith('![') or 
-                        prev_line.startswith('```') or
-                        prev_line == '---' or
-                        re.match(r'^#{1,6}\s+', prev_line)):
-                        continue
-                    if prev_line and len(prev_line) > 20:
-                        prev_text_blocks.append(prev_line)
-                
-                prev_text = ' '.join(prev_text_blocks)
-                if not (prev_text and self._text_similarity(table_text, prev_text) > 0.6):
-                    result.extend(table_lines)
-            else:
-                result.extend(table_lines)
+            if not self._is_duplicate_table(store, table_lines, table_start_idx):
+                for k in table_lines:
+                    result.append_from(store, k)
         
         return result
     
@@ -975,19 +2761,19 @@ class MarkdownOptimizer:
     
     def optimize(self, content):
         """执行所有优化步骤"""
-        lines = content.split('\n')
-        
-        # 步骤1: 移除页面标记
-        lines = self.remove_page_markers(lines)
-        
-        # 步骤2: 清理重复的表格内容（在去重之前先处理表格）
-        lines = self.clean_duplicate_tables(lines)
-        
-        # 步骤3: 移除重复的内容段落
-        lines = self.remove_duplicate_content(lines)
-        
-        # 步骤4: 修复标题层级
-        lines = self.fix_title_hierarchy(lines)
+        # 每行的分类只计算一次，后续步骤共享
+        # 步骤1: 移除页面标记（不保留中间结果的引用，便于各步骤完成后及时释放）
+        return self.optimize_lines(self.remove_page_markers(LineStore(content.split('\n'))))
+    
+    def optimize_pages(self, pages):
+        """直接优化PageResult序列（无需先拼接成带页面标记的字符串）"""
+        # 正文中残留的分隔线按原规则处理
+        return self.optimize_lines(self.remove_page_markers(LineStore(MarkdownRenderer().page_lines(pages))))
+    
+    def optimize_local(self, lines, is_first=True):
+        """只依赖局部上下文的优化步骤（可以在分块上独立执行）"""
+        # 步骤4: 修复标题层级（只有第一个分块可能添加主标题）
+        lines = self.fix_title_hierarchy(lines, seen_first_title=not is_first)
         
         # 步骤5: 优化代码块
         lines = self.optimize_code_blocks(lines)
@@ -997,14 +2783,1028 @@ class MarkdownOptimizer:
         
         # 步骤7: 清理多余空行
         lines = self.clean_extra_blank_lines(lines)
+        return lines
+    
+    def split_safe_chunks(self, lines):
+        """在安全边界处把行列表切成分块，使局部优化步骤在各分块上的结果拼接后与整体执行一致
+        
+        安全边界是代码块之外的Markdown标题行：代码块合并、命令和配置项的向后收集都会在标题处停止，
+        空行计数也会被标题重置。主标题只可能出现在输出的前5行，因此第一个分块需要包含
+        开头的若干行；开头几行中有代码块标记时不切分（主标题处理可能改变代码块配对）。
+        """
+        store = LineStore.of(lines)
+        if len(store) < self.PARALLEL_MIN_LINES:
+            return [store]
+        if any(flags & LineStore.FENCE for flags in store.flags[:6]):
+            return [store]
+        
+        target = max(len(store) // (self.workers * 4), self.PARALLEL_MIN_LINES // 5)
+        chunks = []
+        start = 0
+        in_code = False
+        for i, flags in enumerate(store.flags):
+            if flags & LineStore.FENCE:
+                in_code = not in_code
+                continue
+            if not in_code and i - start >= target and i >= 6 and flags & LineStore.HEADING:
+                chunks.append(store.slice(start, i))
+                start = i
+        chunks.append(store.slice(start, len(store)))
+        return chunks
+    
+    def optimize_lines(self, lines):
+        """对已移除页面标记的行（行列表或 LineStore）执行其余优化步骤"""
+        # 步骤2: 清理重复的表格内容（在去重之前先处理表格）
+        lines = self.clean_duplicate_tables(lines)
+        
+        # 步骤3: 移除重复的内容段落（并行时各进程查找相似段落，按文档顺序合并判定）
+        lines = self.remove_duplicate_content(lines)
+        
+        # 步骤4-7: 修复标题层级、优化代码块、格式化链接、清理多余空行
+        chunks = self.split_safe_chunks(lines) if self.workers > 1 else [lines]
+        if len(chunks) > 1:
+            from concurrent.futures import ProcessPoolExecutor
+            with ProcessPoolExecutor(max_workers=self.workers) as pool:
+                parts = pool.map(_optimize_chunk_worker, [(chunk, idx == 0) for idx, chunk in enumerate(chunks)])
+                lines = LineStore.concat(parts)
+        else:
+            lines = self.optimize_local(lines)
         
-        # 步骤8: 修复特定问题
-        result = '\n'.join(lines)
+        # 步骤8: 修复特定问题（整篇文本替换前先释放行存储，降低峰值内存）
+        result = '\n'.join(lines.texts)
+        del lines
         result = self.fix_specific_issues(result)
         
         return result
 
 
+def collect_input_files(inputs, extensions):
+    """展开输入路径：目录递归查找指定扩展名的文件，文件原样保留，结果排序"""
+    files = []
+    for path in inputs:
+        if os.path.isdir(path):
+            for root, _, names in os.walk(path):
+                files.extend(os.path.join(root, name) for name in names
+                             if name.lower().endswith(extensions))
+        else:
+            files.append(path)
+    files.sort()
+    return files
+
+
+def _process_rss_mb(pid):
+    """读取进程当前常驻内存（MB），无法读取（非Linux）时返回None"""
+    try:
+        with open(f'/proc/{pid}/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / (1024 * 1024)
+    except (OSError, ValueError, IndexError, AttributeError):
+        return None
+
+
+def convert_document(pdf_path, output_file, converter_options=None, formats=('md',), boilerplate=None,
+                     optimizer_options=None):
+    """转换单篇文档并原子写入全部输出格式（批量模式使用，不输出进度），返回PageResult列表"""
+    import contextlib
+    import io
+    with contextlib.redirect_stdout(io.StringIO()):
+        converter = PDFToMarkdownConverter(output_dir=os.path.dirname(os.path.abspath(output_file)),
+                                           progress=ProgressReporter(mode='quiet'), **(converter_options or {}))
+        pages = converter.convert_pages(pdf_path, output_file)
+        optimizer = MarkdownOptimizer(boilerplate=boilerplate, **(optimizer_options or {}))
+        outputs = render_outputs(pages, formats, optimizer)
+        paths = output_paths(output_file, formats)
+        for fmt in formats:
+            write_text_atomic(paths[fmt], outputs[fmt])
+    return pages
+
+
+def _batch_worker(conn, converter_options, formats, boilerplate_path, max_docs, optimizer_options=None,
+                  send_pages=False):
+    """批量转换工作进程：逐个接收（PDF, 输出文件）任务，处理max_docs篇文档后退出以回收内存
+    
+    send_pages 为真时随结果返回页面数据（to_dict()），由父进程统一写入全文检索索引。
+    """
+    boilerplate = BoilerplateIndex.load(boilerplate_path) if boilerplate_path else None
+    for _ in range(max_docs):
+        job = conn.recv()
+        if job is None:
+            break
+        pdf_path, output_file = job
+        start = time.perf_counter()
+        try:
+            pages = convert_document(pdf_path, output_file, converter_options, formats, boilerplate,
+                                     optimizer_options)
+            page_data = [page.to_dict() for page in pages] if send_pages else None
+            conn.send(('ok', len(pages), time.perf_counter() - start, page_data))
+        except Exception as e:
+            conn.send(('error', f"{type(e).__name__}: {e}", time.perf_counter() - start, None))
+    conn.close()
+
+
+class BatchConverter:
+    """批量转换调度器：按内存上限动态控制并发，工作进程处理一定数量的文档后回收
+    
+    每篇文档按页数和文件大小预估峰值内存；已运行任务按 max(当前RSS, 预估) 计入，
+    加上空闲工作进程的RSS和新任务的预估不超过内存上限时才分派新任务，否则等待。
+    任务完成后用观测到的峰值RSS修正预估系数。
+    指定 search_index 时，工作进程把页面数据发回父进程，由父进程通过同一个 SearchIndexWriter 依次写入。
+    """
+    
+    BASE_COST_MB = 80  # 工作进程本身（解释器和解析库）的内存
+    PAGE_COST_MB = 0.5  # 每页的预估内存
+    FILE_COST_RATIO = 2.0  # 每MB文件大小的预估内存（内存映射和解析对象）
+    POLL_INTERVAL = 0.2  # 采样工作进程RSS的间隔（秒）
+    
+    def __init__(self, max_workers=None, memory_limit_mb=None, max_docs_per_worker=20,
+                 converter_options=None, formats=('md',), boilerplate_path=None, optimizer_options=None,
+                 search_index=None):
+        self.max_workers = max_workers or os.cpu_count() or 1  # 最大并发进程数
+        if memory_limit_mb is None:
+            memory_limit_mb = self.default_memory_limit_mb()
+        self.memory_limit_mb = memory_limit_mb  # 内存上限（MB），None表示只按进程数限制
+        self.max_docs_per_worker = max_docs_per_worker  # 每个工作进程处理多少篇文档后退出
+        self.converter_options = converter_options or {}  # 传给PDFToMarkdownConverter的参数
+        self.optimizer_options = optimizer_options or {}  # 传给MarkdownOptimizer的参数
+        self.search_index = search_index  # 全文检索数据库路径（None表示不写入）
+        self.index_records = 0  # 写入全文检索索引的记录数
+        self.formats = formats
+        self.boilerplate_path = boilerplate_path
+        self.cost_scale = 1.0  # 预估系数，按实测峰值修正
+        self.peak_in_use_mb = 0  # 调度期间观测到的所有工作进程RSS之和的峰值
+        self.workers_started = 0
+    
+    @staticmethod
+    def default_memory_limit_mb():
+        """默认内存上限：物理内存的70%（无法获取时返回None）"""
+        try:
+            return os.sysconf('SC_PHYS_PAGES') * os.sysconf('SC_PAGE_SIZE') * 0.7 / (1024 * 1024)
+        except (AttributeError, ValueError, OSError):
+            return None
+    
+    @staticmethod
+    def count_pages(pdf_path):
+        """读取PDF页数（只解析页面树），失败时返回None"""
+        try:
+            import fitz
+            with fitz.open(pdf_path) as doc:
+                return doc.page_count
+        except ImportError:
+            pass
+        except Exception:
+            return None
+        try:
+            import pdfplumber
+            with pdfplumber.open(pdf_path) as pdf:
+                return len(pdf.pages)
+        except Exception:
+            return None
+    
+    def estimate_cost_mb(self, pdf_path, pages):
+        """预估转换一篇文档时工作进程的峰值RSS（MB，未乘修正系数）"""
+        size_mb = os.path.getsize(pdf_path) / (1024 * 1024)
+        if pages is None:
+            # 页数未知时按文件大小估算
+            return self.BASE_COST_MB + size_mb * (self.FILE_COST_RATIO + self.PAGE_COST_MB * 10)
+        return self.BASE_COST_MB + pages * self.PAGE_COST_MB + size_mb * self.FILE_COST_RATIO
+    
+    def _start_worker(self):
+        """启动一个工作进程，返回状态字典"""
+        import multiprocessing
+        parent_conn, child_conn = multiprocessing.Pipe()
+        process = multiprocessing.Process(
+            target=_batch_worker,
+            args=(child_conn, self.converter_options, self.formats, self.boilerplate_path, self.max_docs_per_worker,
+                  self.optimizer_options, self.search_index is not None),
+            daemon=True)
+        process.start()
+        child_conn.close()
+        self.workers_started += 1
+        return {'process': process, 'conn': parent_conn, 'docs': 0, 'job': None, 'rss': 0.0, 'peak': 0.0}
+    
+    def _stop_worker(self, worker):
+        """通知工作进程退出并回收"""
+        try:
+            worker['conn'].send(None)
+        except (OSError, EOFError):
+            pass
+        worker['process'].join(timeout=5)
+        if worker['process'].is_alive():
+            worker['process'].terminate()
+            worker['process'].join()
+        worker['conn'].close()
+    
+    def _memory_in_use(self, workers):
+        """已占用或已承诺的内存：运行中任务取 max(当前RSS, 预估)，空闲进程取当前RSS"""
+        total = 0.0
+        for worker in workers:
+            if worker['job'] is not None:
+                total += max(worker['rss'], worker['job']['estimate'] * self.cost_scale)
+            else:
+                total += worker['rss']
+        return total
+    
+    def _sample_rss(self, workers):
+        """采样各工作进程的RSS并记录运行中任务的峰值"""
+        for worker in workers:
+            rss = _process_rss_mb(worker['process'].pid)
+            if rss is None:
+                continue
+            worker['rss'] = rss
+            worker['peak'] = max(worker['peak'], rss)
+        self.peak_in_use_mb = max(self.peak_in_use_mb, sum(worker['rss'] for worker in workers))
+    
+    def _update_cost_scale(self, job, peak):
+        """用实测峰值修正预估系数（指数滑动平均，只在读到RSS时修正）"""
+        if peak > 0 and job['estimate'] > 0:
+            self.cost_scale = 0.7 * self.cost_scale + 0.3 * (peak / job['estimate'])
+    
+    def run(self, jobs):
+        """执行批量转换，jobs为（PDF路径, 输出文件）列表；返回每篇文档的结果字典列表（按输入顺序）"""
+        from collections import deque
+        from multiprocessing.connection import wait
+        
+        pending = deque()
+        for num, (pdf_path, output_file) in enumerate(jobs):
+            pages = self.count_pages(pdf_path)
+            pending.append({'num': num, 'pdf': pdf_path, 'output': output_file, 'pages': pages,
+                            'estimate': self.estimate_cost_mb(pdf_path, pages)})
+        results = [None] * len(pending)
+        total = len(pending)
+        workers = []
+        search_index = SearchIndexWriter(self.search_index) if self.search_index else None
+        
+        def finish(worker, status, pages=None, seconds=0.0, error=None):
+            job = worker['job']
+            peak = worker['peak']
+            self._update_cost_scale(job, peak)
+            results[job['num']] = {'pdf': job['pdf'], 'output': job['output'], 'status': status,
+                                   'pages': pages if pages is not None else job['pages'],
+                                   'seconds': seconds, 'peak_mb': peak, 'error': error}
+            worker['job'] = None
+            worker['docs'] += 1
+            done = sum(1 for result in results if result is not None)
+            message = f"用时 {seconds:.1f}s，峰值内存 {peak:.0f} MB" if status == 'ok' else f"失败 - {error}"
+            print(f"  [{done}/{total}] {os.path.basename(job['pdf'])}: {message}")
+        
+        try:
+            while pending or any(worker['job'] is not None for worker in workers):
+                # 回收已达到文档数上限的空闲进程（进程自行退出，释放积累的内存）
+                for worker in [w for w in workers if w['job'] is None and w['docs'] >= self.max_docs_per_worker]:
+                    worker['process'].join()
+                    worker['conn'].close()
+                    workers.remove(worker)
+                
+                # 在内存上限内分派新任务（按顺序，不跳过大文档；没有运行中的任务时总是放行一个）
+                while pending:
+                    running = sum(1 for worker in workers if worker['job'] is not None)
+                    if running >= self.max_workers:
+                        break
+                    job = pending[0]
+                    idle = next((worker for worker in workers if worker['job'] is None), None)
+                    if running and self.memory_limit_mb is not None:
+                        in_use = self._memory_in_use(workers)
+                        estimate = job['estimate'] * self.cost_scale
+                        if idle is not None:
+                            # 复用空闲进程时它的RSS已计入，只需加上超出部分
+                            estimate = max(0.0, estimate - idle['rss'])
+                        if in_use + estimate > self.memory_limit_mb:
+                            break
+                    pending.popleft()
+                    worker = idle or self._start_worker()
+                    if idle is None:
+                        workers.append(worker)
+                    worker['job'] = job
+                    worker['peak'] = worker['rss']
+                    worker['conn'].send((job['pdf'], job['output']))
+                
+                # 等待任务完成或进程退出，同时定期采样RSS
+                busy = [worker for worker in workers if worker['job'] is not None]
+                ready = wait([worker['conn'] for worker in busy] + [worker['process'].sentinel for worker in busy],
+                             timeout=self.POLL_INTERVAL)
+                self._sample_rss(workers)
+                for worker in busy:
+                    if worker['conn'] in ready or worker['conn'].poll():
+                        try:
+                            status, value, seconds, page_data = worker['conn'].recv()
+                        except EOFError:
+                            status = None
+                        if status == 'ok' and search_index is not None:
+                            try:
+                                search_index.add_pages(worker['job']['output'],
+                                                       [PageResult.from_dict(data) for data in page_data])
+                            except Exception as e:
+                                finish(worker, 'error', seconds=seconds, error=f"写入全文检索索引失败 - {e}")
+                                continue
+                        if status == 'ok':
+                            finish(worker, 'ok', pages=value, seconds=seconds)
+                            continue
+                        if status == 'error':
+                            finish(worker, 'error', seconds=seconds, error=value)
+                            continue
+                    if not worker['process'].is_alive():
+                        # 工作进程异常退出（例如被OOM终止）：记录失败，丢弃该进程
+                        exitcode = worker['process'].exitcode
+                        finish(worker, 'error', error=f"工作进程异常退出（退出码 {exitcode}）")
+                        worker['conn'].close()
+                        workers.remove(worker)
+        finally:
+            for worker in workers:
+                self._stop_worker(worker)
+            if search_index is not None:
+                search_index.close()
+                self.index_records = search_index.records
+        return results
+
+
+class LeaseQueue:
+    """共享目录上的任务租约队列：多台机器挂载同一目录，通过租约文件协作处理同一批任务
+    
+    每个任务对应队列目录中的一组文件（以任务名的哈希命名）：
+        <key>.lease   租约：以 O_CREAT|O_EXCL 原子创建，持有者由后台线程定期更新修改时间（心跳）
+        <key>.done    任务完成标记（输出写入之后才创建）
+        <key>.failed  任务失败标记（处理出错，或租约多次过期仍未完成）
+    租约是否过期由观察者自己计时：租约文件的修改时间在 lease_seconds 内没有变化即视为持有者已崩溃，
+    不依赖各机器时钟一致。接管过期租约时先原子重命名旧文件，保证只有一个节点成功。
+    """
+    
+    LEASE_SUFFIX = '.lease'
+    DONE_SUFFIX = '.done'
+    FAILED_SUFFIX = '.failed'
+    
+    def __init__(self, queue_dir, node_id=None, lease_seconds=300, max_attempts=3):
+        import socket
+        import threading
+        self.queue_dir = queue_dir
+        self.node_id = node_id or f"{socket.gethostname()}-{os.getpid()}"  # 节点标识
+        self.lease_seconds = lease_seconds  # 租约多久没有心跳视为过期
+        self.max_attempts = max_attempts  # 同一任务最多被领取几次（之前的持有者都已崩溃）
+        self._observed = {}  # 其他节点的租约：key -> (文件签名, 首次观察到该签名的时间)
+        self._held = {}  # 本节点持有的租约：key -> 令牌（心跳线程也会读取）
+        self._lock = threading.Lock()
+        self._stop = None
+        self._heartbeat_thread = None
+        os.makedirs(queue_dir, exist_ok=True)
+    
+    @staticmethod
+    def job_key(name):
+        """任务名（如相对路径）对应的文件名前缀"""
+        return hashlib.blake2b(name.encode('utf-8'), digest_size=12).hexdigest()
+    
+    def _path(self, key, suffix):
+        return os.path.join(self.queue_dir, key + suffix)
+    
+    def is_finished(self, key):
+        """任务是否已完成或已失败（任何节点）"""
+        return (os.path.exists(self._path(key, self.DONE_SUFFIX))
+                or os.path.exists(self._path(key, self.FAILED_SUFFIX)))
+    
+    def _read_lease(self, path):
+        """读取租约或标记文件内容，文件不存在或正在写入时返回None"""
+        try:
+            with open(path, encoding='utf-8') as f:
+                return json.loads(f.read())
+        except (OSError, ValueError):
+            return None
+    
+    def _create_lease(self, key, name, attempts):
+        """原子创建租约文件，已存在时返回False"""
+        import uuid
+        token = uuid.uuid4().hex
+        path = self._path(key, self.LEASE_SUFFIX)
+        try:
+            fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644)
+        except FileExistsError:
+            return False
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            f.write(json.dumps({'name': name, 'node': self.node_id, 'token': token, 'attempts': attempts}))
+        with self._lock:
+            self._held[key] = token
+        return True
+    
+    @staticmethod
+    def _signature(path):
+        """租约文件签名（inode、大小、修改时间），文件不存在时返回None"""
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            return None
+        return (st.st_ino, st.st_size, st.st_mtime_ns)
+    
+    def _is_expired(self, key, path):
+        """租约在本节点连续观察 lease_seconds 秒都没有变化时视为过期"""
+        signature = self._signature(path)
+        if signature is None:
+            self._observed.pop(key, None)
+            return False
+        now = time.monotonic()
+        observed = self._observed.get(key)
+        if observed is None or observed[0] != signature:
+            self._observed[key] = (signature, now)
+            return False
+        return now - observed[1] >= self.lease_seconds
+    
+    def try_claim(self, key, name):
+        """尝试领取任务：成功返回True；已完成、已失败或被其他节点有效持有时返回False"""
+        if self.is_finished(key):
+            return False
+        if self._create_lease(key, name, attempts=1):
+            return True
+        path = self._path(key, self.LEASE_SUFFIX)
+        if not self._is_expired(key, path):
+            return False
+        
+        # 接管过期租约：先把旧租约重命名为本节点独有的文件名，只有一个节点能重命名成功
+        signature = self._observed.pop(key)[0]
+        stale_path = f"{path}.{self.node_id}.stale"
+        try:
+            os.rename(path, stale_path)
+        except FileNotFoundError:
+            return False
+        if self._signature(stale_path) != signature:
+            # 重命名前租约已被其他节点接管或续期，放回原处（原处已有新租约时放弃）
+            try:
+                os.link(stale_path, path)
+            except OSError:
+                pass
+            os.remove(stale_path)
+            return False
+        lease = self._read_lease(stale_path) or {}
+        os.remove(stale_path)
+        attempts = lease.get('attempts', 1) + 1
+        if attempts > self.max_attempts:
+            self._mark(key, self.FAILED_SUFFIX, {'name': name, 'node': self.node_id,
+                                                 'error': f"租约过期 {attempts - 1} 次（持有节点可能已崩溃）"})
+            return False
+        print(f"接管过期租约: {name}（原节点 {lease.get('node', '?')}，第 {attempts} 次领取）")
+        return self._create_lease(key, name, attempts)
+    
+    def owns(self, key):
+        """本节点是否仍持有该任务的租约"""
+        lease = self._read_lease(self._path(key, self.LEASE_SUFFIX))
+        return lease is not None and lease.get('token') == self._held.get(key)
+    
+    def _mark(self, key, suffix, info):
+        write_text_atomic(self._path(key, suffix), json.dumps(info, ensure_ascii=False))
+    
+    def _release(self, key):
+        """释放本节点持有的租约（租约已被接管时不删除别人的租约）"""
+        owned = self.owns(key)
+        with self._lock:
+            self._held.pop(key, None)
+        if owned:
+            try:
+                os.remove(self._path(key, self.LEASE_SUFFIX))
+            except FileNotFoundError:
+                pass
+        return owned
+    
+    def complete(self, key, name, info=None):
+        """输出写入后标记任务完成并释放租约；租约已被接管时返回False"""
+        if not self.owns(key):
+            self._release(key)
+            return False
+        self._mark(key, self.DONE_SUFFIX, dict(info or {}, name=name, node=self.node_id))
+        self._release(key)
+        return True
+    
+    def fail(self, key, name, error):
+        """标记任务失败并释放租约"""
+        if self.owns(key):
+            self._mark(key, self.FAILED_SUFFIX, {'name': name, 'node': self.node_id, 'error': error})
+        self._release(key)
+    
+    def failures(self, names):
+        """已失败任务的 [(任务名, 错误信息)]（任何节点标记的）"""
+        failed = []
+        for name in names:
+            info = self._read_lease(self._path(self.job_key(name), self.FAILED_SUFFIX))
+            if info is not None:
+                failed.append((name, info.get('error', '')))
+        return failed
+    
+    def heartbeat(self):
+        """更新本节点持有的全部租约的修改时间"""
+        with self._lock:
+            keys = list(self._held)
+        for key in keys:
+            try:
+                os.utime(self._path(key, self.LEASE_SUFFIX))
+            except FileNotFoundError:
+                pass
+    
+    def start_heartbeat(self):
+        """启动后台心跳线程（间隔为租约时长的四分之一）"""
+        import threading
+        self._stop = threading.Event()
+        
+        def beat():
+            while not self._stop.wait(self.lease_seconds / 4):
+                self.heartbeat()
+        
+        self._heartbeat_thread = threading.Thread(target=beat, name='ptom-lease-heartbeat', daemon=True)
+        self._heartbeat_thread.start()
+    
+    def stop_heartbeat(self):
+        if self._heartbeat_thread is not None:
+            self._stop.set()
+            self._heartbeat_thread.join()
+            self._heartbeat_thread = None
+    
+    def process(self, jobs, handler, poll_interval=5.0):
+        """领取并处理任务，直到所有任务都已完成或失败（包括其他节点的任务）
+        
+        jobs 为 [(任务名, 参数)]，handler(参数) 处理单个任务并返回写入完成标记的信息字典。
+        返回本节点处理过的 [(任务名, 'ok'/'error'/'lost', 信息)]。
+        """
+        results = []
+        self.start_heartbeat()
+        try:
+            while True:
+                waiting = 0  # 被其他节点持有、尚未结束的任务数
+                for name, job in jobs:
+                    key = self.job_key(name)
+                    if self.is_finished(key):
+                        continue
+                    if not self.try_claim(key, name):
+                        waiting += not self.is_finished(key)
+                        continue
+                    try:
+                        info = handler(job) or {}
+                    except Exception as e:
+                        error = f"{type(e).__name__}: {e}"
+                        self.fail(key, name, error)
+                        results.append((name, 'error', error))
+                        continue
+                    if self.complete(key, name, info):
+                        results.append((name, 'ok', info))
+                    else:
+                        # 租约已被其他节点接管（本节点心跳中断过），输出相同，由接管节点负责标记完成
+                        results.append((name, 'lost', info))
+                if not waiting:
+                    break
+                time.sleep(poll_interval)
+        finally:
+            self.stop_heartbeat()
+            for key in list(self._held):
+                self._release(key)
+        return results
+
+
+class DirectoryWatcher:
+    """等待目录树发生变化：Linux上通过ctypes使用inotify，不可用时（其他系统、被禁用）退回定期轮询
+    
+    事件只用于及时唤醒，具体哪些文件变化由调用方重新扫描判断，因此漏掉的事件不影响正确性。
+    网络文件系统（NFS、SMB）上其他机器写入的文件不会产生inotify事件，应使用轮询。
+    """
+    
+    IN_MODIFY = 0x00000002
+    IN_ATTRIB = 0x00000004
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_FROM = 0x00000040
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_DELETE = 0x00000200
+    IN_ISDIR = 0x40000000
+    WATCH_MASK = IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+    
+    def __init__(self, root, use_inotify=True):
+        self.root = root
+        self.fd = None  # inotify文件描述符（None表示轮询）
+        self._libc = None
+        self._watched = set()  # 已添加监视的目录
+        if use_inotify and sys.platform.startswith('linux'):
+            self._init_inotify()
+    
+    @property
+    def mode(self):
+        return 'inotify' if self.fd is not None else 'poll'
+    
+    def _init_inotify(self):
+        """初始化inotify并监视目录树中的所有目录，失败时保持轮询模式"""
+        try:
+            import ctypes
+            import ctypes.util
+            libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+            fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+            if fd < 0:
+                return
+        except (OSError, AttributeError):
+            return
+        self._libc = libc
+        self.fd = fd
+        self._add_watches()
+    
+    def _add_watches(self):
+        """为目录树中尚未监视的目录添加监视（新建子目录后调用）"""
+        for directory, _, _ in os.walk(self.root):
+            if directory in self._watched:
+                continue
+            if self._libc.inotify_add_watch(self.fd, os.fsencode(directory), self.WATCH_MASK) >= 0:
+                self._watched.add(directory)
+    
+    def wait(self, timeout):
+        """等待变化或超时（秒）；返回是否收到了事件（轮询模式下超时后总是返回True）"""
+        if self.fd is None:
+            time.sleep(timeout)
+            return True
+        import select
+        import struct
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return False
+        new_directory = False
+        while True:
+            try:
+                data = os.read(self.fd, 65536)
+            except BlockingIOError:
+                break
+            offset = 0
+            while offset + 16 <= len(data):
+                _, mask, _, name_len = struct.unpack_from('iIII', data, offset)
+                if mask & self.IN_ISDIR and mask & (self.IN_CREATE | self.IN_MOVED_TO):
+                    new_directory = True
+                offset += 16 + name_len
+        if new_directory:
+            self._add_watches()
+        return True
+    
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+
+class WatchConverter:
+    """监视模式：持续监视输入目录，只转换新增或内容变化的PDF
+    
+    文件的大小和修改时间连续 debounce 秒不变才视为写入完成（防止转换写了一半的文件）；
+    修改时间变化但内容哈希不变的PDF不重新转换；转换过程中文件又被修改时，下次扫描会再次转换。
+    转换器（应关闭内存映射）和优化器只创建一次，输出的Markdown和图片内容没有变化时不重写文件。
+    已处理文件的状态保存在输出目录的 .ptom-watch.json 中，重启后不会重复转换。
+    """
+    
+    STATE_FILE = '.ptom-watch.json'
+    RESCAN_INTERVAL = 60  # inotify模式下的兜底重新扫描间隔（秒）
+    IMAGE_NAME = re.compile(r'page_\d+_(?:img_\d+|scan)\.\w+$')  # 转换器生成的图片文件名
+    
+    def __init__(self, input_dir, output_dir, converter, optimizer=None, formats=('md',),
+                 debounce=2.0, poll_interval=2.0, use_inotify=True):
+        self.input_dir = input_dir
+        self.output_dir = output_dir
+        self.converter = converter  # 复用的转换器（依赖只检查一次）
+        self.optimizer = optimizer or MarkdownOptimizer()
+        self.formats = formats
+        self.debounce = debounce  # 文件多久没有变化才视为写入完成（秒）
+        self.poll_interval = poll_interval  # 轮询模式的扫描间隔（秒）
+        self.use_inotify = use_inotify
+        self.state_path = os.path.join(output_dir, self.STATE_FILE)
+        self.state = self._load_state()  # 相对路径 -> {'signature': [大小, 修改时间], 'hash': PDF哈希}
+        self.pending = {}  # 正在等待写入完成的文件：相对路径 -> (签名, 首次观察到该签名的时间)
+        self.converted = 0
+        self.unchanged = 0
+    
+    def _load_state(self):
+        try:
+            with open(self.state_path, encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+    
+    def _save_state(self):
+        write_text_atomic(self.state_path, json.dumps(self.state, ensure_ascii=False, sort_keys=True))
+    
+    @staticmethod
+    def file_hash(path):
+        """PDF内容哈希"""
+        digest = hashlib.blake2b(digest_size=16)
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1024 * 1024), b''):
+                digest.update(block)
+        return digest.hexdigest()
+    
+    def output_file(self, relative):
+        return os.path.join(self.output_dir, os.path.splitext(relative)[0] + '.md')
+    
+    def scan(self):
+        """扫描输入目录，返回已写入完成且需要处理的相对路径列表"""
+        now = time.monotonic()
+        seen = set()
+        ready = []
+        for pdf_path in collect_input_files([self.input_dir], ('.pdf',)):
+            relative = os.path.relpath(pdf_path, self.input_dir)
+            try:
+                st = os.stat(pdf_path)
+            except FileNotFoundError:
+                continue
+            seen.add(relative)
+            signature = [st.st_size, st.st_mtime_ns]
+            known = self.state.get(relative)
+            if known is not None and known['signature'] == signature:
+                self.pending.pop(relative, None)
+                continue
+            observed = self.pending.get(relative)
+            if observed is None or observed[0] != signature:
+                self.pending[relative] = (signature, now)
+            elif now - observed[1] >= self.debounce:
+                ready.append(relative)
+        for relative in list(self.pending):
+            if relative not in seen:
+                del self.pending[relative]
+        return ready
+    
+    def _remove_stale_images(self, pages):
+        """删除同一文档旧版本留下、本次没有生成的图片"""
+        images_dir = self.converter.images_dir
+        if not images_dir or not os.path.isdir(images_dir):
+            return
+        keep = {image['filename'] for page in pages for image in page.images}
+        for name in os.listdir(images_dir):
+            if name not in keep and self.IMAGE_NAME.match(name):
+                os.remove(os.path.join(images_dir, name))
+    
+    def process(self, relative):
+        """处理一个写入完成的PDF：内容哈希未变时只更新状态，否则转换并只重写有变化的输出"""
+        pdf_path = os.path.join(self.input_dir, relative)
+        signature = self.pending.pop(relative)[0]
+        try:
+            pdf_hash = self.file_hash(pdf_path)
+        except OSError as e:
+            print(f"✗ {relative}: 无法读取 - {e}")
+            return
+        known = self.state.get(relative)
+        if known is not None and known.get('hash') == pdf_hash:
+            known['signature'] = signature
+            self._save_state()
+            return
+        
+        output_file = self.output_file(relative)
+        os.makedirs(os.path.dirname(output_file), exist_ok=True)
+        start = time.perf_counter()
+        converter = self.converter
+        converter.output_dir = os.path.dirname(output_file)
+        converter.image_counter = 0  # 图片编号按文档计数
+        try:
+            pages = converter.convert_pages(pdf_path, output_file)
+            outputs = render_outputs(pages, self.formats, self.optimizer)
+            written = [path for fmt, path in output_paths(output_file, self.formats).items()
+                       if write_text_if_changed(path, outputs[fmt])]
+            self._remove_stale_images(pages)
+        except Exception as e:
+            # 记录签名，文件再次变化前不重试（例如损坏或仍在写入的PDF）
+            print(f"✗ {relative}: 转换失败 - {e}")
+            self.state[relative] = {'signature': signature, 'hash': None, 'error': str(e)}
+            self._save_state()
+            return
+        self.state[relative] = {'signature': signature, 'hash': pdf_hash}
+        self._save_state()
+        self.converted += 1
+        if written:
+            print(f"✓ {relative}: {len(pages)} 页，用时 {time.perf_counter() - start:.1f}s，"
+                  f"更新 {', '.join(os.path.basename(path) for path in written)}")
+        else:
+            self.unchanged += 1
+            print(f"✓ {relative}: 输出内容没有变化，未重写")
+    
+    def run(self, max_cycles=None):
+        """监视并转换，直到被中断（max_cycles 用于限制扫描次数）"""
+        watcher = DirectoryWatcher(self.input_dir, use_inotify=self.use_inotify)
+        print(f"监视模式: {watcher.mode}，按 Ctrl+C 退出")
+        cycles = 0
+        try:
+            while max_cycles is None or cycles < max_cycles:
+                cycles += 1
+                for relative in self.scan():
+                    self.process(relative)
+                # 有等待写入完成的文件时，在防抖时间到期后再扫描
+                if watcher.mode == 'poll':
+                    timeout = self.poll_interval
+                else:
+                    timeout = self.RESCAN_INTERVAL
+                if self.pending:
+                    timeout = min(timeout, self.debounce)
+                watcher.wait(timeout)
+        finally:
+            watcher.close()
+
+
+def converter_options_from_args(args):
+    """命令行参数中传给PDFToMarkdownConverter的选项（批量模式在工作进程中创建转换器）"""
+    return {
+        'use_mmap': not args.no_mmap, 'chunk_pages': args.chunk_pages,
+        'engine': args.engine, 'table_precheck': not args.no_table_precheck,
+        'detect_scans': not args.no_scan_detect, 'scan_dpi': args.scan_dpi,
+        'strip_headers': args.strip_headers, 'min_image_size': args.min_image_size,
+        'min_image_bytes': args.min_image_bytes,
+    }
+
+
+def optimizer_options_from_args(args):
+    """命令行参数中传给MarkdownOptimizer的选项"""
+    return {'similarity_window': args.similarity_window}
+
+
+def run_batch(args, formats):
+    """命令行批量模式：转换目录下的全部PDF，输出到输出目录（默认与PDF相同目录）并保持子目录结构"""
+    if args.search_index and args.queue_dir:
+        # 各节点在不同机器上运行，不能安全地同时写入共享目录上的同一个SQLite数据库
+        print("错误: 分布式批量模式（--queue-dir）不支持 --search-index，请在转换完成后单独建立索引")
+        sys.exit(1)
+    input_dir = os.path.abspath(args.pdf_file)
+    output_dir = os.path.abspath(args.output_file) if args.output_file else input_dir
+    jobs = []
+    for pdf_path in collect_input_files([input_dir], ('.pdf',)):
+        relative = os.path.splitext(os.path.relpath(pdf_path, input_dir))[0] + '.md'
+        jobs.append((pdf_path, os.path.join(output_dir, relative)))
+    if not jobs:
+        print(f"错误: 目录中没有PDF文件: {input_dir}")
+        sys.exit(1)
+    for _, output_file in jobs:
+        os.makedirs(os.path.dirname(output_file), exist_ok=True)
+    if args.queue_dir:
+        run_queue_node(args, formats, input_dir, output_dir, jobs)
+        return
+    
+    batch = BatchConverter(max_workers=args.batch_workers, memory_limit_mb=args.memory_limit,
+                           max_docs_per_worker=args.worker_max_docs, formats=formats,
+                           boilerplate_path=args.boilerplate_index,
+                           converter_options=converter_options_from_args(args),
+                           optimizer_options=optimizer_options_from_args(args),
+                           search_index=args.search_index)
+    limit = f"{batch.memory_limit_mb:.0f} MB" if batch.memory_limit_mb is not None else "不限制"
+    print("=" * 60)
+    print("PtoM - 批量转换")
+    print("=" * 60)
+    print(f"输入目录: {input_dir}（{len(jobs)} 个PDF）")
+    print(f"输出目录: {output_dir}")
+    print(f"最多 {batch.max_workers} 个进程，内存上限 {limit}，每个进程处理 {batch.max_docs_per_worker} 篇文档后回收")
+    print("=" * 60)
+    
+    start = time.perf_counter()
+    results = batch.run(jobs)
+    failed = [result for result in results if result['status'] != 'ok']
+    
+    print("\n" + "=" * 60)
+    print(f"批量转换完成: 成功 {len(results) - len(failed)} 篇，失败 {len(failed)} 篇，用时 {time.perf_counter() - start:.1f}s")
+    print(f"工作进程: 启动 {batch.workers_started} 个，内存峰值合计 {batch.peak_in_use_mb:.0f} MB，"
+          f"预估系数 {batch.cost_scale:.2f}")
+    if args.search_index:
+        print(f"全文检索索引: {args.search_index}（{batch.index_records} 条记录）")
+    for result in failed:
+        print(f"  ✗ {result['pdf']}: {result['error']}")
+    print("=" * 60)
+    if failed:
+        sys.exit(1)
+
+
+def run_queue_node(args, formats, input_dir, output_dir, jobs):
+    """命令行分布式批量模式：作为一个节点通过共享目录中的租约文件领取并转换PDF"""
+    queue = LeaseQueue(args.queue_dir, node_id=args.node_id, lease_seconds=args.lease_seconds)
+    boilerplate = BoilerplateIndex.load(args.boilerplate_index) if args.boilerplate_index else None
+    converter_options = converter_options_from_args(args)
+    optimizer_options = optimizer_options_from_args(args)
+    
+    def handle(job):
+        pdf_path, output_file = job
+        start = time.perf_counter()
+        print(f"  转换: {os.path.relpath(pdf_path, input_dir)}")
+        pages = convert_document(pdf_path, output_file, converter_options, formats, boilerplate, optimizer_options)
+        return {'pages': len(pages), 'seconds': round(time.perf_counter() - start, 3)}
+    
+    print("=" * 60)
+    print("PtoM - 分布式批量转换")
+    print("=" * 60)
+    print(f"节点: {queue.node_id}")
+    print(f"队列目录: {os.path.abspath(args.queue_dir)}（租约 {args.lease_seconds:g}s）")
+    print(f"输入目录: {input_dir}（{len(jobs)} 个PDF）")
+    print(f"输出目录: {output_dir}")
+    print("=" * 60)
+    
+    # 任务名使用相对路径：各节点的挂载点可以不同
+    named_jobs = [(os.path.relpath(pdf_path, input_dir).replace(os.sep, '/'), (pdf_path, output_file))
+                  for pdf_path, output_file in jobs]
+    results = queue.process(named_jobs, handle, poll_interval=min(5.0, args.lease_seconds / 4))
+    
+    failed = queue.failures(name for name, _ in named_jobs)
+    converted = sum(1 for _, status, _ in results if status == 'ok')
+    print("\n" + "=" * 60)
+    print(f"队列已处理完毕: 本节点转换 {converted} 篇，全部任务中失败 {len(failed)} 篇")
+    for name, error in failed:
+        print(f"  ✗ {name}: {error}")
+    print("=" * 60)
+    if failed:
+        sys.exit(1)
+
+
+def run_watch(args, formats):
+    """命令行监视模式：持续转换输入目录中新增或变化的PDF，直到按 Ctrl+C"""
+    input_dir = os.path.abspath(args.pdf_file)
+    output_dir = os.path.abspath(args.output_file) if args.output_file else input_dir
+    os.makedirs(output_dir, exist_ok=True)
+    boilerplate = BoilerplateIndex.load(args.boilerplate_index) if args.boilerplate_index else None
+    # 监视目录中的PDF可能在转换过程中被覆盖写入，截断已内存映射的文件会导致进程崩溃（SIGBUS），因此不使用内存映射
+    options = dict(converter_options_from_args(args), use_mmap=False)
+    converter = PDFToMarkdownConverter(progress=ProgressReporter(mode=args.progress), skip_unchanged_images=True,
+                                       **options)
+    optimizer = MarkdownOptimizer(boilerplate=boilerplate, **optimizer_options_from_args(args))
+    watch = WatchConverter(input_dir, output_dir, converter, optimizer,
+                           formats=formats, debounce=args.watch_debounce, poll_interval=args.watch_interval,
+                           use_inotify=not args.watch_poll)
+    print("=" * 60)
+    print("PtoM - 监视模式")
+    print("=" * 60)
+    print(f"输入目录: {input_dir}")
+    print(f"输出目录: {output_dir}")
+    print("=" * 60)
+    try:
+        watch.run()
+    except KeyboardInterrupt:
+        print(f"\n已停止监视: 转换 {watch.converted} 篇（其中 {watch.unchanged} 篇输出没有变化）")
+
+
+def build_arg_parser():
+    """构建命令行参数解析器"""
+    import argparse
+    parser = argparse.ArgumentParser(
+        prog='PtoM.py',
+        description='PtoM - 将PDF转换为Markdown并自动优化',
+    )
+    parser.add_argument('pdf_file', nargs='?', help='输入的PDF文件（目录则批量转换其中全部PDF）')
+    parser.add_argument('output_file', nargs='?', help='输出的Markdown文件（默认：原文件名.md；批量模式为输出目录）')
+    parser.add_argument('--chunk-pages', type=int, default=None, metavar='N',
+                        help='每处理N页关闭并重新打开PDF，限制超大文件的常驻内存')
+    parser.add_argument('--engine', choices=PDFToMarkdownConverter.ENGINES, default='pdfplumber',
+                        help='解析引擎：pdfplumber（默认，文本和表格用pdfplumber、图片用PyMuPDF）'
+                             '或 pymupdf（全部使用PyMuPDF，速度更快）')
+    parser.add_argument('--progress', choices=ProgressReporter.MODES, default='text',
+                        help='进度输出：text（默认）、json（每个事件一行JSON，写入stderr）或 quiet（不输出）')
+    parser.add_argument('--no-table-precheck', action='store_true',
+                        help='对每一页都执行表格识别（默认跳过没有表格线的页面）')
+    parser.add_argument('--min-image-size', type=int, default=8, metavar='PX',
+                        help='跳过宽或高小于PX像素的图片（默认8，0表示不限制）')
+    parser.add_argument('--min-image-bytes', type=int, default=128, metavar='N',
+                        help='跳过原始数据小于N字节的图片（默认128，0表示不限制）')
+    parser.add_argument('--strip-headers', action='store_true',
+                        help='先采样页面学习重复的页眉页脚区域，提取文本前裁掉')
+    parser.add_argument('--scan-dpi', type=int, default=None, metavar='DPI',
+                        help='扫描页按指定分辨率渲染为整页图片（默认保存原始分辨率的扫描图）')
+    parser.add_argument('--no-scan-detect', action='store_true',
+                        help='不识别扫描页，所有页面都做文本和表格分析')
+    parser.add_argument('--optimize-workers', type=int, default=1, metavar='N',
+                        help='Markdown优化使用N个进程（大文档分块并行，结果与串行一致；默认1）')
+    parser.add_argument('--similarity-window', type=int, nargs='?', const=MarkdownOptimizer.SIMILARITY_WINDOW,
+                        default=None, metavar='N',
+                        help='段落去重的相似度只与最近N个段落内出现过的段落比较，超长文档的优化耗时与长度成线性关系，'
+                             f'但相距更远的近似重复段落不再移除（不带N时为{MarkdownOptimizer.SIMILARITY_WINDOW}；'
+                             f'默认与全部段落比较）')
+    parser.add_argument('--formats', default='md', metavar='FMT[,FMT...]',
+                        help='输出格式，逗号分隔：md（优化后的Markdown，总是生成）、raw（<名称>.raw.md，未优化）、'
+                             'json（<名称>.json，结构化页面数据）、txt（<名称>.txt，纯文本）；PDF只解析一次')
+    parser.add_argument('--batch-workers', type=int, default=None, metavar='N',
+                        help='批量模式最多同时运行N个转换进程（默认CPU核数）')
+    parser.add_argument('--memory-limit', type=float, default=None, metavar='MB',
+                        help='批量模式的内存上限：按工作进程RSS和文档预估内存决定是否启动新任务（默认物理内存的70%%）')
+    parser.add_argument('--worker-max-docs', type=int, default=20, metavar='N',
+                        help='批量模式每个工作进程处理N篇文档后退出并重新启动，回收积累的内存（默认20）')
+    parser.add_argument('--queue-dir', metavar='DIR',
+                        help='分布式批量模式：多个节点通过共享目录DIR中的租约文件领取同一输入目录中的PDF')
+    parser.add_argument('--node-id', default=None,
+                        help='分布式批量模式的节点标识（默认：主机名-进程号）')
+    parser.add_argument('--lease-seconds', type=float, default=300, metavar='S',
+                        help='租约S秒没有心跳视为节点已崩溃，其他节点接管其任务（默认300）')
+    parser.add_argument('--watch', action='store_true',
+                        help='监视输入目录，持续转换新增或内容变化的PDF（输出内容没有变化时不重写文件）')
+    parser.add_argument('--watch-debounce', type=float, default=2.0, metavar='S',
+                        help='监视模式下文件S秒内大小和修改时间都不变才视为写入完成（默认2）')
+    parser.add_argument('--watch-interval', type=float, default=2.0, metavar='S',
+                        help='监视模式使用轮询时的扫描间隔（默认2秒）')
+    parser.add_argument('--watch-poll', action='store_true',
+                        help='监视模式不使用inotify，改为定期轮询（网络共享目录上需要）')
+    parser.add_argument('--preview', action='store_true',
+                        help='快速预览：只提取开头几页和均匀抽样页的文本（不含图片和表格），默认输出为 原文件名.preview.md')
+    parser.add_argument('--preview-budget', type=float, default=1.0, metavar='S',
+                        help='预览的时间预算（秒），到时返回已完成的页面（默认1）')
+    parser.add_argument('--preview-first-pages', type=int, default=PDFToMarkdownConverter.PREVIEW_FIRST_PAGES,
+                        metavar='N', help=f'预览包含的开头页数（默认{PDFToMarkdownConverter.PREVIEW_FIRST_PAGES}）')
+    parser.add_argument('--preview-sample-pages', type=int, default=PDFToMarkdownConverter.PREVIEW_SAMPLE_PAGES,
+                        metavar='N', help=f'预览在其余页面中均匀抽样的页数（默认{PDFToMarkdownConverter.PREVIEW_SAMPLE_PAGES}）')
+    parser.add_argument('--search-index', metavar='DB',
+                        help='同时把按页、按标题切分的正文写入SQLite FTS5全文检索数据库'
+                             '（批量模式由主进程统一写入；分布式批量模式 --queue-dir 不支持）')
+    parser.add_argument('--boilerplate-index', metavar='PATH',
+                        help='使用样板段落索引，移除跨文档反复出现的段落（免责声明、版权声明等）')
+    parser.add_argument('--rebuild-boilerplate-index', metavar='PATH',
+                        help='扫描语料重建样板段落索引后退出；位置参数指定语料目录或文件（PDF或Markdown）')
+    parser.add_argument('--boilerplate-min-docs', type=int, default=3, metavar='N',
+                        help='重建索引时，段落至少出现在N篇文档中才算样板段落（默认3）')
+    parser.add_argument('--boilerplate-max-entries', type=int, default=50000, metavar='N',
+                        help='重建索引时最多保存N个样板段落（默认50000）')
+    parser.add_argument('--no-resume', action='store_true',
+                        help='忽略已有的检查点（<输出文件>.journal），从第1页重新转换')
+    parser.add_argument('--no-mmap', action='store_true',
+                        help='不使用内存映射，由两个解析库分别按路径读取PDF')
+    return parser
+
+
 def main():
     # 打印Banner
     print_banner()
@@ -1018,23 +3818,57 @@ def main():
         except:
             pass  # 如果已经设置过，忽略错误
     
-    if len(sys.argv) < 2:
+    parser = build_arg_parser()
+    args = parser.parse_args()
+    
+    # 重建样板段落索引（位置参数作为语料路径）
+    if args.rebuild_boilerplate_index:
+        inputs = [path for path in (args.pdf_file, args.output_file) if path]
+        if not inputs:
+            print("错误: 请指定用于构建样板段落索引的语料目录或文件")
+            sys.exit(1)
+        print(f"正在重建样板段落索引: {args.rebuild_boilerplate_index}")
+        rebuild_boilerplate_index(args.rebuild_boilerplate_index, inputs,
+                                  min_docs=args.boilerplate_min_docs,
+                                  max_entries=args.boilerplate_max_entries, engine=args.engine)
+        return
+    
+    formats = ['md'] + [fmt for fmt in (part.strip() for part in args.formats.split(',')) if fmt and fmt != 'md']
+    unknown = [fmt for fmt in formats if fmt not in OUTPUT_FORMATS]
+    if unknown:
+        print(f"错误: 不支持的输出格式 {', '.join(unknown)}（可选: {', '.join(OUTPUT_FORMATS)}）")
+        sys.exit(1)
+    formats = list(dict.fromkeys(formats))
+    
+    # 批量转换：输入为目录时，在内存上限内调度多个工作进程
+    if args.pdf_file and os.path.isdir(args.pdf_file):
+        if args.watch:
+            run_watch(args, formats)
+        else:
+            run_batch(args, formats)
+        return
+    if args.queue_dir or args.watch:
+        print(f"错误: {'--queue-dir' if args.queue_dir else '--watch'} 需要指定输入目录")
+        sys.exit(1)
+    
+    if not args.pdf_file:
         print("=" * 60)
         print("PtoM - PDF to Markdown Converter")
         print("=" * 60)
         print("\n使用方法:")
-        print("    python PtoM.py <PDF文件> [输出文件]")
+        print("    python PtoM.py <PDF文件> [输出文件] [选项]")
         print("\n如果不指定输出文件，将自动生成（原文件名.md）")
         print("\n示例:")
         print("    python PtoM.py document.pdf")
         print("    python PtoM.py document.pdf output.md")
+        print("    python PtoM.py --help    查看全部选项")
         print("=" * 60)
         sys.exit(1)
     
     # 处理中文文件名（Windows编码问题）
     import glob
     
-    pdf_file_arg = sys.argv[1]
+    pdf_file_arg = args.pdf_file
     
     # 如果文件不存在，尝试使用glob查找（处理编码问题）
     if not os.path.exists(pdf_file_arg):
@@ -1066,8 +3900,8 @@ def main():
         pdf_file = os.path.abspath(pdf_file_arg)
     
     # 确定输出文件
-    if len(sys.argv) > 2:
-        output_file_arg = sys.argv[2]
+    if args.output_file:
+        output_file_arg = args.output_file
         # 如果输出文件路径不存在，使用当前目录
         if os.path.dirname(output_file_arg):
             output_file = os.path.abspath(output_file_arg)
@@ -1077,17 +3911,14 @@ def main():
         # 自动生成输出文件名
         base_name = os.path.splitext(os.path.basename(pdf_file))[0]
         output_dir = os.path.dirname(pdf_file)
-        output_file = os.path.join(output_dir, base_name + ".md")
+        output_file = os.path.join(output_dir, base_name + (".preview.md" if args.preview else ".md"))
     
     # 确保输出文件路径有效（处理编码问题）
     try:
         output_file = os.path.abspath(output_file)
-        # 测试是否可以创建文件（Windows编码兼容性）
-        test_file = output_file + '.test'
-        with open(test_file, 'w', encoding='utf-8') as f:
-            f.write('test')
-        os.remove(test_file)
-    except (UnicodeEncodeError, OSError) as e:
+        # 检查文件名能否用文件系统编码表示（Windows编码兼容性）
+        os.fsencode(output_file)
+    except UnicodeEncodeError as e:
         # 如果编码失败，使用ASCII安全的文件名
         output_dir = os.path.dirname(output_file)
         base_name = os.path.basename(output_file)
@@ -1109,14 +3940,56 @@ def main():
     print(f"输出文件: {output_file}")
     print("=" * 60)
     
+    # 快速预览：只提取抽样页的文本，在时间预算内返回
+    if args.preview:
+        start = time.perf_counter()
+        try:
+            converter = PDFToMarkdownConverter(use_mmap=not args.no_mmap, engine=args.engine,
+                                               progress=ProgressReporter(mode='quiet'))
+            content = converter.preview(pdf_file, first_pages=args.preview_first_pages,
+                                        sample_pages=args.preview_sample_pages, budget=args.preview_budget)
+            write_text_atomic(output_file, content)
+        except Exception as e:
+            print(f"✗ 错误: 预览失败 - {e}")
+            sys.exit(1)
+        print(content.split('\n', 1)[0])
+        print(f"✓ 预览已保存: {output_file}（用时 {time.perf_counter() - start:.2f}s）")
+        return
+    
+    paths = output_paths(output_file, formats)
+    
+    boilerplate = None
+    if args.boilerplate_index:
+        try:
+            boilerplate = BoilerplateIndex.load(args.boilerplate_index)
+        except (OSError, ValueError, KeyError) as e:
+            print(f"✗ 错误: 无法读取样板段落索引 - {e}")
+            sys.exit(1)
+        print(f"样板段落索引: {args.boilerplate_index}（{len(boilerplate)} 个样板段落）")
+    
     # 步骤1: 转换PDF为Markdown
     print("\n[步骤 1/2] 正在转换PDF为Markdown...")
     try:
         # 确定输出目录（用于保存图片）
         output_dir = os.path.dirname(os.path.abspath(output_file)) if os.path.dirname(output_file) else os.path.dirname(os.path.abspath(pdf_file))
-        converter = PDFToMarkdownConverter(output_dir=output_dir)
-        markdown_content = converter.convert(pdf_file, output_file)
-        print(f"✓ PDF转换完成，共提取 {len(markdown_content)} 字符")
+        converter = PDFToMarkdownConverter(output_dir=output_dir, use_mmap=not args.no_mmap,
+                                           chunk_pages=args.chunk_pages, engine=args.engine,
+                                           progress=ProgressReporter(mode=args.progress),
+                                           table_precheck=not args.no_table_precheck,
+                                           detect_scans=not args.no_scan_detect, scan_dpi=args.scan_dpi,
+                                           strip_headers=args.strip_headers,
+                                           min_image_size=args.min_image_size, min_image_bytes=args.min_image_bytes)
+        journal_path = output_file + '.journal'
+        if args.no_resume and os.path.exists(journal_path):
+            os.remove(journal_path)
+        journal = ConversionJournal(journal_path, pdf_file, engine=converter.engine,
+                                    options=converter.output_options())
+        try:
+            pages = converter.convert_pages(pdf_file, output_file, journal=journal)
+        finally:
+            journal.close()
+        char_count = sum(len(page.text) for page in pages)
+        print(f"✓ PDF转换完成，共 {len(pages)} 页，提取 {char_count} 字符")
         
         # 如果提取了图片，显示图片目录信息
         if converter.image_counter > 0:
@@ -1130,9 +4003,13 @@ def main():
     # 步骤2: 优化Markdown
     print("\n[步骤 2/2] 正在优化Markdown文档...")
     try:
-        optimizer = MarkdownOptimizer()
-        optimized_content = optimizer.optimize(markdown_content)
+        optimizer = MarkdownOptimizer(workers=args.optimize_workers, boilerplate=boilerplate,
+                                      **optimizer_options_from_args(args))
+        outputs = render_outputs(pages, formats, optimizer)
+        optimized_content = outputs['md']
         print(f"✓ Markdown优化完成")
+        if boilerplate is not None:
+            print(f"✓ 移除样板段落 {optimizer.boilerplate_removed} 个")
     except Exception as e:
         print(f"✗ 错误: Markdown优化失败 - {e}")
         sys.exit(1)
@@ -1140,13 +4017,27 @@ def main():
     # 保存文件
     print(f"\n正在保存到: {output_file}")
     try:
-        with open(output_file, 'w', encoding='utf-8') as f:
-            f.write(optimized_content)
+        for fmt in formats:
+            write_text_atomic(paths[fmt], outputs[fmt])
+        journal.remove()
         print(f"✓ 文件保存成功")
     except Exception as e:
         print(f"✗ 错误: 无法保存文件 - {e}")
         sys.exit(1)
     
+    # 写入全文检索索引（直接使用转换结果，无需重新读取Markdown）
+    if args.search_index:
+        try:
+            search_index = SearchIndexWriter(args.search_index)
+            try:
+                search_index.add_pages(output_file, pages)
+            finally:
+                search_index.close()
+            print(f"✓ 全文检索索引已写入: {args.search_index}（{search_index.records} 条记录）")
+        except Exception as e:
+            print(f"✗ 错误: 无法写入全文检索索引 - {e}")
+            sys.exit(1)
+    
     # 统计信息
     print("\n" + "=" * 60)
     print("转换完成！")
@@ -1154,6 +4045,8 @@ def main():
     print(f"原PDF文件: {pdf_file}")
     print(f"输出Markdown: {output_file}")
     print(f"文件大小: {len(optimized_content)} 字符")
+    for fmt in formats[1:]:
+        print(f"输出{fmt}: {paths[fmt]}")
     print("=" * 60)
 
 
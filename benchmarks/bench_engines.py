@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+PtoM 解析引擎对比基准：pdfplumber 引擎 vs pymupdf 引擎
+
+对同一PDF分别使用两种引擎转换，输出总耗时、各阶段耗时（来自 PageResult.timings），
+以及两种引擎优化后Markdown的一致程度。
+
+使用方法：
+    python benchmarks/bench_engines.py [PDF文件] [--pages 100] [--repeat 1]
+
+不指定PDF时生成一个包含文本、表格和图片的合成PDF。
+"""
+
+import argparse
+import contextlib
+import difflib
+import io
+import os
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from PtoM import PDFToMarkdownConverter, MarkdownOptimizer
+
+
+def generate_pdf(path, pages):
+    """生成合成PDF：正文段落、带边框的表格和小图片"""
+    import fitz
+
+    pix = fitz.Pixmap(fitz.csRGB, fitz.IRect(0, 0, 64, 64), False)
+    pix.set_rect(pix.irect, (180, 40, 40))
+    doc = fitz.open()
+    for page_num in range(1, pages + 1):
+        page = doc.new_page()
+        y = 72
+        page.insert_text((72, y), f"{page_num}.1 Section {page_num}", fontsize=13)
+        y += 24
+        for line in range(30):
+            page.insert_text((72, y), f"Line {line} of page {page_num}: the quick brown fox jumps over the lazy dog.", fontsize=9)
+            y += 12
+        if page_num % 2:
+            for row in range(6):
+                for col in range(4):
+                    rect = fitz.Rect(72 + col * 110, y + row * 16, 182 + col * 110, y + (row + 1) * 16)
+                    page.draw_rect(rect, color=(0, 0, 0), width=0.5)
+                    page.insert_text((rect.x0 + 3, rect.y1 - 4), f"R{row}C{col}", fontsize=8)
+            y += 110
+        page.insert_image(fitz.Rect(72, y, 136, y + 64), pixmap=pix)
+    doc.save(path)
+    doc.close()
+
+
+def run_engine(pdf_path, engine):
+    """使用指定引擎转换，返回（耗时, 各阶段耗时合计, 优化后Markdown）"""
+    out_dir = tempfile.mkdtemp(prefix=f'ptom_{engine}_')
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        converter = PDFToMarkdownConverter(output_dir=out_dir, engine=engine)
+        pages = converter.convert_pages(pdf_path, os.path.join(out_dir, 'out.md'))
+    elapsed = time.perf_counter() - start
+    stages = {}
+    for page in pages:
+        for stage, seconds in page.timings.items():
+            stages[stage] = stages.get(stage, 0.0) + seconds
+    markdown = MarkdownOptimizer().optimize_pages(pages)
+    return elapsed, stages, markdown, len(pages)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='PtoM 解析引擎对比基准')
+    parser.add_argument('pdf', nargs='?', help='待测试的PDF（默认生成合成PDF）')
+    parser.add_argument('--pages', type=int, default=100, help='合成PDF页数')
+    parser.add_argument('--repeat', type=int, default=1, help='每个引擎重复次数（取最快一次）')
+    args = parser.parse_args()
+
+    pdf_path = args.pdf
+    if not pdf_path:
+        pdf_path = os.path.join(tempfile.mkdtemp(prefix='ptom_bench_'), 'synthetic.pdf')
+        generate_pdf(pdf_path, args.pages)
+    print(f"PDF: {pdf_path}")
+
+    results = {}
+    for engine in PDFToMarkdownConverter.ENGINES:
+        runs = [run_engine(pdf_path, engine) for _ in range(max(1, args.repeat))]
+        results[engine] = min(runs, key=lambda r: r[0])
+
+    print(f"{'引擎':<12}{'页数':>6}{'总耗时(s)':>12}{'页/秒':>10}{'图片(s)':>10}{'文本(s)':>10}{'表格(s)':>10}")
+    for engine, (elapsed, stages, _, page_count) in results.items():
+        print(f"{engine:<12}{page_count:>6}{elapsed:>12.2f}{page_count / elapsed if elapsed else 0:>10.1f}"
+              f"{stages.get('images', 0):>10.2f}{stages.get('text', 0):>10.2f}{stages.get('tables', 0):>10.2f}")
+
+    base = results['pdfplumber'][2]
+    other = results['pymupdf'][2]
+    ratio = difflib.SequenceMatcher(None, base.splitlines(), other.splitlines(), autojunk=False).ratio()
+    speedup = results['pdfplumber'][0] / results['pymupdf'][0] if results['pymupdf'][0] else 0
+    print(f"\n加速比: {speedup:.1f}x    输出一致: {'是' if base == other else '否'}    行相似度: {ratio:.3f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+PtoM 内存基准测试：比较不同PDF输入方式下的峰值常驻内存（RSS）
+
+生成包含不可压缩图片的大型合成PDF，然后分别在子进程中以下列方式转换：
+    path      两个解析库分别按路径打开（旧行为）
+    mmap      内存映射一次，两个解析库共享缓冲区
+    mmap+chunk 内存映射 + 每N页关闭并重新打开文档
+
+使用方法：
+    python benchmarks/bench_memory.py [--pages 400] [--image-kb 1024] [--chunk-pages 50]
+
+依赖：pdfplumber、PyMuPDF；峰值内存通过 resource 模块获取（仅限Unix）。
+在Linux上还会采样 /proc/self/status 的 RssAnon：内存映射的文件页可被系统随时回收，
+计入RSS但不计入匿名内存，因此匿名内存峰值更能反映进程自身的内存压力。
+"""
+
+import argparse
+import contextlib
+import io
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def generate_pdf(path, pages, image_kb):
+    """生成合成PDF：每页一段文本、一个表格和一张随机噪声图片"""
+    import fitz
+
+    side = max(16, int((image_kb * 1024 / 3) ** 0.5))
+    doc = fitz.open()
+    for page_num in range(1, pages + 1):
+        page = doc.new_page()
+        y = 72
+        for line in range(20):
+            page.insert_text((72, y), f"Page {page_num} line {line}: synthetic benchmark text content.", fontsize=9)
+            y += 12
+        for row in range(4):
+            for col in range(3):
+                rect = fitz.Rect(72 + col * 120, y + row * 16, 192 + col * 120, y + (row + 1) * 16)
+                page.draw_rect(rect, color=(0, 0, 0), width=0.5)
+                page.insert_text((rect.x0 + 3, rect.y1 - 4), f"r{row}c{col}", fontsize=8)
+        # 随机噪声图片无法被压缩，用于撑大文件体积
+        pix = fitz.Pixmap(fitz.csRGB, fitz.IRect(0, 0, side, side), False)
+        pix.set_rect(pix.irect, (0, 0, 0))
+        pix.samples_mv[:] = os.urandom(len(pix.samples_mv))
+        page.insert_image(fitz.Rect(72, y + 80, 372, y + 380), pixmap=pix)
+    doc.save(path)
+    doc.close()
+
+
+def read_anon_rss_kb():
+    """读取当前匿名常驻内存（KB），非Linux返回0"""
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('RssAnon:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return 0
+
+
+def run_child(pdf_path, use_mmap, chunk_pages):
+    """子进程入口：转换PDF（不保留结果）并输出峰值RSS和峰值匿名内存"""
+    from PtoM import PDFToMarkdownConverter
+
+    peak_anon = [0]
+    done = threading.Event()
+
+    def sample():
+        while not done.is_set():
+            peak_anon[0] = max(peak_anon[0], read_anon_rss_kb())
+            done.wait(0.01)
+
+    sampler = threading.Thread(target=sample, daemon=True)
+    sampler.start()
+
+    out_dir = tempfile.mkdtemp(prefix='ptom_bench_')
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        converter = PDFToMarkdownConverter(output_dir=out_dir, use_mmap=use_mmap, chunk_pages=chunk_pages)
+        for _ in converter.iter_pages(pdf_path, os.path.join(out_dir, 'out.md')):
+            pass
+    elapsed = time.perf_counter() - start
+    done.set()
+    sampler.join()
+
+    peak_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        peak_kb //= 1024
+    print(f"{peak_kb} {peak_anon[0]} {elapsed:.3f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='PtoM 内存基准测试')
+    parser.add_argument('--pages', type=int, default=400, help='合成PDF页数')
+    parser.add_argument('--image-kb', type=int, default=1024, help='每页图片的原始大小（KB）')
+    parser.add_argument('--chunk-pages', type=int, default=50, help='分块模式下每块页数')
+    parser.add_argument('--pdf', help='使用已有PDF，而不是生成合成PDF')
+    parser.add_argument('--child', nargs=3, metavar=('PDF', 'MMAP', 'CHUNK'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        pdf_path, use_mmap, chunk = args.child
+        run_child(pdf_path, use_mmap == '1', int(chunk) or None)
+        return
+
+    pdf_path = args.pdf
+    if not pdf_path:
+        pdf_path = os.path.join(tempfile.mkdtemp(prefix='ptom_bench_'), 'synthetic.pdf')
+        print(f"正在生成合成PDF: {args.pages} 页 ...")
+        generate_pdf(pdf_path, args.pages, args.image_kb)
+    size_mb = os.path.getsize(pdf_path) / 1024 / 1024
+    print(f"PDF: {pdf_path} ({size_mb:.1f} MB)")
+
+    configs = [
+        ('path', '0', '0'),
+        ('mmap', '1', '0'),
+        (f'mmap+chunk{args.chunk_pages}', '1', str(args.chunk_pages)),
+    ]
+    print(f"{'模式':<16}{'峰值RSS(MB)':>14}{'峰值匿名(MB)':>14}{'耗时(s)':>10}")
+    for name, use_mmap, chunk in configs:
+        output = subprocess.check_output(
+            [sys.executable, os.path.abspath(__file__), '--child', pdf_path, use_mmap, chunk],
+            text=True,
+        )
+        peak_kb, anon_kb, elapsed = output.split()[-3:]
+        print(f"{name:<16}{int(peak_kb) / 1024:>14.1f}{int(anon_kb) / 1024:>14.1f}{float(elapsed):>10.2f}")
+
+
+if __name__ == '__main__':
+    main()
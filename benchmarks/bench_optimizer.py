@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+PtoM Markdown优化器基准测试：各行处理步骤的耗时和峰值内存
+
+生成指定大小的合成Markdown（正文、命令、配置项、标题、表格、链接、代码块混合），
+在子进程中按 MarkdownOptimizer.optimize 的顺序逐步执行各优化步骤，输出每一步的耗时；
+再在另一个子进程中完整调用一次 optimize()，输出总耗时和峰值RSS相对于读入文本后的增量。
+
+段落去重（remove_duplicate_content）的每个段落要与全部已保留段落比较相似度，
+在100MB输入上耗时很长，默认不计入；可用 --with-dedup 在较小输入上测试。
+
+使用方法：
+    python benchmarks/bench_optimizer.py [--size-mb 100] [--compare 旧版PtoM.py]
+
+--compare 可以指定另一个版本的 PtoM.py（例如 git show HEAD~1:PtoM.py > /tmp/PtoM_old.py），
+两个版本在同一输入上分别测试并检查输出是否一致。
+"""
+
+import argparse
+import importlib.util
+import os
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+WORDS = ("alpha beta gamma delta config server network host port user file data "
+         "log index value system cluster node service request").split()
+COMMANDS = ["sudo systemctl restart nginx", "yum install -y httpd", "cd /etc/nginx", "ls -la",
+            "cat /var/log/messages", "pip install pdfplumber", "export PATH=/usr/bin", "# comment line"]
+CONFIGS = ["network.host: 0.0.0.0", "HOME_NET: \"[192.168.0.0/16]\"", "http.port: 9200",
+           "path_data: [\"/var\"]", "HTTP_PORTS: 80"]
+
+
+def generate_markdown(path, size_mb, seed=0):
+    """生成约 size_mb MB 的合成Markdown（带页面标记，与转换器输出格式一致）"""
+    rng = random.Random(seed)
+    target = size_mb * 1024 * 1024
+    written = 0
+    page_num = 0
+    with open(path, 'w', encoding='utf-8') as f:
+        while written < target:
+            page_num += 1
+            parts = []
+            if page_num > 1:
+                parts.append("\n---\n")
+            parts.append(f"## 第 {page_num} 页\n\n")
+            lines = []
+            for _ in range(rng.randint(20, 40)):
+                k = rng.random()
+                if k < 0.45:
+                    lines.append(" ".join(rng.choice(WORDS) for _ in range(rng.randint(4, 16))) + f" {page_num}")
+                elif k < 0.55:
+                    lines.append(rng.choice(COMMANDS))
+                elif k < 0.63:
+                    lines.append(rng.choice(CONFIGS))
+                elif k < 0.68:
+                    lines.append(f"{rng.randint(1, 9)}.{rng.randint(1, 9)} Section {rng.choice(WORDS)}")
+                elif k < 0.71:
+                    lines.append(f"{rng.randint(1, 9)}.{rng.randint(1, 9)}.{rng.randint(1, 9)} Sub {rng.choice(WORDS)}")
+                elif k < 0.73:
+                    lines.append(rng.choice(["一 概述", "二 安装", "三 配置", "四 测试"]))
+                elif k < 0.76:
+                    lines.append("https://example.com/" + rng.choice(WORDS))
+                elif k < 0.79:
+                    lines.append("```" + rng.choice(["", "bash", "yaml"]))
+                elif k < 0.82:
+                    lines.append("- " + rng.choice(WORDS))
+                elif k < 0.85:
+                    lines.append("  indented " + rng.choice(WORDS) + "  ")
+                else:
+                    lines.append("")
+            parts.append("\n".join(lines) + "\n")
+            if rng.random() < 0.2:
+                parts.append("\n### 表格\n\n| Name | Port |\n| --- | --- |\n| http | 80 |\n\n")
+            chunk = "".join(parts)
+            f.write(chunk)
+            written += len(chunk.encode('utf-8'))
+
+
+def load_module(path):
+    """按文件路径加载一个版本的 PtoM 模块"""
+    spec = importlib.util.spec_from_file_location('ptom_bench_target', path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def peak_rss_kb():
+    """当前进程的峰值RSS（KB）"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak // 1024 if sys.platform == 'darwin' else peak
+
+
+def make_optimizer(module, with_dedup):
+    """创建优化器；不测试段落去重时将该步骤替换为原样返回"""
+    if with_dedup:
+        return module.MarkdownOptimizer()
+
+    class Optimizer(module.MarkdownOptimizer):
+        def remove_duplicate_content(self, lines):
+            return lines
+
+    return Optimizer()
+
+
+def run_child(mode, module_path, md_path, output_path, with_dedup=False):
+    """子进程入口：stages 模式输出各步骤耗时，full 模式输出 optimize() 总耗时和峰值内存增量"""
+    module = load_module(module_path)
+    optimizer = make_optimizer(module, with_dedup)
+    with open(md_path, encoding='utf-8') as f:
+        content = f.read()
+    base_kb = peak_rss_kb()
+
+    if mode == 'full':
+        start = time.perf_counter()
+        result = optimizer.optimize(content)
+        print(f"optimize {time.perf_counter() - start:.3f}")
+        print(f"peak_delta_kb {peak_rss_kb() - base_kb}")
+        with open(output_path, 'w', encoding='utf-8') as f:
+            f.write(result)
+        return
+
+    timings = []
+
+    def timed(name, func, *args):
+        start = time.perf_counter()
+        value = func(*args)
+        timings.append((name, time.perf_counter() - start))
+        return value
+
+    lines = timed('split', lambda: content.split('\n'))
+    if hasattr(module, 'LineStore'):
+        lines = timed('classify', module.LineStore, lines)
+    lines = timed('remove_page_markers', optimizer.remove_page_markers, lines)
+    lines = timed('clean_duplicate_tables', optimizer.clean_duplicate_tables, lines)
+    if with_dedup:
+        lines = timed('remove_duplicate_content', optimizer.remove_duplicate_content, lines)
+    lines = timed('fix_title_hierarchy', optimizer.fix_title_hierarchy, lines)
+    lines = timed('optimize_code_blocks', optimizer.optimize_code_blocks, lines)
+    lines = timed('format_links', optimizer.format_links, lines)
+    lines = timed('clean_extra_blank_lines', optimizer.clean_extra_blank_lines, lines)
+    result = timed('join', lambda: '\n'.join(lines))
+    timed('fix_specific_issues', optimizer.fix_specific_issues, result)
+    for name, seconds in timings:
+        print(f"{name} {seconds:.3f}")
+
+
+def run_mode(mode, module_path, md_path, output_path, with_dedup):
+    """启动一个子进程，返回解析后的 {名称: 数值}"""
+    args = [sys.executable, os.path.abspath(__file__), '--child', mode, module_path, md_path, output_path]
+    if with_dedup:
+        args.append('--with-dedup')
+    output = subprocess.check_output(args, text=True)
+    return {name: float(value) for name, value in (line.split() for line in output.splitlines())}
+
+
+def measure(module_path, md_path, with_dedup):
+    """测试一个版本，返回（各步骤耗时, optimize()总耗时, 峰值内存增量KB, 输出文件路径）"""
+    fd, output_path = tempfile.mkstemp(prefix='ptom_opt_', suffix='.md')
+    os.close(fd)
+    timings = run_mode('stages', module_path, md_path, output_path, with_dedup)
+    full = run_mode('full', module_path, md_path, output_path, with_dedup)
+    return timings, full['optimize'], int(full['peak_delta_kb']), output_path
+
+
+def main():
+    parser = argparse.ArgumentParser(description='PtoM Markdown优化器基准测试')
+    parser.add_argument('--size-mb', type=int, default=100, help='合成Markdown大小（MB）')
+    parser.add_argument('--markdown', help='使用已有的Markdown文件，而不是生成合成输入')
+    parser.add_argument('--compare', metavar='PtoM.py', help='与另一个版本的 PtoM.py 对比')
+    parser.add_argument('--with-dedup', action='store_true', help='同时测试段落去重（仅适合小输入）')
+    parser.add_argument('--child', nargs=4, metavar=('MODE', 'MODULE', 'MARKDOWN', 'OUTPUT'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(*args.child, with_dedup=args.with_dedup)
+        return
+
+    md_path = args.markdown
+    if not md_path:
+        md_path = os.path.join(tempfile.mkdtemp(prefix='ptom_bench_'), 'synthetic.md')
+        print(f"正在生成合成Markdown: {args.size_mb} MB ...")
+        generate_markdown(md_path, args.size_mb)
+    print(f"输入: {md_path} ({os.path.getsize(md_path) / 1024 / 1024:.1f} MB)")
+
+    versions = [('当前', os.path.join(ROOT, 'PtoM.py'))]
+    if args.compare:
+        versions.insert(0, ('对比', os.path.abspath(args.compare)))
+
+    results = []
+    for name, module_path in versions:
+        results.append((name,) + measure(module_path, md_path, args.with_dedup))
+
+    stages = []
+    for _, timings, _, _, _ in results:
+        stages.extend(stage for stage in timings if stage not in stages)
+    print(f"{'步骤':<26}" + ''.join(f"{name + '(s)':>12}" for name, _, _, _, _ in results))
+    for stage in stages:
+        row = ''.join(f"{timings[stage]:>12.2f}" if stage in timings else f"{'-':>12}"
+                      for _, timings, _, _, _ in results)
+        print(f"{stage:<26}{row}")
+    print(f"{'各步骤合计':<21}" + ''.join(f"{sum(timings.values()):>12.2f}" for _, timings, _, _, _ in results))
+    print(f"{'optimize()':<26}" + ''.join(f"{total:>12.2f}" for _, _, total, _, _ in results))
+    print(f"{'峰值内存增量(MB)':<18}" + ''.join(f"{peak / 1024:>12.1f}" for _, _, _, peak, _ in results))
+
+    outputs = []
+    for _, _, _, _, output_path in results:
+        with open(output_path, encoding='utf-8') as f:
+            outputs.append(f.read())
+        os.remove(output_path)
+    if len(outputs) > 1:
+        print("输出一致" if all(output == outputs[0] for output in outputs) else "输出不一致！")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+PtoM 表格预检验证：比较“先预检再识别”与“每页都识别”的结果和耗时
+
+对语料中的每一页，分别记录：
+    - 不做预检时 filter_tables(extract_tables()) 得到的有效表格（现有行为）
+    - 预检结果（是否跳过表格识别）
+被跳过但现有行为能识别出有效表格的页面计为“漏检”，出现漏检时以非零状态退出。
+
+使用方法：
+    python benchmarks/bench_table_precheck.py [PDF文件或目录 ...] [--engine pdfplumber|pymupdf|all]
+
+不指定语料时生成一个包含多种页面结构的合成语料（纯文本、下划线、文本框、带线表格、仅横线表格）。
+"""
+
+import argparse
+import contextlib
+import io
+import os
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from PtoM import PDFToMarkdownConverter
+
+
+def generate_corpus(directory, pages_per_kind=10):
+    """生成合成语料，每种页面结构一份PDF"""
+    import fitz
+
+    def text(page, y0=72, lines=25):
+        for line in range(lines):
+            page.insert_text((72, y0 + line * 12), f"Body text line {line}, plain paragraph content.", fontsize=9)
+
+    def grid(page, y0, rows, cols, vertical=True):
+        for row in range(rows + 1):
+            page.draw_line((72, y0 + row * 16), (72 + cols * 100, y0 + row * 16))
+        if vertical:
+            for col in range(cols + 1):
+                page.draw_line((72 + col * 100, y0), (72 + col * 100, y0 + rows * 16))
+        for row in range(rows):
+            for col in range(cols):
+                page.insert_text((75 + col * 100, y0 + row * 16 + 12), f"r{row}c{col}", fontsize=8)
+
+    kinds = {
+        'text_only': lambda page: text(page),
+        'underlines': lambda page: (text(page), [page.draw_line((72, 90 + k * 48), (300, 90 + k * 48)) for k in range(6)]),
+        'text_box': lambda page: (text(page, 100, 10), page.draw_rect(fitz.Rect(60, 80, 500, 240))),
+        'ruled_table': lambda page: (text(page, 72, 8), grid(page, 200, 5, 4)),
+        'cell_rects': lambda page: (text(page, 72, 8), [page.draw_rect(fitz.Rect(72 + c * 100, 200 + r * 16, 172 + c * 100, 216 + r * 16))
+                                                      for r in range(4) for c in range(3)],
+                                    [page.insert_text((75 + c * 100, 212 + r * 16), f"v{r}{c}", fontsize=8)
+                                     for r in range(4) for c in range(3)]),
+        'horizontal_rules_only': lambda page: (text(page, 72, 8), grid(page, 200, 5, 4, vertical=False)),
+    }
+    paths = []
+    for name, draw in kinds.items():
+        doc = fitz.open()
+        for _ in range(pages_per_kind):
+            draw(doc.new_page())
+        path = os.path.join(directory, f"{name}.pdf")
+        doc.save(path)
+        doc.close()
+        paths.append(path)
+    return paths
+
+
+def collect_pdfs(inputs):
+    """展开命令行中的文件和目录"""
+    paths = []
+    for item in inputs:
+        if os.path.isdir(item):
+            for root, _, files in os.walk(item):
+                paths.extend(os.path.join(root, f) for f in sorted(files) if f.lower().endswith('.pdf'))
+        else:
+            paths.append(item)
+    return paths
+
+
+def validate_pdfplumber(converter, pdf_path):
+    """返回每页的（预检是否通过, 有效表格数, 识别耗时, 预检耗时）"""
+    rows = []
+    with converter.pdfplumber.open(pdf_path) as pdf:
+        for page in pdf.pages:
+            page.extract_text()  # 与转换流程一致：文本提取已缓存页面对象
+            start = time.perf_counter()
+            passed = converter.has_table_structure(page)
+            check_time = time.perf_counter() - start
+            start = time.perf_counter()
+            tables = converter.filter_tables(page.extract_tables())
+            extract_time = time.perf_counter() - start
+            rows.append((passed, len(tables), extract_time, check_time))
+            page.close()
+    return rows
+
+
+def validate_pymupdf(converter, pdf_path):
+    """返回每页的（预检是否通过, 有效表格数, 识别耗时, 预检耗时）"""
+    rows = []
+    doc = converter.fitz.open(pdf_path)
+    try:
+        for fitz_page in doc:
+            start = time.perf_counter()
+            passed = converter.has_table_structure_fitz(fitz_page)
+            check_time = time.perf_counter() - start
+            start = time.perf_counter()
+            tables = converter.filter_tables([table for table, _ in converter.extract_tables_with_fitz(fitz_page)])
+            extract_time = time.perf_counter() - start
+            rows.append((passed, len(tables), extract_time, check_time))
+    finally:
+        doc.close()
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description='PtoM 表格预检验证')
+    parser.add_argument('inputs', nargs='*', help='PDF文件或目录（默认生成合成语料）')
+    parser.add_argument('--engine', choices=PDFToMarkdownConverter.ENGINES + ('all',), default='all')
+    args = parser.parse_args()
+
+    pdfs = collect_pdfs(args.inputs) if args.inputs else generate_corpus(tempfile.mkdtemp(prefix='ptom_corpus_'))
+    with contextlib.redirect_stdout(io.StringIO()):
+        converter = PDFToMarkdownConverter()
+    engines = PDFToMarkdownConverter.ENGINES if args.engine == 'all' else (args.engine,)
+    validators = {'pdfplumber': validate_pdfplumber, 'pymupdf': validate_pymupdf}
+
+    missed_total = 0
+    for engine in engines:
+        if engine == 'pymupdf' and not converter.has_fitz:
+            print("跳过pymupdf引擎：未安装PyMuPDF")
+            continue
+        print(f"\n引擎: {engine}")
+        print(f"{'文件':<28}{'页数':>6}{'跳过':>6}{'有表格':>8}{'漏检':>6}{'识别耗时(s)':>13}{'预检后(s)':>11}")
+        for pdf_path in pdfs:
+            with contextlib.redirect_stdout(io.StringIO()):
+                rows = validators[engine](converter, pdf_path)
+            skipped = sum(1 for passed, _, _, _ in rows if not passed)
+            with_tables = sum(1 for _, count, _, _ in rows if count)
+            missed = sum(1 for passed, count, _, _ in rows if not passed and count)
+            full_time = sum(extract for _, _, extract, _ in rows)
+            gated_time = sum(check + (extract if passed else 0) for passed, _, extract, check in rows)
+            missed_total += missed
+            print(f"{os.path.basename(pdf_path)[:27]:<28}{len(rows):>6}{skipped:>6}{with_tables:>8}{missed:>6}"
+                  f"{full_time:>13.3f}{gated_time:>11.3f}")
+
+    print(f"\n漏检页数合计: {missed_total}")
+    sys.exit(1 if missed_total else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,259 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+PtoM Markdown优化器最坏情况性能测试：生成对抗性Markdown，检查耗时随输入大小近似线性增长
+
+每类对抗输入（超长行、连续配置项、成串的代码块标记、大量互不相同或近似重复的段落、
+重复字符组成的长段落、前文很长的表格等）以及随机拼接的片段，分别按 n、scale*n、scale^2*n
+等大小生成，在带超时的子进程中完整调用一次 MarkdownOptimizer.optimize()。
+输入每放大 scale 倍，耗时增长超过 scale*slack 倍、单位耗时超过 --max-ms-per-kb 或超时即为失败。
+
+线性耗时依赖段落去重的相似度窗口，默认以 --similarity-window 200 测试；
+--similarity-window 0 测试默认的全文比较（大量互不相同的段落时耗时按平方增长）。
+
+--record 会把随机输入中单位耗时最高的几个样本写入 benchmarks/fixtures/ 作为回归样本；
+--fixtures 只运行已记录的回归样本并检查单位耗时。
+
+使用方法：
+    python benchmarks/fuzz_optimizer.py [--size-kb 16] [--scale 4] [--steps 3] [--random 20]
+    python benchmarks/fuzz_optimizer.py --random 200 --record 5
+    python benchmarks/fuzz_optimizer.py --fixtures
+"""
+
+import argparse
+import glob
+import importlib.util
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FIXTURE_DIR = os.path.join(ROOT, 'benchmarks', 'fixtures')
+
+WORDS = "alpha beta gamma delta config server network host port user file data log index value".split()
+FRAGMENTS = [
+    "", "  ", "---", "## 第 3 页", "# title", "## heading", "![图片](a.png)", "```", "```bash", " ```yaml ",
+    "| a | b |", "|---|---|", "一 概述", "1.2 Section x", "1.2.3 Sub", "3. item", "sudo ls", "cd /etc",
+    "log.level: debug", "network.host: 0.0.0.0", "HOME_NET: x", "path: [1]", "export X=1", "- item",
+    "http://example.com/x", "https://a.b/[x]", "一段中文，带标点。", "### 表格", "\tindented", "./run.sh",
+    "a_b_c_d_e_f_g_h_i_j", "x" * 60, "ab" * 40, "word " * 30, "| " + "cell | " * 12,
+]
+
+
+def _paragraphs(n, make):
+    """按 make(i) 生成段落，直到总长度达到约 n 个字符"""
+    parts = []
+    size = 0
+    i = 0
+    while size < n:
+        part = make(i)
+        parts.append(part)
+        size += len(part) + 2
+        i += 1
+    return '\n\n'.join(parts)
+
+
+# 各类对抗输入：参数为目标字符数和随机数生成器
+FAMILIES = {
+    'long_line': lambda n, rng: 'x\n' + 'a_' * (n // 2) + '\ny',
+    'config_chain': lambda n, rng: 'x\n' + 'a.b: c\n' * (n // 7) + 'y',
+    'text_config': lambda n, rng: 'text\na.b: c\n' * (n // 12),
+    'fences': lambda n, rng: '```\n' * (n // 4),
+    'fence_pairs': lambda n, rng: '```bash\nls\n```\n\n' * (n // 16),
+    'yaml_merge': lambda n, rng: '```yaml\nx\n```\n\na.b: c\n' * (n // 22),
+    'commands': lambda n, rng: 'cd x\n\n' * (n // 6),
+    'dup_paras': lambda n, rng: 'alpha beta gamma delta epsilon zeta\n\n' * (n // 38),
+    'distinct_paras': lambda n, rng: _paragraphs(n, lambda i: ' '.join(rng.choice(WORDS) for _ in range(12))),
+    'near_dup_paras': lambda n, rng: _paragraphs(n, lambda i: ('word%d ' % (i % 7)) * 60),
+    'cjk_paras': lambda n, rng: _paragraphs(n, lambda i: ''.join(chr(0x4e00 + rng.randrange(3000)) for _ in range(40))),
+    'repeat_lengths': lambda n, rng: _paragraphs(n, lambda i: 'ab' * (50 + 37 * i)),
+    'repeat_two': lambda n, rng: 'ab' * (n // 6) + '\n\n' + 'ab' * (n // 3),
+    'table_long_prev': lambda n, rng: ('x' * (n // 1000 + 1) + '\n') * 100 + '| ' + 'y' * (n // 4) + ' | z |\n| a | b |\n',
+}
+
+
+def generate_random(n, rng):
+    """随机拼接片段（偶尔变异、重复）生成约 n 个字符的Markdown"""
+    lines = []
+    size = 0
+    while size < n:
+        k = rng.random()
+        if k < 0.6:
+            line = rng.choice(FRAGMENTS)
+        elif k < 0.8:
+            line = ' '.join(rng.choice(WORDS) for _ in range(rng.randint(1, 20)))
+        elif k < 0.9 and lines:
+            line = rng.choice(lines)  # 重复出现过的行
+        else:
+            line = rng.choice(FRAGMENTS) * rng.randint(2, 50)
+        if rng.random() < 0.1:
+            pos = rng.randrange(len(line) + 1)
+            line = line[:pos] + rng.choice(['`', ':', '|', '#', ' ', '\t', '.', '_']) + line[pos:]
+        lines.append(line)
+        size += len(line) + 1
+    return '\n'.join(lines)
+
+
+def generate(family, size, seed):
+    """生成某类输入，family 为 'random' 时随机拼接片段"""
+    rng = random.Random(seed)
+    if family == 'random':
+        return generate_random(size, rng)
+    return FAMILIES[family](size, rng)
+
+
+def load_module(path):
+    """按文件路径加载一个版本的 PtoM 模块"""
+    spec = importlib.util.spec_from_file_location('ptom_fuzz_target', path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def run_child(module_path, md_path, similarity_window):
+    """子进程入口：完整优化一次并输出耗时"""
+    module = load_module(module_path)
+    with open(md_path, encoding='utf-8') as f:
+        content = f.read()
+    optimizer = module.MarkdownOptimizer(similarity_window=int(similarity_window) or None)
+    start = time.perf_counter()
+    optimizer.optimize(content)
+    print(f"{time.perf_counter() - start:.4f}")
+
+
+def time_optimize(module_path, content, timeout, similarity_window):
+    """在子进程中优化 content，返回耗时（秒），超时返回 None"""
+    fd, md_path = tempfile.mkstemp(prefix='ptom_fuzz_', suffix='.md')
+    with os.fdopen(fd, 'w', encoding='utf-8') as f:
+        f.write(content)
+    try:
+        output = subprocess.check_output(
+            [sys.executable, os.path.abspath(__file__), '--child', module_path, md_path, str(similarity_window)],
+            text=True, timeout=timeout,
+        )
+        return float(output.split()[-1])
+    except subprocess.TimeoutExpired:
+        return None
+    finally:
+        os.remove(md_path)
+
+
+def per_kb_ms(seconds, content):
+    """单位耗时（毫秒/KB）"""
+    return seconds * 1000 / max(1.0, len(content.encode('utf-8')) / 1024)
+
+
+def check_scaling(name, make, args):
+    """按 size、size*scale、... 依次测试，返回失败原因列表"""
+    failures = []
+    previous = None
+    row = []
+    for step in range(args.steps):
+        content = make(args.size_kb * 1024 * args.scale ** step)
+        seconds = time_optimize(args.module, content, args.timeout, args.similarity_window)
+        if seconds is None:
+            row.append(f"{len(content) // 1024}K:超时")
+            failures.append(f"{name}: {len(content) // 1024}KB 超过 {args.timeout}s")
+            break
+        row.append(f"{len(content) // 1024}K:{seconds:.2f}s")
+        if per_kb_ms(seconds, content) > args.max_ms_per_kb:
+            failures.append(f"{name}: {len(content) // 1024}KB 耗时 {per_kb_ms(seconds, content):.1f}ms/KB")
+        # 太短的耗时受计时噪声影响，不参与增长倍数判断
+        if previous and max(seconds, previous) >= args.min_seconds:
+            ratio = seconds / max(previous, 1e-3)
+            if ratio > args.scale * args.slack:
+                failures.append(f"{name}: 输入放大{args.scale}倍，耗时增长{ratio:.1f}倍")
+        previous = seconds
+    print(f"{name:<18}" + ' '.join(row), flush=True)
+    return failures
+
+
+def run_fixtures(args):
+    """只运行已记录的回归样本，检查单位耗时"""
+    paths = sorted(glob.glob(os.path.join(FIXTURE_DIR, '*.md')))
+    if not paths:
+        print(f"没有回归样本: {FIXTURE_DIR}")
+        return []
+    failures = []
+    for path in paths:
+        with open(path, encoding='utf-8') as f:
+            content = f.read()
+        name = os.path.basename(path)
+        seconds = time_optimize(args.module, content, args.timeout, args.similarity_window)
+        if seconds is None:
+            print(f"{name:<28}超时")
+            failures.append(f"{name}: 超过 {args.timeout}s")
+            continue
+        cost = per_kb_ms(seconds, content)
+        print(f"{name:<28}{len(content) // 1024:>6}K {seconds:>8.3f}s {cost:>8.2f}ms/KB")
+        if cost > args.max_ms_per_kb:
+            failures.append(f"{name}: 耗时 {cost:.1f}ms/KB")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description='PtoM Markdown优化器最坏情况性能测试')
+    parser.add_argument('--size-kb', type=int, default=16, help='最小输入大小（KB）')
+    parser.add_argument('--scale', type=int, default=4, help='每一步输入放大的倍数')
+    parser.add_argument('--steps', type=int, default=3, help='每类输入测试的大小个数')
+    parser.add_argument('--slack', type=float, default=2.5, help='允许耗时增长超过放大倍数的比例')
+    parser.add_argument('--min-seconds', type=float, default=0.2, help='耗时低于该值时不判断增长倍数')
+    parser.add_argument('--max-ms-per-kb', type=float, default=100.0, help='单位耗时上限（毫秒/KB）')
+    parser.add_argument('--timeout', type=float, default=120.0, help='单次优化的超时时间（秒）')
+    parser.add_argument('--families', help='只测试指定的输入类别（逗号分隔）')
+    parser.add_argument('--random', type=int, default=20, help='随机拼接输入的个数')
+    parser.add_argument('--seed', type=int, default=0, help='随机输入的起始种子')
+    parser.add_argument('--record', type=int, default=0, metavar='N',
+                        help='把单位耗时最高的N个随机输入写入 benchmarks/fixtures/')
+    parser.add_argument('--fixtures', action='store_true', help='只运行已记录的回归样本')
+    parser.add_argument('--similarity-window', type=int, default=200, metavar='N',
+                        help='段落去重的相似度窗口（默认200，0表示与全部段落比较）')
+    parser.add_argument('--module', default=os.path.join(ROOT, 'PtoM.py'), help='被测试的 PtoM.py')
+    parser.add_argument('--child', nargs=3, metavar=('MODULE', 'MARKDOWN', 'WINDOW'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(*args.child)
+        return
+    args.module = os.path.abspath(args.module)
+
+    if args.fixtures:
+        failures = run_fixtures(args)
+    else:
+        families = args.families.split(',') if args.families else list(FAMILIES)
+        failures = []
+        for family in families:
+            failures.extend(check_scaling(family, lambda size, family=family: generate(family, size, 0), args))
+
+        # 随机输入：先在最小大小上找出单位耗时最高的样本，再检查它们的增长
+        samples = []
+        for seed in range(args.seed, args.seed + args.random):
+            content = generate('random', args.size_kb * 1024, seed)
+            seconds = time_optimize(args.module, content, args.timeout, args.similarity_window)
+            cost = float('inf') if seconds is None else per_kb_ms(seconds, content)
+            samples.append((cost, seed, content))
+        samples.sort(key=lambda sample: sample[0], reverse=True)
+        for cost, seed, _ in samples[:3]:
+            failures.extend(check_scaling(f"random:{seed}", lambda size, seed=seed: generate('random', size, seed), args))
+
+        if args.record:
+            os.makedirs(FIXTURE_DIR, exist_ok=True)
+            for cost, seed, content in samples[:args.record]:
+                path = os.path.join(FIXTURE_DIR, f"random-{seed}.md")
+                with open(path, 'w', encoding='utf-8') as f:
+                    f.write(content)
+                print(f"已记录回归样本: {path} ({cost:.2f}ms/KB)")
+
+    if failures:
+        print("失败:")
+        for failure in failures:
+            print(f"  {failure}")
+        sys.exit(1)
+    print("全部通过")
+
+
+if __name__ == '__main__':
+    main()
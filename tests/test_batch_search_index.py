@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+"""批量模式的全文检索索引：工作进程发回页面数据，主进程写入的记录与单文件转换一致"""
+
+import os
+import sqlite3
+import sys
+
+import pytest
+
+fitz = pytest.importorskip('fitz')
+pytest.importorskip('pdfplumber')
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import PtoM  # noqa: E402
+
+
+def make_pdf(path, title, pages=2):
+    """生成每页带标题和一段正文的PDF"""
+    doc = fitz.open()
+    for num in range(1, pages + 1):
+        page = doc.new_page()
+        page.insert_text((72, 72), f"{num}.1 {title} section", fontsize=12)
+        page.insert_text((72, 100), f"{title} body text on page {num}", fontsize=10)
+    doc.save(path)
+    doc.close()
+
+
+def index_records(db_path, document):
+    with sqlite3.connect(db_path) as conn:
+        return conn.execute("SELECT page, heading, text FROM pages WHERE document = ? ORDER BY rowid",
+                            (document,)).fetchall()
+
+
+def test_batch_search_index(tmp_path):
+    jobs = []
+    for name in ('alpha', 'beta'):
+        pdf_path = str(tmp_path / f'{name}.pdf')
+        make_pdf(pdf_path, name)
+        jobs.append((pdf_path, str(tmp_path / 'out' / f'{name}.md')))
+    os.makedirs(tmp_path / 'out')
+
+    db_path = str(tmp_path / 'batch.db')
+    batch = PtoM.BatchConverter(max_workers=2, memory_limit_mb=None, search_index=db_path)
+    results = batch.run(jobs)
+    assert [result['status'] for result in results] == ['ok', 'ok']
+
+    expected_db = str(tmp_path / 'single.db')
+    writer = PtoM.SearchIndexWriter(expected_db)
+    for pdf_path, output_file in jobs:
+        writer.add_pages(output_file, PtoM.convert_document(pdf_path, output_file))
+    writer.close()
+
+    assert batch.index_records == writer.records > 0
+    for _, output_file in jobs:
+        assert index_records(db_path, output_file) == index_records(expected_db, output_file)
@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+"""检查点续转：跨页表格在断点处继续时，结果与不中断的转换一致"""
+
+import os
+import sys
+
+import pytest
+
+fitz = pytest.importorskip('fitz')
+pytest.importorskip('pdfplumber')
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import PtoM  # noqa: E402
+
+
+def make_table_pdf(path, pages=4, rows_per_page=20):
+    """生成一个从第一页延续到最后一页的三列表格，每页重复表头"""
+    doc = fitz.open()
+    n = 0
+    for _ in range(pages):
+        page = doc.new_page()
+        rows = [("Item", "Qty", "Price")] + [None] * rows_per_page
+        height = 760 / len(rows)
+        for r, row in enumerate(rows):
+            if row is None:
+                n += 1
+                row = (f"item{n}", str(n * 3), f"{n * 1.5:.2f}")
+            for c, cell in enumerate(row):
+                rect = fitz.Rect(72 + c * 150, 40 + r * height, 222 + c * 150, 40 + (r + 1) * height)
+                page.draw_rect(rect, color=(0, 0, 0), width=0.5)
+                page.insert_text((rect.x0 + 3, rect.y1 - 4), cell, fontsize=8)
+    doc.save(path)
+    doc.close()
+
+
+class InterruptingJournal(PtoM.ConversionJournal):
+    """写入指定页数后模拟进程中断"""
+
+    def __init__(self, *args, stop_after, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.stop_after = stop_after
+
+    def append(self, page):
+        super().append(page)
+        if page.page_num == self.stop_after:
+            raise KeyboardInterrupt
+
+
+@pytest.mark.parametrize('engine', PtoM.PDFToMarkdownConverter.ENGINES)
+def test_resume_inside_continued_table(tmp_path, engine):
+    pdf_path = str(tmp_path / 'table.pdf')
+    output_file = str(tmp_path / 'table.md')
+    journal_path = str(tmp_path / 'table.journal')
+    make_table_pdf(pdf_path)
+
+    def converter():
+        return PtoM.PDFToMarkdownConverter(engine=engine, progress=PtoM.ProgressReporter('quiet'))
+
+    expected = converter().convert_pages(pdf_path, output_file)
+    assert [page.table_continued for page in expected] == [False, True, True, True]
+
+    journal = InterruptingJournal(journal_path, pdf_path, engine=engine, stop_after=2)
+    with pytest.raises(KeyboardInterrupt):
+        converter().convert_pages(pdf_path, output_file, journal=journal)
+    journal.close()
+
+    journal = PtoM.ConversionJournal(journal_path, pdf_path, engine=engine)
+    resumed = converter().convert_pages(pdf_path, output_file, journal=journal)
+    journal.close()
+
+    assert [page.table_continued for page in resumed] == [False, True, True, True]
+    renderer = PtoM.MarkdownRenderer()
+    assert renderer.render(resumed) == renderer.render(expected)
+
+
+def test_changed_options_start_over(tmp_path):
+    pdf_path = str(tmp_path / 'table.pdf')
+    output_file = str(tmp_path / 'table.md')
+    journal_path = str(tmp_path / 'table.journal')
+    make_table_pdf(pdf_path)
+    progress = PtoM.ProgressReporter('quiet')
+
+    converter = PtoM.PDFToMarkdownConverter(progress=progress)
+    journal = InterruptingJournal(journal_path, pdf_path, options=converter.output_options(), stop_after=2)
+    with pytest.raises(KeyboardInterrupt):
+        converter.convert_pages(pdf_path, output_file, journal=journal)
+    journal.close()
+
+    converter = PtoM.PDFToMarkdownConverter(progress=progress)
+    journal = PtoM.ConversionJournal(journal_path, pdf_path, options=converter.output_options())
+    assert [page.page_num for page in journal.load()] == [1, 2]
+    journal.close()
+
+    converter = PtoM.PDFToMarkdownConverter(progress=progress, strip_headers=True)
+    journal = PtoM.ConversionJournal(journal_path, pdf_path, options=converter.output_options())
+    assert journal.load() == []
+    journal.close()
@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+"""段落去重：默认与全部已保留段落比较相似度，相似度窗口需要显式开启"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import PtoM  # noqa: E402
+
+
+def make_document(gap):
+    """一个段落，相隔 gap 个互不相似的段落后出现它的近似重复"""
+    paragraphs = ['the quick brown fox jumps over the lazy dog near the river bank']
+    paragraphs += [f'paragraph {i} ' + chr(0x4e00 + i) * 30 for i in range(gap)]
+    paragraphs.append('the quick brown fox jumps over the lazy dog near the river bend')
+    return '\n\n'.join(paragraphs)
+
+
+def test_default_compares_all_paragraphs():
+    content = make_document(PtoM.MarkdownOptimizer.SIMILARITY_WINDOW + 50)
+    result = PtoM.MarkdownOptimizer().optimize(content)
+    assert 'river bank' in result
+    assert 'river bend' not in result
+
+
+def test_window_is_opt_in():
+    window = PtoM.MarkdownOptimizer.SIMILARITY_WINDOW
+    far = PtoM.MarkdownOptimizer(similarity_window=window).optimize(make_document(window + 50))
+    assert 'river bend' in far
+    near = PtoM.MarkdownOptimizer(similarity_window=window).optimize(make_document(10))
+    assert 'river bend' not in near
@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+"""表格提取：两个解析引擎对多行单元格的输出一致，每个表格行只占一行"""
+
+import os
+import sys
+
+import pytest
+
+fitz = pytest.importorskip('fitz')
+pytest.importorskip('pdfplumber')
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import PtoM  # noqa: E402
+
+
+def make_multiline_pdf(path):
+    """生成一个第二列单元格有两行文字的表格"""
+    doc = fitz.open()
+    page = doc.new_page()
+    for r in range(4):
+        for c in range(3):
+            rect = fitz.Rect(72 + c * 150, 80 + r * 40, 222 + c * 150, 120 + r * 40)
+            page.draw_rect(rect, color=(0, 0, 0), width=0.5)
+            page.insert_text((rect.x0 + 3, rect.y0 + 12), f"v{r} {c}", fontsize=9)
+            if c == 1:
+                page.insert_text((rect.x0 + 3, rect.y0 + 26), "_", fontsize=9)
+    doc.save(path)
+    doc.close()
+
+
+def test_multiline_cells(tmp_path):
+    pdf_path = str(tmp_path / 'cells.pdf')
+    make_multiline_pdf(pdf_path)
+    tables = {}
+    for engine in PtoM.PDFToMarkdownConverter.ENGINES:
+        converter = PtoM.PDFToMarkdownConverter(engine=engine, progress=PtoM.ProgressReporter('quiet'))
+        pages = converter.convert_pages(pdf_path, str(tmp_path / f'{engine}.md'))
+        tables[engine] = pages[0].tables
+    assert tables['pdfplumber'] == tables['pymupdf']
+    assert tables['pymupdf'][0][0] == ['v0 0', 'v0 1 _', 'v0 2']